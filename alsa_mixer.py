@@ -0,0 +1,215 @@
+import ctypes
+import ctypes.util
+import logging
+import math
+import select
+
+# What libasound reports as the bottom of a range that reaches silence.
+DB_GAIN_MUTE = -9999999
+# Ranges up to this wide (in dB) are mapped linearly; wider ones follow the
+# ear. Both as in alsa-utils, so percentages agree with `amixer -M`.
+MAX_LINEAR_DB_SCALE = 24
+CHANNEL = 0  # SND_MIXER_SCHN_FRONT_LEFT, which is also MONO
+
+
+class MixerError(Exception):
+    """The control could not be opened, read or set"""
+
+
+class _PollFd(ctypes.Structure):
+    _fields_ = [("fd", ctypes.c_int), ("events", ctypes.c_short),
+                ("revents", ctypes.c_short)]
+
+
+def _load_libasound():
+    path = ctypes.util.find_library("asound")
+    if not path:
+        raise MixerError("libasound is not installed")
+    lib = ctypes.CDLL(path)
+
+    handle, elem = ctypes.c_void_p, ctypes.c_void_p
+    long_p = ctypes.POINTER(ctypes.c_long)
+    for name, argtypes in {
+            "snd_mixer_open": [ctypes.POINTER(handle), ctypes.c_int],
+            "snd_mixer_attach": [handle, ctypes.c_char_p],
+            "snd_mixer_selem_register": [handle, ctypes.c_void_p,
+                                         ctypes.c_void_p],
+            "snd_mixer_load": [handle],
+            "snd_mixer_close": [handle],
+            "snd_mixer_handle_events": [handle],
+            "snd_mixer_poll_descriptors_count": [handle],
+            "snd_mixer_poll_descriptors": [handle, ctypes.POINTER(_PollFd),
+                                           ctypes.c_uint],
+            "snd_mixer_selem_id_malloc": [ctypes.POINTER(ctypes.c_void_p)],
+            "snd_mixer_selem_id_free": [ctypes.c_void_p],
+            "snd_mixer_selem_id_set_index": [ctypes.c_void_p, ctypes.c_uint],
+            "snd_mixer_selem_id_set_name": [ctypes.c_void_p, ctypes.c_char_p],
+            "snd_mixer_selem_get_playback_dB_range": [elem, long_p, long_p],
+            "snd_mixer_selem_get_playback_dB": [elem, ctypes.c_int, long_p],
+            "snd_mixer_selem_set_playback_dB_all": [elem, ctypes.c_long,
+                                                    ctypes.c_int],
+            "snd_mixer_selem_get_playback_volume_range": [elem, long_p,
+                                                          long_p],
+            "snd_mixer_selem_get_playback_volume": [elem, ctypes.c_int,
+                                                    long_p],
+            "snd_mixer_selem_set_playback_volume_all": [elem,
+                                                        ctypes.c_long],
+            "snd_strerror": [ctypes.c_int]}.items():
+        function = getattr(lib, name)
+        function.argtypes = argtypes
+        function.restype = ctypes.c_int
+    lib.snd_mixer_find_selem.argtypes = [handle, ctypes.c_void_p]
+    lib.snd_mixer_find_selem.restype = elem
+    lib.snd_strerror.restype = ctypes.c_char_p
+    return lib
+
+
+class AlsaMixer:
+    """One ALSA simple control, held open for the life of the process
+
+    Replaces two amixer forks per volume press. Reads are served from
+    libasound's copy of the control, which it keeps current from the
+    driver's change events - so a change made elsewhere, spotifyd's volume
+    for one, is picked up without asking the driver each time.
+
+    Volumes are percentages on amixer's -M scale rather than raw steps, as
+    before: on most Pi outputs raw steps are linear in dB, so equal steps
+    sound nothing like equal.
+    """
+
+    def __init__(self, control, card="default"):
+        self.control = control
+        self._lib = _load_libasound()
+        self._handle = ctypes.c_void_p()
+        self._check(self._lib.snd_mixer_open(ctypes.byref(self._handle), 0),
+                    "open the mixer")
+        try:
+            self._check(self._lib.snd_mixer_attach(self._handle,
+                                                   card.encode()),
+                        f"attach to {card}")
+            self._check(self._lib.snd_mixer_selem_register(self._handle,
+                                                           None, None),
+                        "register simple controls")
+            self._check(self._lib.snd_mixer_load(self._handle),
+                        "load the controls")
+            self._elem = self._find(control)
+            self._poll = self._poller()
+            self._db_range = self._range(
+                self._lib.snd_mixer_selem_get_playback_dB_range)
+        except MixerError:
+            self.close()
+            raise
+
+    def _check(self, result, action):
+        if result < 0:
+            reason = self._lib.snd_strerror(result).decode()
+            raise MixerError(f"Could not {action}: {reason}")
+        return result
+
+    def _find(self, control):
+        sid = ctypes.c_void_p()
+        self._check(self._lib.snd_mixer_selem_id_malloc(ctypes.byref(sid)),
+                    "allocate a control id")
+        try:
+            self._lib.snd_mixer_selem_id_set_index(sid, 0)
+            self._lib.snd_mixer_selem_id_set_name(sid, control.encode())
+            elem = self._lib.snd_mixer_find_selem(self._handle, sid)
+        finally:
+            self._lib.snd_mixer_selem_id_free(sid)
+        if not elem:
+            raise MixerError(f"No ALSA control named {control!r}")
+        return elem
+
+    def _poller(self):
+        count = self._lib.snd_mixer_poll_descriptors_count(self._handle)
+        fds = (_PollFd * max(count, 0))()
+        filled = self._check(self._lib.snd_mixer_poll_descriptors(
+            self._handle, fds, count), "get the event descriptors")
+        poller = select.poll()
+        for fd in fds[:filled]:
+            poller.register(fd.fd, fd.events)
+        return poller
+
+    def _range(self, getter):
+        low, high = ctypes.c_long(), ctypes.c_long()
+        if getter(self._elem, ctypes.byref(low), ctypes.byref(high)) < 0:
+            return None
+        if low.value >= high.value:
+            return None
+        return low.value, high.value
+
+    def _catch_up(self):
+        """Apply pending change events, without waiting for any"""
+        if self._poll.poll(0):
+            self._check(self._lib.snd_mixer_handle_events(self._handle),
+                        "read mixer events")
+
+    def volume(self):
+        """The current volume as a percentage"""
+        self._catch_up()
+        value = ctypes.c_long()
+        if self._db_range is None:
+            low, high = self._raw_range()
+            self._check(self._lib.snd_mixer_selem_get_playback_volume(
+                self._elem, CHANNEL, ctypes.byref(value)), "read the volume")
+            return round(100 * (value.value - low) / (high - low))
+
+        self._check(self._lib.snd_mixer_selem_get_playback_dB(
+            self._elem, CHANNEL, ctypes.byref(value)), "read the volume")
+        return round(100 * db_to_fraction(value.value, *self._db_range))
+
+    def set_volume(self, percent):
+        fraction = max(0, min(100, percent)) / 100
+        if self._db_range is None:
+            low, high = self._raw_range()
+            self._check(self._lib.snd_mixer_selem_set_playback_volume_all(
+                self._elem, low + round(fraction * (high - low))),
+                "set the volume")
+            return
+
+        self._check(self._lib.snd_mixer_selem_set_playback_dB_all(
+            self._elem, fraction_to_db(fraction, *self._db_range), 0),
+            "set the volume")
+
+    def _raw_range(self):
+        raw = self._range(self._lib.snd_mixer_selem_get_playback_volume_range)
+        if raw is None:
+            raise MixerError(f"{self.control!r} has no volume range")
+        return raw
+
+    def close(self):
+        if self._handle:
+            self._lib.snd_mixer_close(self._handle)
+            self._handle = ctypes.c_void_p()
+
+
+# The -M mapping, in hundredths of a dB as libasound counts them.
+
+def db_to_fraction(value, low, high):
+    if high - low <= MAX_LINEAR_DB_SCALE * 100:
+        return (value - low) / (high - low)
+    fraction = 10 ** ((value - high) / 6000)
+    if low != DB_GAIN_MUTE:
+        floor = 10 ** ((low - high) / 6000)
+        fraction = (fraction - floor) / (1 - floor)
+    return max(0.0, fraction)
+
+
+def fraction_to_db(fraction, low, high):
+    if high - low <= MAX_LINEAR_DB_SCALE * 100:
+        return round(fraction * (high - low)) + low
+    if low != DB_GAIN_MUTE:
+        floor = 10 ** ((low - high) / 6000)
+        fraction = fraction * (1 - floor) + floor
+    if fraction <= 0:
+        return low
+    return round(6000 * math.log10(fraction)) + high
+
+
+def open_mixer(control):
+    """An AlsaMixer for `control`, or None where one cannot be had"""
+    try:
+        return AlsaMixer(control)
+    except (MixerError, OSError) as e:
+        logging.warning("No direct mixer access (%s); using amixer", e)
+        return None
@@ -0,0 +1,115 @@
+import ctypes
+import ctypes.util
+import logging
+import sys
+
+SND_PCM_STREAM_PLAYBACK = 0
+SND_PCM_NONBLOCK = 1
+SND_PCM_ACCESS_RW_INTERLEAVED = 3
+# S16_LE and S16_BE: samples go out in the machine's own byte order.
+SND_PCM_FORMAT_S16 = 2 if sys.byteorder == "little" else 3
+
+
+class PcmError(Exception):
+    """The PCM could not be opened or written"""
+
+
+def _load_libasound():
+    path = ctypes.util.find_library("asound")
+    if not path:
+        raise PcmError("libasound is not installed")
+    lib = ctypes.CDLL(path)
+
+    handle = ctypes.c_void_p
+    for name, argtypes in {
+            "snd_pcm_open": [ctypes.POINTER(handle), ctypes.c_char_p,
+                             ctypes.c_int, ctypes.c_int],
+            "snd_pcm_set_params": [handle, ctypes.c_int, ctypes.c_int,
+                                   ctypes.c_uint, ctypes.c_uint,
+                                   ctypes.c_int, ctypes.c_uint],
+            "snd_pcm_recover": [handle, ctypes.c_int, ctypes.c_int],
+            "snd_pcm_drain": [handle],
+            "snd_pcm_close": [handle],
+            "snd_strerror": [ctypes.c_int]}.items():
+        function = getattr(lib, name)
+        function.argtypes = argtypes
+        function.restype = ctypes.c_int
+    lib.snd_pcm_writei.argtypes = [handle, ctypes.c_void_p, ctypes.c_ulong]
+    lib.snd_pcm_writei.restype = ctypes.c_long
+    lib.snd_strerror.restype = ctypes.c_char_p
+    return lib
+
+
+class AlsaPcm:
+    """A mono 16-bit playback stream on an ALSA device, through libasound
+
+    What aplay did for the sound engine, without the fork, the exec and the
+    pipe in between. Writes block while the device's buffer is full, which
+    `latency` (microseconds) keeps short.
+
+    `shared` records whether the device can be opened again while this
+    stream holds it - measured at open, by trying. It can behind dmix, and
+    MPD and spotifyd then play alongside us; it cannot on a bare hw device,
+    where holding the stream would lock them out.
+    """
+
+    def __init__(self, rate, device="default", latency=50000):
+        self.device = device
+        self._lib = _load_libasound()
+        self._handle = self._open(0)
+        try:
+            self._check(self._lib.snd_pcm_set_params(
+                self._handle, SND_PCM_FORMAT_S16,
+                SND_PCM_ACCESS_RW_INTERLEAVED, 1, rate, 1, latency),
+                f"configure {device}")
+        except PcmError:
+            self.close()
+            raise
+        self.shared = self._can_open_again()
+
+    def _check(self, result, action):
+        if result < 0:
+            reason = self._lib.snd_strerror(result).decode()
+            raise PcmError(f"Could not {action}: {reason}")
+        return result
+
+    def _open(self, mode):
+        handle = ctypes.c_void_p()
+        self._check(self._lib.snd_pcm_open(
+            ctypes.byref(handle), self.device.encode(),
+            SND_PCM_STREAM_PLAYBACK, mode), f"open {self.device}")
+        return handle
+
+    def _can_open_again(self):
+        # Non-blocking, so an exclusive device answers EBUSY at once rather
+        # than waiting for us to let go.
+        try:
+            other = self._open(SND_PCM_NONBLOCK)
+        except PcmError as e:
+            logging.debug("%s is not shared: %s", self.device, e)
+            return False
+        self._lib.snd_pcm_close(other)
+        return True
+
+    def write(self, samples):
+        """Play an array of 16-bit samples, waiting for room as need be"""
+        # Straight from the array's memory: no copy per period.
+        address, frames = samples.buffer_info()
+        written = 0
+        while written < frames:
+            result = self._lib.snd_pcm_writei(
+                self._handle, address + samples.itemsize * written,
+                frames - written)
+            if result < 0:
+                # Chiefly the underrun (EPIPE) of a stream left idle between
+                # clips, which recover() restarts it from.
+                self._check(self._lib.snd_pcm_recover(self._handle, result, 1),
+                            "recover the stream")
+                continue
+            written += result
+
+    def close(self):
+        if self._handle:
+            self._lib.snd_pcm_drain(self._handle)
+            self._lib.snd_pcm_close(self._handle)
+            self._handle = ctypes.c_void_p()
@@ -0,0 +1,93 @@
+import logging
+import os
+import random
+import time
+
+
+class Backoff:
+    """When to try again: a short first retry, growing, jittered, bounded
+
+    A fixed delay is wrong at both ends. A spotifyd that is ready after 200ms
+    still waited a whole second, while one slow to register after boot got
+    asked once a second for as long as the budget lasted. Starting small and
+    doubling serves the quick case quickly and leaves the slow one alone.
+
+    Jitter keeps retries from falling into step with whatever they are
+    waiting on - or, for the sync API, with every other device on it.
+
+    Bounded by whichever runs out first: max_attempts, or deadline seconds
+    since the first attempt. Both are optional, but a policy with neither
+    retries forever.
+    """
+
+    def __init__(self, first=0.2, factor=2, max_delay=2, jitter=0.2,
+                 deadline=None, max_attempts=None):
+        self.first = first
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_env(cls, name, **defaults):
+        """A policy whose bounds can be overridden from the environment
+
+        Reads <name>_RETRY_FIRST, <name>_RETRY_MAX, <name>_RETRY_DEADLINE and
+        <name>_RETRY_ATTEMPTS. A value that does not parse is reported and
+        ignored, rather than stopping the service over a tuning knob.
+        """
+        settings = dict(defaults)
+        for suffix, key, parse in (("FIRST", "first", float),
+                                   ("MAX", "max_delay", float),
+                                   ("DEADLINE", "deadline", float),
+                                   ("ATTEMPTS", "max_attempts", int)):
+            variable = f"{name}_RETRY_{suffix}"
+            raw = os.environ.get(variable, "").strip()
+            if not raw:
+                continue
+            try:
+                settings[key] = parse(raw)
+            except ValueError:
+                logging.warning("Ignoring %s=%r: not a number", variable, raw)
+        return cls(**settings)
+
+    def replace(self, **changes):
+        """A copy with some settings changed"""
+        settings = dict(vars(self))
+        settings.update(changes)
+        return Backoff(**settings)
+
+    def delay(self, retry):
+        """Seconds to wait before retry number `retry`, counting from 1"""
+        delay = min(self.max_delay, self.first * self.factor ** (retry - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def attempts(self):
+        """Yield 0, 1, 2, ... - one per attempt - sleeping in between
+
+        The caller breaks out on success. Never sleeps after the last attempt:
+        nothing follows it to wait for.
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            yield attempt
+            attempt += 1
+            if self.max_attempts is not None and attempt >= self.max_attempts:
+                return
+
+            delay = self.delay(attempt)
+            if self.deadline is not None:
+                remaining = self.deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    return
+                delay = min(delay, remaining)
+
+            logging.debug("Retrying in %.2fs", delay)
+            time.sleep(delay)
+
+    def __repr__(self):
+        return (f"Backoff(first={self.first}, factor={self.factor}, "
+                f"max_delay={self.max_delay}, jitter={self.jitter}, "
+                f"deadline={self.deadline}, max_attempts={self.max_attempts})")
@@ -2,12 +2,13 @@ import logging
 import os
 import re
 import socket
-import sqlite3
 import subprocess
 import threading
 import time
 
+import database
 import utils
+from alsa_mixer import MixerError, open_mixer
 
 try:
     from gpiozero import Button
@@ -44,8 +45,16 @@ class PlayerActionHandler:
         # Detected once: the control does not change while we run, and probing
         # on every keypress would add a subprocess to each one.
         self.mixer_control = self._detect_mixer_control()
+        self.mixer = None
         if self.mixer_control:
             logging.info("Volume control: ALSA '%s'", self.mixer_control)
+            self.mixer = open_mixer(self.mixer_control)
+
+        # Volume changes are applied by a worker, so a held key never waits
+        # on the mixer. _volume_pending is the target it has yet to reach.
+        self.volume_lock = threading.Condition()
+        self._volume_pending = None
+        self._volume_worker = None
 
         # Map action names to handler methods
         self.action_map = {
@@ -198,6 +207,12 @@ class PlayerActionHandler:
         """Current mixer volume as a percentage, or None if unreadable"""
         if not self.mixer_control:
             return None
+        if self.mixer:
+            try:
+                return self.mixer.volume()
+            except MixerError as e:
+                logging.error("Could not read the volume: %s", e)
+                return None
         try:
             output = subprocess.run(
                 ["amixer", "-M", "get", self.mixer_control],
@@ -208,37 +223,86 @@ class PlayerActionHandler:
             logging.error("Could not read the volume: %s", e)
             return None
 
-    def _set_volume(self, change):
-        """Nudge the mixer by `change` percent, clamped to VOLUME_MAX"""
-        current = self._current_volume()
-        if current is None:
-            utils.play_sound("error")
-            return
-
-        # Refuse rather than clamp when already past an end stop. Clamping was
-        # worse than doing nothing: spotifyd sets initial_volume to 100, so a
-        # volume-*up* press at 100% would have pulled it down to VOLUME_MAX.
-        if change > 0 and current >= self.VOLUME_MAX:
-            utils.play_sound("error")
-            return
-        if change < 0 and current <= 0:
-            utils.play_sound("error")
-            return
-
-        target = max(0, min(self.VOLUME_MAX, current + change))
-        if target == current:
-            utils.play_sound("error")
-            return
-
+    def _write_volume(self, target):
+        """Set the mixer to `target` percent; False if that failed"""
         try:
-            subprocess.run(
-                ["amixer", "-M", "-q", "set", self.mixer_control, f"{target}%"],
-                check=True, timeout=5)
-            logging.info("Volume %d%% -> %d%% (%s)",
-                         current, target, self.mixer_control)
-        except (OSError, subprocess.SubprocessError) as e:
+            if self.mixer:
+                self.mixer.set_volume(target)
+            else:
+                subprocess.run(
+                    ["amixer", "-M", "-q", "set", self.mixer_control,
+                     f"{target}%"],
+                    check=True, timeout=5)
+            logging.info("Volume -> %d%% (%s)", target, self.mixer_control)
+            return True
+        except (MixerError, OSError, subprocess.SubprocessError) as e:
             logging.error("Could not set the volume: %s", e)
-            utils.play_sound("error")
+            return False
+
+    def _set_volume(self, change):
+        """Nudge the mixer by `change` percent, clamped to VOLUME_MAX
+
+        Returns without waiting for the mixer. A held IR key sends a repeat
+        frame every ~100ms; a press that arrives while an earlier one is
+        still being applied moves the pending target instead, so a burst of
+        frames coalesces into as few mixer writes as the mixer can take.
+        """
+        with self.volume_lock:
+            current = self._volume_pending
+            if current is None:
+                current = self._current_volume()
+            if current is None:
+                utils.play_sound("error")
+                return
+
+            # Refuse rather than clamp when already past an end stop.
+            # Clamping was worse than doing nothing: spotifyd sets
+            # initial_volume to 100, so a volume-*up* press at 100% would
+            # have pulled it down to VOLUME_MAX.
+            if change > 0 and current >= self.VOLUME_MAX:
+                utils.play_sound("error")
+                return
+            if change < 0 and current <= 0:
+                utils.play_sound("error")
+                return
+
+            target = max(0, min(self.VOLUME_MAX, current + change))
+            if target == current:
+                utils.play_sound("error")
+                return
+
+            self._volume_pending = target
+            if self._volume_worker is None:
+                self._volume_worker = threading.Thread(
+                    target=self._apply_volume, name="volume", daemon=True)
+                self._volume_worker.start()
+            self.volume_lock.notify_all()
+
+    def _apply_volume(self):
+        """Worker: bring the mixer to the latest pending target"""
+        while True:
+            with self.volume_lock:
+                while self._volume_pending is None:
+                    self.volume_lock.wait()
+                target = self._volume_pending
+
+            written = self._write_volume(target)
+
+            with self.volume_lock:
+                # Presses that came in meanwhile moved the target on; leave
+                # it for the next round. A failure drops it altogether,
+                # rather than retrying forever against a broken mixer.
+                if self._volume_pending == target or not written:
+                    self._volume_pending = None
+                self.volume_lock.notify_all()
+            if not written:
+                utils.play_sound("error")
+
+    def _wait_for_volume(self, timeout=5):
+        """Block until no volume change is pending; True if none is"""
+        with self.volume_lock:
+            return self.volume_lock.wait_for(
+                lambda: self._volume_pending is None, timeout)
 
     def _handle_volume_up(self):
         utils.play_sound("volume_up")
@@ -250,7 +314,7 @@ class PlayerActionHandler:
 
     def _create_and_play_last_player(self):
         try:
-            with sqlite3.connect(self.database_url) as db:
+            with database.connect(self.database_url) as db:
                 music_data = utils.get_music_data(
                     db, utils.get_last_played_rfid(db))
                 if not music_data:
@@ -0,0 +1,156 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import db_setup
+
+# Statements that need the write lock, and so open a transaction.
+_WRITES = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """Times each statement, and the wait for the write lock separately"""
+
+    def execute(self, sql, parameters=()):
+        self._begin_if_writing(sql)
+        started = time.monotonic()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.record_query(sql, time.monotonic() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin_if_writing(sql)
+        started = time.monotonic()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.record_query(sql, time.monotonic() - started)
+
+    def _begin_if_writing(self, sql):
+        # What sqlite3 would do implicitly, but IMMEDIATE and on its own: the
+        # write lock is taken here and nowhere else, so the time this takes
+        # is exactly the time spent waiting for another thread's write.
+        if self.connection.in_transaction or not _WRITES.match(sql):
+            return
+        started = time.monotonic()
+        super().execute("BEGIN IMMEDIATE")
+        self.connection.record_lock_wait(time.monotonic() - started)
+
+
+class _Connection(sqlite3.Connection):
+    # Set once the connection is configured; until then nothing is recorded.
+    database = None
+
+    def record_query(self, sql, seconds):
+        if self.database:
+            self.database.record_query(sql, seconds)
+
+    def record_lock_wait(self, seconds):
+        if self.database:
+            self.database.record_lock_wait(seconds)
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3's own shortcuts build a plain cursor, bypassing cursor().
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class Database:
+    """One connection per thread, reused, with its timings kept
+
+    Every caller used to open its own connection and close it again: a new
+    file handle, the schema parsed afresh and an empty statement cache each
+    time. Here each thread keeps the connection it first asks for, so its
+    prepared statements stay prepared.
+
+    Connections run in sqlite3's autocommit mode and open transactions
+    themselves, with BEGIN IMMEDIATE before the first write - otherwise
+    as sqlite3 does by default, so `with db:` and db.commit() behave as
+    before. Taking the lock up front lets the wait for it be measured on its
+    own, which is what shows a sync stalling a scan.
+    """
+
+    # A lock wait or statement this slow is logged where it happened.
+    SLOW = 0.1
+
+    def __init__(self, database_url):
+        self.database_url = database_url
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._stats = {"queries": 0, "query_seconds": 0.0,
+                       "lock_waits": 0, "lock_wait_seconds": 0.0,
+                       "max_lock_wait": 0.0}
+
+    def connection(self):
+        """This thread's connection, opened on first use"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # check_same_thread off only so that close_all() can run at
+            # exit; otherwise a connection never leaves its thread.
+            db = db_setup.connect(
+                self.database_url, factory=_Connection, isolation_level=None,
+                check_same_thread=False)
+            db.database = self
+            self._local.db = db
+            with self.lock:
+                self._connections.append(db)
+            logging.debug("Opened a database connection for %s",
+                          threading.current_thread().name)
+        return db
+
+    def record_query(self, sql, seconds):
+        with self.lock:
+            self._stats["queries"] += 1
+            self._stats["query_seconds"] += seconds
+        if seconds > self.SLOW:
+            logging.warning("Slow query (%.0fms on %s): %s", seconds * 1000,
+                            threading.current_thread().name,
+                            " ".join(sql.split())[:80])
+
+    def record_lock_wait(self, seconds):
+        with self.lock:
+            self._stats["lock_waits"] += 1
+            self._stats["lock_wait_seconds"] += seconds
+            self._stats["max_lock_wait"] = max(self._stats["max_lock_wait"],
+                                               seconds)
+        if seconds > self.SLOW:
+            logging.warning("Waited %.0fms for the database write lock on %s",
+                            seconds * 1000, threading.current_thread().name)
+
+    def stats(self):
+        with self.lock:
+            return dict(self._stats)
+
+    def close_all(self):
+        with self.lock:
+            connections, self._connections = self._connections, []
+        for db in connections:
+            db.close()
+        self._local = threading.local()
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get(database_url):
+    """The shared Database for a file"""
+    with _databases_lock:
+        database = _databases.get(database_url)
+        if database is None:
+            database = _databases[database_url] = Database(database_url)
+        return database
+
+
+def connect(database_url):
+    """The calling thread's connection to `database_url`"""
+    return get(database_url).connection()
@@ -35,16 +35,79 @@ def create_tables(db):
     );
     """)
 
-
     db.commit()
 
 
+def enable_wal(db):
+    """Readers stop blocking the writer, and commits stop rewriting pages
+
+    With the rollback journal a sync holding the write lock stalled every
+    scan, and each commit wrote its pages twice. Persists in the file, so
+    this is done once; it cannot run inside a transaction.
+    """
+    mode = db.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if mode.lower() != "wal":
+        logging.warning("Could not switch the database to WAL (still %s)",
+                        mode)
+
+
+def index_last_modified(db):
+    # Sync asks for the cards changed since the last run, on every run.
+    db.execute("CREATE INDEX IF NOT EXISTS music_last_modified"
+               " ON music(last_modified)")
+
+
+def add_sync_validators(db):
+    # What the sync API said about its data last time, so a poll can ask
+    # whether anything changed instead of downloading the answer.
+    columns = {row[1] for row in db.execute("PRAGMA table_info(sync_meta)")}
+    for column in ("etag", "remote_last_modified"):
+        if column not in columns:
+            db.execute(f"ALTER TABLE sync_meta ADD COLUMN {column} TEXT")
+
+
+# In order; the database's user_version counts how many have been applied.
+# Never edit or reorder one that has shipped - add another. Each must be safe
+# to run again, since a crash can land between it and the version bump.
+MIGRATIONS = [
+    create_tables,
+    enable_wal,
+    index_last_modified,
+    add_sync_validators,
+]
+
+
+def migrate(db):
+    """Bring the schema up to date; returns the version it ended at"""
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:],
+                                       start=version + 1):
+        logging.info("Migrating database to version %d (%s)", number,
+                     migration.__name__)
+        migration(db)
+        db.execute(f"PRAGMA user_version = {number:d}")
+        db.commit()
+    return max(version, len(MIGRATIONS))
+
+
+def connect(database_url, **kwargs):
+    """A connection with the settings every connection needs
+
+    synchronous=NORMAL is safe under WAL - a power cut can lose the last
+    commits but never corrupts the file - and saves an fsync per commit. It
+    is per connection rather than stored in the file, hence this helper.
+    """
+    db = sqlite3.connect(database_url, **kwargs)
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
 def create_db(database_url):
-    """Create database"""
+    """Create database, or bring an existing one up to date"""
     if not os.path.exists(database_url):
         logging.info("Creating database...")
-        db = sqlite3.connect(database_url)
-        create_tables(db)
+    db = connect(database_url)
+    try:
+        migrate(db)
+    finally:
         db.close()
-    else:
-        logging.warning("Database exists. Skipping...")
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import re
+import threading
+
+
+class FileCache:
+    """JSON values by key, one file each, with the parsed values kept in memory
+
+    The caches used to be one JSON file each, so reading one entry parsed
+    all of them and writing one rewrote all of them - in place, so a power
+    cut mid-write took every entry with it. Here each key has a file of its
+    own in `path`, a directory: a read opens one small file, at most once
+    per process, and a write replaces one file atomically. The worst a power
+    cut can do is lose the entry being written, which is then fetched again.
+
+    Best-effort throughout: an unreadable entry is a miss, and a failed
+    write is logged and otherwise ignored. Values returned are shared with
+    the memory cache and must not be modified.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._memory = {}
+
+    def _file(self, key):
+        # Keys are Spotify IDs and URIs; anything else in a name is replaced.
+        return os.path.join(self.path,
+                            re.sub(r"[^A-Za-z0-9_-]", "_", key) + ".json")
+
+    def get(self, key):
+        """The value stored for `key`, or None"""
+        with self.lock:
+            if key in self._memory:
+                return self._memory[key]
+        try:
+            with open(self._file(key)) as entry:
+                value = json.load(entry)
+        except FileNotFoundError:
+            value = None
+        except (OSError, ValueError) as e:
+            logging.debug("No usable cache entry for %s: %s", key, e)
+            return None
+        with self.lock:
+            # A miss is remembered too: the next lookup need not try the disk.
+            return self._memory.setdefault(key, value)
+
+    def put(self, key, value):
+        with self.lock:
+            self._memory[key] = value
+        try:
+            if os.path.exists(self.path) and not os.path.isdir(self.path):
+                # The single-file cache this replaces, at the same path.
+                os.remove(self.path)
+            os.makedirs(self.path, exist_ok=True)
+            target = self._file(key)
+            temporary = f"{target}.tmp"
+            try:
+                with open(temporary, "w") as entry:
+                    json.dump(value, entry)
+                    entry.flush()
+                    os.fsync(entry.fileno())
+                os.replace(temporary, target)
+            except OSError:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                raise
+        except OSError as e:
+            # Losing the entry costs speed on the next lookup, nothing else.
+            logging.warning("Could not write the cache entry for %s: %s",
+                            key, e)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path):
+    """The shared FileCache for a directory"""
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = FileCache(path)
+        return cache
@@ -0,0 +1,29 @@
+import requests
+
+
+class TimeoutSession(requests.Session):
+    """A pooled, kept-alive session whose requests always time out
+
+    A request made without a timeout waits as long as TCP does, which on a
+    half-dead wifi link can be many minutes. Here `timeout`, a (connect,
+    read) pair in seconds, applies to every request that does not bring its
+    own.
+
+    `pool_connections` is how many hosts are pooled, `pool_maxsize` how
+    many connections are kept per host. Past that a request still goes out,
+    on a connection opened for it and discarded afterwards; it is not made
+    to wait for a free one (pool_block), which with no pool timeout could
+    hang it.
+    """
+
+    def __init__(self, timeout, pool_maxsize, pool_connections=1):
+        super().__init__()
+        self.timeout = timeout
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
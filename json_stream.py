@@ -0,0 +1,91 @@
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def iter_array(chunks):
+    """The elements of a JSON array, one by one, from an iterable of bytes
+
+    response.json() holds the whole body twice over - as text and as the
+    objects decoded from it - before the first element can be used. For a
+    sync with no last_sync, that is the entire card library at once, on a
+    Pi Zero sharing 512MB with spotifyd. Here only the current chunk and
+    the element being decoded are held, however long the array.
+
+    The chunks may split the text anywhere, mid-character included.
+    Raises ValueError if the body is not a JSON array.
+    """
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+    empty = True
+    after_element = False
+    finished = False
+
+    for chunk in _with_end(chunks):
+        final = chunk is None
+        buffer = buffer[position:] + text.decode(chunk or b"", final)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+            if finished:
+                raise ValueError("Unexpected data after the JSON array")
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if after_element:
+                if buffer[position] not in ",]":
+                    raise ValueError("Expected , or ] in the JSON array")
+                finished = buffer[position] == "]"
+                after_element = False
+                position += 1
+                continue
+            if buffer[position] == "]" and empty:
+                finished = True
+                position += 1
+                continue
+            try:
+                element, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise ValueError("Malformed element in the JSON array"
+                                     ) from None
+                break  # The element continues in the next chunk.
+            if not final and (end == len(buffer)
+                              or buffer[end] not in _WHITESPACE + ",]"):
+                # A number cut short decodes as a shorter one: "1.5e" as
+                # 1.5. Only what is followed by a separator is whole.
+                break
+            position = end
+            after_element = True
+            empty = False
+            yield element
+
+    if not finished:
+        raise ValueError("Truncated JSON array")
+
+
+def _with_end(chunks):
+    yield from chunks
+    yield None
+
+
+def batched(items, size):
+    """Lists of up to `size` items, in order"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
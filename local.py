@@ -1,7 +1,7 @@
 import json
 import logging
-import os
-import re
+
+from mpd_client import MpdError, get_client, get_watcher
 
 
 class AudioPlayer:
@@ -13,94 +13,231 @@ class AudioPlayer:
         self.playback_state = (
             json.loads(playback_state)
             if playback_state
-            else {"track": 1, "position": "0%"}
+            else {"track": 1, "position": 0}
         )
         self.location = location
         self.playing = False
+        # MPD's version number for the queue this player loaded. Every change
+        # to the queue bumps it, so it tells our own playback apart from
+        # whatever the next card loads - which matters, because change
+        # notifications for a replaced player can still be in flight.
+        self.queue_version = None
+        self.mpd = get_client()
+        self.watcher = get_watcher()
+        self.watcher.subscribe(self._on_mpd_change)
         logging.info("AudioPlayer initialized for RFID %s", self.rfid)
 
+    def _status(self):
+        """MPD's status, from the watcher's picture when it has one
+
+        Only asks MPD directly while the watcher is disconnected. Returns an
+        empty dict if MPD cannot be asked at all.
+        """
+        status = self.watcher.snapshot()
+        if status is not None:
+            return status
+        try:
+            return self.mpd.status()
+        except MpdError as e:
+            logging.error("Could not read the MPD status: %s", e)
+            return {}
+
+    def _run(self, message, *commands, audible=False):
+        """Send commands as one batch
+
+        Returns MPD's response as a dict - empty for most commands - or None
+        if MPD refused any of them.
+        """
+        try:
+            if len(commands) == 1:
+                return dict(self.mpd.command(*commands[0]))
+            return dict(self.mpd.command_list(commands))
+        except MpdError as e:
+            self._failed(message, e, audible)
+            return None
+
+    def _failed(self, message, e, audible):
+        logging.error("%s: %s", message, e)
+        if audible:
+            # Lazy import to avoid circular dependency: utils imports
+            # AudioPlayer
+            import utils
+            utils.play_sound("playback_error")
+
+    def _load_and_start(self, start):
+        """Load the card and start it with `start`, plus `status`, in one batch
+
+        Returns (status, whether `start` itself ran). A saved track that no
+        longer exists - files removed from the folder, say - makes MPD
+        refuse `start` and drop the rest of the batch, leaving the queue
+        loaded but silent. The mpc version started the first track then, so
+        this does too, at the cost of a second round trip. Raises MpdError
+        if that fails as well.
+        """
+        try:
+            return dict(self.mpd.command_list(
+                [("clear",), ("add", self.location), start, ("status",)])
+            ), True
+        except MpdError as e:
+            # ACK [error@index] {command} message: was it `start` refused?
+            if f"{{{start[0]}}}" not in str(e):
+                raise
+            logging.warning("Could not resume %s where it was (%s); "
+                            "starting from the first track", self.rfid, e)
+        return dict(self.mpd.command_list([("play", 0), ("status",)])), False
+
     def check_playback_status(self):
-        mpc_status = os.popen("mpc status").readlines()
-        pattern = r"\[(\w+)\]"
-        if len(mpc_status) > 1:
-            match = re.search(pattern, mpc_status[1])
-            if match:
-                self.playing = match.group(1) == "playing"
+        status = self._status()
+        if status:
+            self.playing = status.get("state") == "play"
+
+    def _start_position(self):
+        """Where to resume: (queue position, seconds into that track)
+
+        States saved by the mpc version hold the track as a string and the
+        position as mpc's percentage, e.g. "45%". Those are converted here
+        rather than migrated, and the next save writes seconds.
+        """
+        try:
+            song = max(0, int(self.playback_state.get("track", 1)) - 1)
+        except (TypeError, ValueError):
+            song = 0
+
+        position = self.playback_state.get("position", 0)
+        if isinstance(position, str) and position.endswith("%"):
+            return song, position
+        try:
+            return song, max(0.0, float(position))
+        except (TypeError, ValueError):
+            return song, 0.0
 
     def play(self):
         logging.info("Playing: %s", self.location)
-        os.system(f"mpc -q clear; mpc -q add {self.location}; mpc -q play")
-        os.system("mpc -q play " + str(self.playback_state["track"]))
-        os.system("mpc -q seek " + str(self.playback_state["position"]))
+        song, position = self._start_position()
+
+        # `status` rides along in the same batch, for the queue version.
+        legacy = isinstance(position, str)
+        if legacy:
+            # A percentage needs the track's duration, which MPD only knows
+            # once the track is loaded - so this legacy case costs a second
+            # round trip to seek.
+            start = ("play", song)
+        else:
+            # `seek` starts the given track at the given time, so the whole
+            # card is one batch and one round trip.
+            start = ("seek", song, f"{position:.1f}")
+        try:
+            status, resumed = self._load_and_start(start)
+        except MpdError as e:
+            self._failed("Playback failed", e, audible=True)
+            return
+
+        if legacy and resumed:
+            try:
+                duration = float(status.get("duration", 0))
+                seconds = duration * float(position.rstrip("%")) / 100
+            except ValueError:
+                seconds = 0
+            self._run("Seeking failed", ("seekcur", f"{seconds:.1f}"))
+        self.queue_version = status.get("playlist")
         self.playing = True
 
     def toggle_playback(self):
-        os.system("mpc -q toggle")
-        self.playing = not self.playing
+        # What mpc toggle did: pause when playing, play otherwise - which
+        # includes starting a stopped queue, where `pause` would do nothing.
+        status = self._status()
+        if status.get("state") == "play":
+            if self._run("Pausing failed", ("pause", 1),
+                         audible=True) is not None:
+                self.playing = False
+        elif self._run("Resuming failed", ("play",), audible=True) is not None:
+            self.playing = True
         logging.info("Toggled playback: %s",
                      "Playing" if self.playing else "Paused")
 
     def pause_playback(self):
-        os.system("mpc -q pause")
+        self._run("Pausing failed", ("pause", 1))
         self.playing = False
         logging.info("Playback paused")
 
     def next_track(self):
-        os.system("mpc -q next")
-        self.playing = True
-        logging.info("Next track")
+        if self._run("Next track failed", ("next",), audible=True) is not None:
+            self.playing = True
+            logging.info("Next track")
 
     def previous_track(self):
         # Same rule as SpotifyPlayer: past the first few seconds, restart the
         # current track instead of skipping back.
         if self._elapsed_seconds() > self.RESTART_THRESHOLD_SECONDS:
-            os.system("mpc -q seek 0")
-            self.playing = True
-            logging.info("Restarted the current track")
+            if self._run("Restarting the track failed", ("seekcur", 0),
+                         audible=True) is not None:
+                self.playing = True
+                logging.info("Restarted the current track")
             return
 
-        os.system("mpc -q prev")
-        self.playing = True
-        logging.info("Previous track")
+        if self._run("Previous track failed", ("previous",),
+                     audible=True) is not None:
+            self.playing = True
+            logging.info("Previous track")
 
     def _elapsed_seconds(self):
         """Seconds into the current track, or 0 if it cannot be read"""
         try:
-            status = os.popen("mpc status").readlines()
-            if len(status) < 2:
-                return 0
-            # e.g. "[playing] #3/12   0:07/3:21 (3%)"
-            match = re.search(r"(\d+):(\d\d)/", status[1])
-            return int(match.group(1)) * 60 + int(match.group(2)) if match else 0
-        except Exception as e:
-            logging.debug("Could not read elapsed time: %s", e)
+            return float(self._status().get("elapsed", 0))
+        except ValueError:
             return 0
 
     def restart_playback(self):
-        self.playback_state = {"track": 1, "position": "0%"}
+        self.playback_state = {"track": 1, "position": 0}
         self.play()
         logging.info("Restarting playback")
 
     def refresh_playback_state(self):
-        """Periodically record position; mpc queries are local and cheap"""
+        """Record position on the watchdog's timer, if nothing else does
+
+        While the watcher is connected, _on_mpd_change saves on every real
+        track change and pause instead, so the timer has nothing to add.
+        """
+        if self.watcher.snapshot() is not None:
+            return False
         if self.playing:
             self.save_playback_state()
+            return True
+        return False
+
+    def _on_mpd_change(self, previous, current):
+        """Follow MPD's state, saving when the track changes or playback stops
+
+        Called from the watcher thread. Ignores everything once another card
+        has loaded its own queue: the state is then someone else's.
+        """
+        if (self.queue_version is None
+                or current.get("playlist") != self.queue_version):
+            return
+
+        self.playing = current.get("state") == "play"
+        track_changed = previous.get("songid") != current.get("songid")
+        stopped = previous.get("state") == "play" and not self.playing
+        if track_changed or stopped:
+            self.save_playback_state(current)
 
-    def save_playback_state(self):
+    def save_playback_state(self, status=None):
         # Lazy import to avoid circular dependency: utils imports AudioPlayer
         import utils
 
         try:
-            track_number = os.popen("mpc current -f %position%").read().strip()
-            mpc_status = os.popen("mpc status").readlines()
-            position = (
-                os.popen(
-                    f"echo '{mpc_status[1]}' | awk -F '[()]' '{{print $2}}'")
-                .read()
-                .strip()
-                if len(mpc_status) > 1 else "0%"
-            )
-            self.playback_state = {"track": track_number, "position": position}
+            if status is None:
+                status = self.mpd.status()
+            if "song" not in status:
+                # Stopped with nothing current: there is no position to
+                # read, and recording track 1 would lose the real one.
+                utils.persist_playback_state(self.rfid, self.playback_state)
+                return
+            self.playback_state = {
+                # 1-based, as mpc reported it and as play() expects.
+                "track": int(status.get("song", 0)) + 1,
+                "position": round(float(status.get("elapsed", 0)), 1),
+            }
             utils.persist_playback_state(self.rfid, self.playback_state)
             logging.info("Playback state saved for RFID %s", self.rfid)
         except Exception as e:
@@ -1,6 +1,6 @@
 import logging
 import os
-import sqlite3
+import signal
 import sys
 import threading
 import time
@@ -8,8 +8,13 @@ import time
 from dotenv import load_dotenv
 
 import buttons
+import card_index
+import database
 import db_setup
+import remote_sync
+import sound_engine
 import spotify
+import state_writer
 import utils
 from remote_sync import schedule_sync
 from rfid import RfidReader
@@ -28,10 +33,16 @@ class RFIDMusicPlayer:
     # how far back a story jumps when another device interrupts it.
     STATE_REFRESH_INTERVAL = 30
 
-    # How often to pull newly registered cards from the sync API. Each poll is
-    # a fresh TLS connection (remote_sync uses no Session), so this trades
-    # against keeping the wifi radio out of power save on a battery device.
+    # How often to pull newly registered cards from the sync API. Polls reuse
+    # one kept-alive connection, so an idle poll is a single small request,
+    # but each still wakes the wifi radio out of power save.
     SYNC_INTERVAL = 60
+    # With SYNC_PUSH, how often to poll anyway while the server is pushing
+    # changes: for uploads, and for an event that never arrived.
+    SYNC_PUSH_INTERVAL = 900
+    # Sync stops this many seconds before idle shutdown - or halfway there,
+    # for an IDLE_TIME this short - rather than wake the radio for nothing.
+    SYNC_IDLE_PAUSE = 300
 
     def __init__(self):
         self.player = None
@@ -39,14 +50,22 @@ class RFIDMusicPlayer:
         self.last_activity = time.monotonic()
         self.activity_lock = threading.Lock()
         self.sync_done = threading.Event()
+        self.sync = None
         self.db = None
         self.database_url = None
         self.rfid_reader = None
         self.button_handler = None
+        self.warm_up_done = threading.Event()
+        self.warm_up_seconds = None
 
     def initialize(self):
         """Initialize the application configuration and logging."""
         load_dotenv()
+        # Read again now that .env is in the environment.
+        utils.configure()
+        spotify.configure()
+        remote_sync.configure()
+        RfidReader.configure()
 
         try:
             utils.verify_env_file(os.environ)
@@ -79,8 +98,28 @@ class RFIDMusicPlayer:
         # cheap to fix, rather than when playback stops.
         spotify.check_refresh_token_age()
 
+        # In the background: the start sound and the RFID reader must not
+        # wait on the network, and by the time a child has picked a card the
+        # token and connections are already there. The refresher is started
+        # first, so that the warm-up's token lands on the manager it keeps.
+        spotify.get_auth_manager().start_refresher()
+        spotify.warm_up(on_done=self.on_warm_up)
+        # Decoding the sounds overlaps with database and hardware setup; the
+        # start sound waits for it only if it is not done by then.
+        threading.Thread(target=sound_engine.get_engine, name="sound-load",
+                         daemon=True).start()
+
         return True
 
+    def on_warm_up(self, ready, seconds):
+        """Record that the Spotify warm-up finished, and how long it took"""
+        self.warm_up_seconds = seconds
+        self.warm_up_done.set()
+        if not ready:
+            logging.warning(
+                "Spotify was not reachable at startup (%.1fs); the first scan "
+                "will connect itself", seconds)
+
     def setup_database(self):
         """Setup and connect to the database."""
         self.database_url = os.environ.get("DATABASE_URL")
@@ -90,11 +129,17 @@ class RFIDMusicPlayer:
             raise ValueError("DATABASE_URL environment variable is required.")
 
         if not os.path.exists(self.database_url):
-            db_setup.create_db(self.database_url)
-            logging.info("Database created at %s", self.database_url)
-
-        self.db = sqlite3.connect(self.database_url)
-        logging.info("Connected to database: %s", self.database_url)
+            logging.info("Creating database at %s", self.database_url)
+
+        # The main thread's own connection; the RFID loop runs on it.
+        self.db = database.connect(self.database_url)
+        # Creates the tables on a first run, and catches up on anything
+        # added since an existing database was made.
+        version = db_setup.migrate(self.db)
+        logging.info("Connected to database: %s (schema version %d)",
+                     self.database_url, version)
+        # Scans are answered from memory from here on.
+        card_index.get_index().load(self.db)
 
     def setup_sync(self):
         """Setup database synchronization if enabled."""
@@ -106,10 +151,16 @@ class RFIDMusicPlayer:
             # registered card only appeared after a service restart, and with
             # idle-shutdown that meant the next time someone switched the
             # device on.
-            schedule_sync(self.database_url, self.sync_done,
-                          interval=self.SYNC_INTERVAL)
-            logging.info("Database sync enabled (polling every %ds)",
-                         self.SYNC_INTERVAL)
+            push = os.environ.get("SYNC_PUSH", "").lower() == "true"
+            self.sync = schedule_sync(self.database_url, self.sync_done,
+                                      interval=self.SYNC_INTERVAL, push=push,
+                                      push_interval=self.SYNC_PUSH_INTERVAL)
+            # `systemctl kill -s USR1 kids-music-player` syncs right away.
+            signal.signal(signal.SIGUSR1,
+                          lambda signum, frame: self.sync.sync_now())
+            logging.info("Database sync enabled (%s every %ds)",
+                         "listening for changes, else polling" if push
+                         else "polling", self.SYNC_INTERVAL)
         else:
             logging.info("Sync disabled.")
 
@@ -169,6 +220,13 @@ class RFIDMusicPlayer:
         with self.activity_lock:
             inactive_for = now - self.last_activity
 
+        if self.sync:
+            if inactive_for > max(self.idle_time - self.SYNC_IDLE_PAUSE,
+                                  self.idle_time / 2):
+                self.sync.pause()
+            else:
+                self.sync.resume()
+
         if inactive_for > self.idle_time:
             logging.info(
                 "Watchdog: system has been idle for %.0f seconds", inactive_for)
@@ -273,6 +331,9 @@ class RFIDMusicPlayer:
                 else:
                     logging.warning("Unknown RFID %s", rfid)
                     utils.play_sound("error")
+                    if self.sync:
+                        # Likely being registered right now; fetch it soon.
+                        self.sync.expect_new_card()
 
     def run(self):
         """Main application loop."""
@@ -316,8 +377,11 @@ class RFIDMusicPlayer:
         """Clean up resources."""
         if self.rfid_reader:
             self.rfid_reader.close()
+        state_writer.flush_all()
         if self.db:
-            self.db.close()
+            db = database.get(self.database_url)
+            logging.info("Database use: %s", db.stats())
+            db.close_all()
 
 
 def main():
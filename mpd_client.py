@@ -0,0 +1,301 @@
+import logging
+import os
+import socket
+import threading
+import time
+import weakref
+
+
+class MpdError(Exception):
+    """MPD refused a command (an ACK line), or could not be reached"""
+
+
+def quote(arg):
+    """One argument in MPD's quoting, so spaces in paths survive"""
+    escaped = str(arg).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+class MpdClient:
+    """A persistent connection to MPD, speaking its text protocol directly
+
+    Replaces forking mpc for every action. On a Pi Zero each fork costs tens
+    of milliseconds, and playing a card took five of them; over one open
+    socket the same work is a single round trip.
+
+    Thread-safe: the RFID, button and watchdog threads all drive the same
+    player, and MPD answers strictly in order, so a command and its response
+    must not interleave with another thread's.
+
+    MPD drops clients that stay silent longer than its connection_timeout
+    (60s by default), so a dead socket is routine rather than exceptional: a
+    command that finds one reconnects and is sent again, once - but only
+    when MPD cannot have run it the first time.
+    """
+
+    # Long enough for a slow SD card to answer `add` on a big directory;
+    # short enough that a wedged MPD cannot hold player_lock indefinitely.
+    TIMEOUT = 10
+
+    def __init__(self, host=None, port=None, timeout=TIMEOUT):
+        # The same variables mpc reads, so both agree on where MPD is.
+        host = host or os.environ.get("MPD_HOST", "localhost")
+        self.password = None
+        if "@" in host:
+            self.password, host = host.split("@", 1)
+        self.host = host
+        self.port = int(port or os.environ.get("MPD_PORT", 6600))
+        self.timeout = timeout
+
+        # Whether a lost connection is re-established and the command resent.
+        # MpdWatcher turns it off and reconnects on its own terms instead.
+        self.reconnect = True
+
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+        # Whether any reply to the command being run has been read.
+        self._answered = False
+
+    # --- connection -------------------------------------------------------
+
+    def _connect(self):
+        if self.host.startswith("/"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.host)
+        else:
+            sock = socket.create_connection((self.host, self.port),
+                                            timeout=self.timeout)
+        self.sock = sock
+        self.reader = sock.makefile("r", encoding="utf-8", newline="\n")
+
+        greeting = self.reader.readline()
+        if not greeting.startswith("OK MPD "):
+            self.close()
+            raise MpdError(f"Unexpected greeting from MPD: {greeting!r}")
+        logging.debug("Connected to %s", greeting.strip())
+
+        if self.password:
+            self._send_and_read([f"password {quote(self.password)}"])
+
+    def interrupt(self):
+        """Wake a thread blocked reading, from another thread
+
+        close() would pull the reader out from under it; shutdown() makes its
+        read return end-of-stream, which it then handles like any lost
+        connection.
+        """
+        sock = self.sock
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        for closable in (self.reader, self.sock):
+            if closable:
+                try:
+                    closable.close()
+                except OSError:
+                    pass
+        self.sock = None
+        self.reader = None
+
+    # --- commands ---------------------------------------------------------
+
+    def _send_and_read(self, lines):
+        self.sock.sendall(("\n".join(lines) + "\n").encode("utf-8"))
+        return self._read_response()
+
+    def _read_response(self):
+        pairs = []
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionError("MPD closed the connection")
+            self._answered = True
+            line = line.rstrip("\n")
+            if line == "OK":
+                return pairs
+            if line.startswith("ACK "):
+                raise MpdError(line)
+            key, _, value = line.partition(": ")
+            pairs.append((key, value))
+
+    def _execute(self, lines):
+        with self.lock:
+            attempts = 2 if self.reconnect else 1
+            for attempt in range(attempts):
+                sent = False
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    sent = True
+                    self._answered = False
+                    return self._send_and_read(lines)
+                except (OSError, ConnectionError) as e:
+                    # Usually MPD timing out an idle client. Reconnect and
+                    # resend once; failing twice means MPD really is gone.
+                    self.close()
+                    # Resent only if MPD cannot have run it: the connection
+                    # was dead before a word of reply came back. After a
+                    # read timeout MPD may just be slow, and a second `next`
+                    # would skip a track twice.
+                    dead = (not sent or (isinstance(e, ConnectionError)
+                                         and not self._answered))
+                    if attempt == attempts - 1 or not dead:
+                        raise MpdError(f"MPD is unreachable: {e}") from e
+                    logging.debug("MPD connection lost (%s), reconnecting", e)
+
+    def command(self, name, *args):
+        """Run one command; returns its response as (key, value) pairs"""
+        return self._execute([" ".join([name, *map(quote, args)])])
+
+    def command_list(self, commands):
+        """Run (name, *args) tuples as one batch, in one round trip
+
+        MPD applies the batch in order and stops at the first failure.
+        """
+        lines = ["command_list_begin"]
+        lines += [" ".join([name, *map(quote, args)])
+                  for name, *args in commands]
+        lines.append("command_list_end")
+        return self._execute(lines)
+
+    def status(self):
+        """`status` as a dict: state, song, elapsed, duration and so on"""
+        return dict(self.command("status"))
+
+
+class MpdWatcher:
+    """Keeps an up-to-date picture of MPD by listening, not polling
+
+    Holds its own connection parked in `idle`, which MPD answers only when
+    something actually changes - so the picture costs nothing while nothing
+    happens, and readers get it without a round trip. Its own connection,
+    because a connection in idle can do nothing else, and without a timeout,
+    because waiting indefinitely is the point.
+
+    Subscribers are called from the watcher thread as callback(previous,
+    current), with both status dicts, after every change. They are held
+    weakly, so a player that has been replaced stops hearing about changes
+    without having to unsubscribe.
+    """
+
+    SUBSYSTEMS = ("player", "mixer", "playlist")
+    RECONNECT_DELAY = 5
+
+    def __init__(self, host=None, port=None):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self._status = None
+        self._read_at = 0
+        self._subscribers = []
+        self._client = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen, name="mpd-idle",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._client:
+            self._client.interrupt()
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    def subscribe(self, callback):
+        """callback must be a bound method; it is held by weak reference"""
+        with self.lock:
+            self._subscribers.append(weakref.WeakMethod(callback))
+
+    def snapshot(self):
+        """The latest status, elapsed brought up to now; None if unknown
+
+        None while disconnected, so a caller falls back to asking MPD rather
+        than trusting a picture that has stopped updating.
+        """
+        with self.lock:
+            if self._status is None:
+                return None
+            status = dict(self._status)
+            read_at = self._read_at
+
+        if status.get("state") == "play" and "elapsed" in status:
+            try:
+                elapsed = float(status["elapsed"]) + time.monotonic() - read_at
+                status["elapsed"] = f"{elapsed:.3f}"
+            except ValueError:
+                pass
+        return status
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            self._client = MpdClient(self.host, self.port, timeout=None)
+            self._client.reconnect = False
+            try:
+                self._update(self._client.status())
+                while not self._stopping.is_set():
+                    self._client.command("idle", *self.SUBSYSTEMS)
+                    self._update(self._client.status())
+            except MpdError as e:
+                if not self._stopping.is_set():
+                    logging.warning("MPD watcher lost its connection: %s", e)
+            finally:
+                self._client.close()
+                with self.lock:
+                    self._status = None
+
+            self._stopping.wait(self.RECONNECT_DELAY)
+
+    def _update(self, status):
+        with self.lock:
+            previous = self._status
+            self._status = status
+            self._read_at = time.monotonic()
+            self._subscribers = [ref for ref in self._subscribers
+                                 if ref() is not None]
+            callbacks = [ref() for ref in self._subscribers]
+
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(previous or {}, status)
+            except Exception as e:
+                # One broken subscriber must not end the watching for good.
+                logging.error("MPD change handler failed: %s", e,
+                              exc_info=True)
+
+
+_client = None
+_watcher = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = MpdClient()
+    return _client
+
+
+def get_watcher():
+    """The shared watcher, started the first time anything asks for it
+
+    Started lazily rather than at boot, so a device with no local cards never
+    opens a connection to an MPD it may not even run.
+    """
+    global _watcher
+    if _watcher is None:
+        _watcher = MpdWatcher()
+        _watcher.start()
+    return _watcher
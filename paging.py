@@ -0,0 +1,36 @@
+import concurrent.futures
+
+# Pages requested at once. Spotify's rate limit is per app over a rolling
+# window, so a handful at a time is safe; the connection pools in spotify.py
+# are sized with this in mind.
+MAX_PARALLEL = 4
+
+
+def fetch_pages(get_page, limit, max_parallel=MAX_PARALLEL):
+    """Every page of a Spotify paging object, in order
+
+    `get_page(offset)` returns one page as decoded JSON. Following `next`
+    one page at a time made a long playlist a dozen-odd round trips in a
+    row. The first page's `total` tells us every other offset up front, so
+    the rest are fetched together - two round trips' worth of waiting,
+    however long the playlist. A page without `total` is followed by `next`
+    as before.
+
+    The first error from any page is raised once the others have finished.
+    """
+    first = get_page(0)
+    total = first.get("total")
+    if not isinstance(total, int):
+        pages = [first]
+        while pages[-1].get("next"):
+            pages.append(get_page(len(pages) * limit))
+        return pages
+
+    offsets = range(limit, total, limit)
+    if not offsets:
+        return [first]
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_parallel, len(offsets)),
+            thread_name_prefix="page") as pool:
+        # map() yields in the order of the offsets, whichever finishes first.
+        return [first] + list(pool.map(get_page, offsets))
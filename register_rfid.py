@@ -6,6 +6,9 @@ from tabulate import tabulate
 
 from dotenv import load_dotenv
 
+import json_stream
+import paging
+
 
 SPOTIFY_URL_RE = re.compile(
     r"open\.spotify\.com/(?:intl-[a-z]{2}/)?(album|playlist|track)/([A-Za-z0-9]+)")
@@ -87,22 +90,29 @@ def playlist_episodes(token, playlist_id):
     """
     url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
     headers = {"Authorization": f"Bearer {token}"}
-    params = {"limit": 50, "offset": 0, "market": "DE"}
-    episodes = []
+    limit = 50
 
-    while True:
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            page = response.json()
-        except requests.RequestException as e:
-            # Spotify answers 404 for a playlist the caller may not see, so a
-            # private one looks exactly like a missing one from here.
-            print(f"Could not read the playlist: {e}")
-            print("If it exists, check that it is public - this lookup uses "
-                  "app-only credentials, which cannot see private playlists.")
-            return None
+    def get_page(offset):
+        response = requests.get(
+            url, headers=headers,
+            params={"limit": limit, "offset": offset, "market": "DE",
+                    # Only what is shown; see SpotifyPlayer.EPISODE_FIELDS.
+                    "fields": "items(track(album(uri,name))),total,next"})
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        pages = paging.fetch_pages(get_page, limit)
+    except requests.RequestException as e:
+        # Spotify answers 404 for a playlist the caller may not see, so a
+        # private one looks exactly like a missing one from here.
+        print(f"Could not read the playlist: {e}")
+        print("If it exists, check that it is public - this lookup uses "
+              "app-only credentials, which cannot see private playlists.")
+        return None
 
+    episodes = []
+    for page in pages:
         for entry in page.get("items", []):
             album = ((entry.get("track") or {}).get("album") or {})
             uri = album.get("uri")
@@ -112,10 +122,7 @@ def playlist_episodes(token, playlist_id):
                 episodes.append({"uri": uri, "name": album.get("name"),
                                  "tracks": 0})
             episodes[-1]["tracks"] += 1
-
-        if not page.get("next"):
-            return episodes
-        params["offset"] += params["limit"]
+    return episodes
 
 
 def choose_spotify_series(token):
@@ -207,23 +214,28 @@ def choose_spotify_album(token):
 
 
 def list_registered_rfids(api_url, headers):
-    """List registered RFID codes from the remote database """
-    res = requests.get(f"{api_url}/music", headers=headers)
-    if res.status_code != 200:
-        print(
-            f"Failed to fetch data from remote: {res.status_code} {res.text}")
-        return
+    """List registered RFID codes from the remote database
+
+    The listing is decoded as it arrives and kept only as table rows: the
+    table needs every row to size its columns, but not the response body
+    or a dict per card alongside them.
+    """
+    res = requests.get(f"{api_url}/music", headers=headers, stream=True)
+    with res:
+        if res.status_code != 200:
+            print(
+                f"Failed to fetch data from remote: {res.status_code} {res.text}")
+            return
 
-    items = res.json()
-    if not items:
+        table = [
+            (item.get("rfid"), item.get("title"), item.get("source"),
+             item.get("location"), item.get("last_modified"))
+            for item in json_stream.iter_array(res.iter_content(16 * 1024))
+        ]
+    if not table:
         print("No registered RFID codes found.")
         return
 
-    table = [
-        [item.get("rfid"), item.get("title"), item.get("source"),
-         item.get("location"), item.get("last_modified")]
-        for item in items
-    ]
     headers = ["RFID", "Title", "Source", "Location", "Last Modified"]
     print(tabulate(table, headers=headers, tablefmt="simple"))
 
@@ -1,3 +1,4 @@
+import gzip
 import json
 import logging
 import os
@@ -5,23 +6,123 @@ import sqlite3
 import threading
 import time
 
-import requests
+import card_index
+import database
+import json_stream
+from backoff import Backoff
+from http_session import TimeoutSession
 
 
-def fetch_remote_items(api_url, headers, last_sync):
+def configure():
+    """Read this module's settings from the environment
+
+    Run at import, and again by main once .env is loaded, as
+    utils.configure() is.
+    """
+    global SYNC_BACKOFF
+
+    # Paces the attempts within one sync run. Deliberately slower to start
+    # than the player's: nobody is standing at the device waiting for this.
+    SYNC_BACKOFF = Backoff.from_env("SYNC", first=1, max_delay=10,
+                                    deadline=60, max_attempts=5)
+
+
+configure()
+
+# Remote rows are read STREAM_CHUNK_BYTES at a time and merged MERGE_BATCH
+# at a time, which bounds what a sync holds in memory whatever the size of
+# the library.
+STREAM_CHUNK_BYTES = 16 * 1024
+MERGE_BATCH = 500
+
+
+class SyncSession(TimeoutSession):
+    """A kept-alive connection to the sync API, compressed both ways
+
+    Polling with module-level requests calls paid a TCP and TLS handshake on
+    every run, which kept the wifi radio awake for several round trips even
+    when nothing had changed. One pooled connection makes an idle poll a
+    single request on a socket that is already open.
+
+    Responses are asked for gzipped; uploads are gzipped once they are big
+    enough to gain from it. Not every server takes compressed request
+    bodies, so a 415 turns that off for the rest of the run and the upload
+    is sent again as it was.
+    """
+
+    POOL_MAXSIZE = 2
+    # (connect, read) in seconds. Nothing waits on sync, but without a limit
+    # a hung API stalls the sync thread - and shutdown, which waits for a
+    # running sync - indefinitely.
+    TIMEOUT = (5, 30)
+    GZIP_MIN_BYTES = 1024
+
+    def __init__(self):
+        super().__init__(self.TIMEOUT, self.POOL_MAXSIZE)
+        self.headers["Accept-Encoding"] = "gzip"
+        self.gzip_uploads = True
+
+    def post_json(self, url, payload, headers=None, **kwargs):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {**(headers or {}), "Content-Type": "application/json"}
+        if self.gzip_uploads and len(body) >= self.GZIP_MIN_BYTES:
+            response = self.post(
+                url, data=gzip.compress(body),
+                headers={**headers, "Content-Encoding": "gzip"}, **kwargs)
+            if response.status_code != 415:
+                return response
+            logging.warning("The sync API refused a gzipped upload; "
+                            "sending uploads uncompressed from now on")
+            self.gzip_uploads = False
+        return self.post(url, data=body, headers=headers, **kwargs)
+
+
+session = SyncSession()
+
+
+def fetch_remote_items(api_url, headers, last_sync, validators=None):
+    """Remote rows changed since last_sync; None if the API says nothing has
+
+    The rows are an iterator, decoded from the response as it arrives: with
+    no last_sync this is the whole library, which need never be in memory
+    at once. Iterate it to the end, or the connection is not reused.
+
+    `validators` carries the previous response's ETag and Last-Modified.
+    They are sent as If-None-Match and If-Modified-Since, and replaced in
+    place with the new response's.
+    """
     params = {"since": last_sync} if last_sync else {}
-    r = requests.get(f"{api_url}/music", headers=headers, params=params)
+    headers = dict(headers)
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    r = session.get(f"{api_url}/music", headers=headers, params=params,
+                    stream=True)
+    if r.status_code == 304:
+        r.close()
+        return None
     if r.status_code != 200:
         raise RuntimeError(
             f"Failed to fetch remote changes: {r.status_code} {r.text}")
-    return r.json()
+    if validators is not None:
+        validators["etag"] = r.headers.get("ETag")
+        validators["last_modified"] = r.headers.get("Last-Modified")
+    return _stream_items(r)
+
+
+def _stream_items(response):
+    with response:
+        yield from json_stream.iter_array(
+            response.iter_content(STREAM_CHUNK_BYTES))
 
 
 def fetch_local_items(cursor, last_sync):
     """Local rows changed since last_sync - i.e. upload candidates.
 
-    Only ever use this to decide what to push. Deciding whether a remote row
-    already exists needs fetch_all_local_items(); see the comment in sync_db.
+    Only ever use this to decide what to push. Whether a remote row already
+    exists is for merge_remote_items() to settle against the whole table.
     """
     if last_sync:
         cursor.execute(
@@ -31,13 +132,81 @@ def fetch_local_items(cursor, last_sync):
     return [dict(row) for row in cursor.fetchall()]
 
 
-def fetch_all_local_items(cursor):
-    """Every local row, regardless of when it last changed."""
-    cursor.execute("SELECT * FROM music")
-    return [dict(row) for row in cursor.fetchall()]
+def merge_remote_items(cursor, remote_items):
+    """Apply remote rows that are new or newer here
 
+    Returns those rows as (rfid, source, location, title, last_modified)
+    tuples, for the card index.
 
-def sync_db(database_url, sync_done=None, retries=5, delay=5):
+    Set-based, so the cost follows the size of the delta rather than of the
+    library: the delta goes into a temporary table, and one join against
+    music's primary key finds what changed and one upsert applies it. This
+    used to read every local row into a dict on every poll, just to look up
+    the few rfids that came back.
+
+    Existence is settled against the whole table, not the local delta. A
+    card edited on the server but untouched here is absent from that delta;
+    taking it for a new card once INSERTed a duplicate rfid, which failed
+    the UNIQUE constraint, rolled the transaction back and took every
+    genuinely new card in the same batch down with it - so freshly
+    registered cards stayed unknown on the device indefinitely.
+    """
+    if not remote_items:
+        return []
+
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS sync_incoming (
+            rfid TEXT PRIMARY KEY,
+            source TEXT,
+            location TEXT,
+            title TEXT,
+            last_modified TIMESTAMP
+        )
+    """)
+    cursor.execute("DELETE FROM sync_incoming")
+    cursor.executemany("""
+        INSERT OR REPLACE INTO sync_incoming
+            (rfid, source, location, title, last_modified)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(item["rfid"], item["source"], item["location"], item["title"],
+           item["last_modified"]) for item in remote_items])
+
+    # A local row without a timestamp predates them; the remote one wins.
+    newer = """
+        music.rfid IS NULL
+        OR music.last_modified IS NULL
+        OR incoming.last_modified > music.last_modified
+    """
+    cursor.execute(f"""
+        SELECT incoming.rfid, incoming.source, incoming.location,
+            incoming.title, incoming.last_modified
+        FROM sync_incoming AS incoming
+        LEFT JOIN music ON music.rfid = incoming.rfid
+        WHERE {newer}
+    """)
+    changed = [tuple(row) for row in cursor.fetchall()]
+
+    # playback_state is left out on purpose: positions are device-local.
+    # "WHERE true" is SQLite's required disambiguation for an upsert fed by
+    # a SELECT.
+    cursor.execute("""
+        INSERT INTO music (rfid, source, location, title, last_modified)
+        SELECT rfid, source, location, title, last_modified
+        FROM sync_incoming WHERE true
+        ON CONFLICT(rfid) DO UPDATE SET
+            source = excluded.source,
+            location = excluded.location,
+            title = excluded.title,
+            last_modified = excluded.last_modified
+        WHERE music.last_modified IS NULL
+            OR excluded.last_modified > music.last_modified
+    """)
+    cursor.execute("DELETE FROM sync_incoming")
+    return changed
+
+
+def sync_db(database_url, sync_done=None, backoff=None):
+    """Pull remote changes and push local ones; True if that succeeded"""
     API_URL = os.environ.get("SYNC_API_URL")
     API_TOKEN = os.environ.get("SYNC_API_TOKEN", "")
 
@@ -53,83 +222,104 @@ def sync_db(database_url, sync_done=None, retries=5, delay=5):
     success = False
     last_error = None
 
-    for attempt in range(retries):
+    for attempt in (backoff or SYNC_BACKOFF).attempts():
         try:
-            with sqlite3.connect(database_url) as db:
-                db.row_factory = sqlite3.Row
+            db = database.connect(database_url)
+            with db:
                 cursor = db.cursor()
+                cursor.row_factory = sqlite3.Row
 
                 cursor.execute(
-                    "SELECT last_sync FROM sync_meta WHERE id = 1")
+                    "SELECT last_sync, etag, remote_last_modified"
+                    " FROM sync_meta WHERE id = 1")
                 row = cursor.fetchone()
                 last_sync = row["last_sync"] if row else None
                 logging.debug(f"Last sync: {last_sync}")
+                validators = {
+                    "etag": row["etag"] if row else None,
+                    "last_modified": row["remote_last_modified"] if row else None,
+                }
+                previous_validators = dict(validators)
 
                 remote_items = fetch_remote_items(
-                    API_URL, headers, last_sync)
+                    API_URL, headers, last_sync, validators)
+                if remote_items is None:
+                    # 304: nothing changed on the server since the last poll,
+                    # so there is nothing to merge.
+                    logging.debug("No remote changes (not modified)")
+                    remote_items = []
 
-                remote_map = {item["rfid"]: item for item in remote_items}
+                # Read before merging, or the merge's own rows would count
+                # as local changes and be sent straight back.
                 local_items = fetch_local_items(cursor, last_sync)
                 local_map = {item["rfid"]: item for item in local_items}
-                # Existence must be checked against the whole table, not the
-                # delta. A card edited on the server but untouched here is
-                # absent from local_map, so the loop below took it for a new
-                # card and INSERTed a duplicate rfid. That raised "UNIQUE
-                # constraint failed", rolled the transaction back, and took
-                # every genuinely new card in the same batch down with it - so
-                # freshly registered cards stayed unknown on the device
-                # indefinitely, with only "All database sync attempts failed"
-                # to show for it.
-                existing_map = {item["rfid"]: item
-                                for item in fetch_all_local_items(cursor)}
-
-                for rfid, remote_item in remote_map.items():
-                    local_item = existing_map.get(rfid)
-                    if not local_item:
-                        cursor.execute("""
-                            INSERT INTO music (rfid, source, location, title, last_modified)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (
-                            rfid,
-                            remote_item["source"],
-                            remote_item["location"],
-                            remote_item["title"],
-                            remote_item["last_modified"]
-                        ))
-                    elif remote_item["last_modified"] > local_item["last_modified"]:
-                        cursor.execute("""
-                            UPDATE music SET source=?, location=?, title=?, last_modified=?
-                            WHERE rfid=?
-                        """, (
-                            remote_item["source"],
-                            remote_item["location"],
-                            remote_item["title"],
-                            remote_item["last_modified"],
-                            rfid
-                        ))
+
+                # Merged as they arrive, a batch at a time. Of the remote
+                # rows only what the upload decision needs is kept: when
+                # each locally changed card last changed over there.
+                #
+                # Each batch is committed on its own. The merge takes the
+                # write lock, and holding it until the end would hold it
+                # while the rest of the body downloads - a whole first
+                # sync, during which saving a position or the last played
+                # card times out. Committing early is safe: the merge
+                # only ever moves a card forward in time, and last_sync
+                # moves only once everything is in, so a sync cut short is
+                # fetched whole again and re-merges to the same rows.
+                index = card_index.get_index()
+                remote_modified = {}
+                changed = 0
+                received = 0
+                for batch in json_stream.batched(remote_items, MERGE_BATCH):
+                    received += len(batch)
+                    for item in batch:
+                        if item["rfid"] in local_map:
+                            remote_modified[item["rfid"]] = item["last_modified"]
+                    merged = merge_remote_items(cursor, batch)
+                    db.commit()
+                    # Only once committed: the index must never get ahead
+                    # of the database it stands in for.
+                    for row in merged:
+                        index.upsert(*row)
+                    changed += len(merged)
 
                 upload_items = []
                 for rfid, local_item in local_map.items():
-                    remote_item = remote_map.get(rfid)
-                    if not remote_item or local_item["last_modified"] > remote_item["last_modified"]:
+                    remote_last_modified = remote_modified.get(rfid)
+                    if not remote_last_modified or local_item["last_modified"] > remote_last_modified:
                         upload_items.append(local_item)
 
                 if upload_items:
-                    sync_res = requests.post(
-                        f"{API_URL}/music/sync", json=upload_items, headers=headers)
+                    sync_res = session.post_json(
+                        f"{API_URL}/music/sync", upload_items, headers=headers)
                     if sync_res.status_code != 200:
                         raise RuntimeError(
                             "Failed to sync items to remote database.")
 
-                if remote_items or upload_items:
-                    cursor.execute(
-                        "INSERT OR REPLACE INTO sync_meta (id, last_sync) VALUES (1, CURRENT_TIMESTAMP)"
-                    )
+                if validators != previous_validators:
+                    cursor.execute("""
+                        INSERT INTO sync_meta (id, etag, remote_last_modified)
+                        VALUES (1, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET
+                            etag = excluded.etag,
+                            remote_last_modified = excluded.remote_last_modified
+                    """, (validators["etag"], validators["last_modified"]))
+
+                if received or upload_items:
+                    # An upsert rather than INSERT OR REPLACE, which would
+                    # wipe the validators stored alongside.
+                    cursor.execute("""
+                        INSERT INTO sync_meta (id, last_sync)
+                        VALUES (1, CURRENT_TIMESTAMP)
+                        ON CONFLICT(id) DO UPDATE SET
+                            last_sync = excluded.last_sync
+                    """)
                     db.commit()
                     logging.info("Sync complete.")
-                    if remote_items:
+                    if received:
                         logging.debug(
-                            f"Items synced from remote: {json.dumps(remote_items, indent=4)}")
+                            f"Received {received} items from remote, "
+                            f"{changed} of them new or newer")
                     if upload_items:
                         logging.debug(
                             f"Items synced to remote: {json.dumps(upload_items, indent=4)}")
@@ -141,9 +331,6 @@ def sync_db(database_url, sync_done=None, retries=5, delay=5):
         except Exception as e:
             last_error = e
             logging.debug(f"Sync attempt {attempt + 1} failed: {e}")
-            if attempt < retries - 1:
-                logging.debug(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
     if sync_done:
         sync_done.set()
 
@@ -154,14 +341,260 @@ def sync_db(database_url, sync_done=None, retries=5, delay=5):
         logging.error(
             "All database sync attempts failed. Last error: %s: %s",
             type(last_error).__name__, last_error)
+    return success
+
+
+def read_events(lines):
+    """Server-sent events from an iterable of lines, as (event, data) pairs
+
+    Only as much of the format as change notifications need: comment lines -
+    which servers send to keep an idle connection open - are skipped, and
+    id: and retry: are ignored, since every event only means "fetch".
+    """
+    event, data = None, []
+    for line in lines:
+        if not line:
+            if event or data:
+                yield event or "message", "\n".join(data)
+            event, data = None, []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+
+class SyncStream:
+    """Change notifications from the sync API, pushed as they happen
+
+    Polling is a trade between freshness and the radio: a card registered on
+    the web waits up to a poll interval to work, and every poll wakes the
+    wifi whether or not anything changed. Here one long-lived request to
+    EVENTS_PATH stays open and the server writes a server-sent event
+    whenever the cards change; `on_change` is called for each one, and for
+    every (re)connect, since whatever happened while disconnected went
+    unannounced.
+
+    The events only say that something changed. The changes themselves are
+    still fetched by sync_db, conditionally and since last_sync, so merging
+    and uploading stay in one place.
+
+    A dropped stream is reopened after a backoff delay, which resets once a
+    connection is made. A server without the endpoint - an older sync API -
+    answers with one of UNSUPPORTED, or with something that is not an event
+    stream; run() then returns False and the caller keeps polling.
+    """
+
+    EVENTS_PATH = "/music/events"
+    UNSUPPORTED = {404, 405, 406, 501}
+    # Well past the keep-alive a server sends on an idle stream, so only a
+    # connection that has actually died times out.
+    READ_TIMEOUT = 90
+    BACKOFF = Backoff(first=1, max_delay=300, jitter=0.5)
+
+    def __init__(self, api_url, headers, on_change, backoff=None):
+        self.url = f"{api_url}{self.EVENTS_PATH}"
+        self.headers = {**headers, "Accept": "text/event-stream",
+                        # Compressed, events would sit in the decoder's buffer.
+                        "Accept-Encoding": "identity"}
+        self.on_change = on_change
+        self.backoff = backoff or self.BACKOFF
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Listen until stopped (True) or the server cannot push (False)"""
+        retry = 0
+        while not self._stop.is_set():
+            try:
+                supported = self._listen()
+                if not supported:
+                    return False
+                retry = 0
+                if self._stop.is_set():
+                    break
+                logging.info("Sync event stream closed; reconnecting")
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                logging.warning("Sync event stream failed: %s", e)
+            finally:
+                self.connected.clear()
+            retry += 1
+            self._stop.wait(self.backoff.delay(retry))
+        return True
+
+    def _listen(self):
+        with session.get(self.url, headers=self.headers, stream=True,
+                         timeout=(SyncSession.TIMEOUT[0],
+                                  self.READ_TIMEOUT)) as response:
+            content_type = response.headers.get("Content-Type", "")
+            if (response.status_code in self.UNSUPPORTED
+                    or (response.status_code == 200
+                        and not content_type.startswith("text/event-stream"))):
+                logging.info("The sync API does not push changes (%s %s); "
+                             "polling instead", response.status_code,
+                             content_type or "no content type")
+                return False
+            response.raise_for_status()
+
+            self.connected.set()
+            logging.info("Listening for sync events")
+            self.on_change()
+            # chunk_size=1: a bigger read would wait for that many bytes,
+            # holding an event back until the next one arrived.
+            lines = response.iter_lines(chunk_size=1, decode_unicode=True)
+            for event, data in read_events(lines):
+                if self._stop.is_set():
+                    break
+                logging.debug("Sync event %s: %s", event, data)
+                self.on_change()
+        return True
+
+    def stop(self):
+        """Stop at the next event, or once the connection ends
+
+        A read blocked on an idle stream cannot be interrupted from another
+        thread: closing the response waits for that very read to finish.
+        The listener is a daemon thread, so shutdown never waits for it.
+        """
+        self._stop.set()
 
 
-def schedule_sync(database_url, sync_done=None, retries=5, delay=5, interval=900):
-    def sync_loop():
+class SyncScheduler:
+    """Decides when to sync next, and runs each sync in a thread of its own
+
+    A fixed interval was wrong at every extreme. With the API unreachable it
+    kept trying - every attempt a full sync_db retry run - as often as when
+    all was well. Right after an unknown card was scanned, when that card
+    is most likely being registered on the web that very minute, it still
+    waited out the whole interval. And in the last minutes before idle
+    shutdown it kept waking the radio for a device about to power off.
+
+    So the wait after each sync is, in order of precedence:
+      - after failures, FAILURE_BACKOFF.delay(failures): from `interval`,
+        doubling up to half an hour, until a sync succeeds again;
+      - after expect_new_card(), EAGER_INTERVAL, for EAGER_FOR seconds;
+      - with a push stream connected, `push_interval`; else `interval`.
+    sync_now() - and every pushed change - cuts the wait short. While
+    paused nothing runs at all; resume() syncs at once if one fell due.
+    """
+
+    EAGER_INTERVAL = 5
+    EAGER_FOR = 120
+    MAX_FAILURE_DELAY = 1800
+
+    def __init__(self, database_url, sync_done=None, backoff=None,
+                 interval=900, push=False, push_interval=900):
+        self.database_url = database_url
+        self.sync_done = sync_done
+        self.backoff = backoff
+        self.interval = interval
+        self.push_interval = push_interval
+        self.failure_backoff = Backoff(first=interval,
+                                       max_delay=self.MAX_FAILURE_DELAY)
+        self.lock = threading.Condition()
+        self.failures = 0
+        self._eager_until = 0
+        self._paused = False
+        self._stopped = False
+        self._wake = threading.Event()
+        self.stream = None
+        if push:
+            self.stream = SyncStream(
+                os.environ.get("SYNC_API_URL", ""),
+                {"Authorization":
+                 f"Bearer {os.environ.get('SYNC_API_TOKEN', '')}"},
+                self.sync_now)
+
+    def start(self):
+        if self.stream:
+            threading.Thread(target=self._listen, name="sync-events",
+                             daemon=True).start()
+        threading.Thread(target=self._run, name="sync", daemon=True).start()
+        return self
+
+    def sync_now(self):
+        """Sync as soon as possible, without waiting out the interval"""
+        self._wake.set()
+
+    def expect_new_card(self):
+        """Poll eagerly for a while: a card was scanned that we do not know"""
+        with self.lock:
+            self._eager_until = time.monotonic() + self.EAGER_FOR
+        self.sync_now()
+
+    def pause(self):
+        with self.lock:
+            if not self._paused:
+                logging.info("Sync paused")
+            self._paused = True
+
+    def resume(self):
+        with self.lock:
+            if self._paused:
+                logging.info("Sync resumed")
+            self._paused = False
+            self.lock.notify_all()
+
+    def stop(self):
+        """No more syncs after the one running, if any; for shutdown"""
+        with self.lock:
+            self._stopped = True
+            self.lock.notify_all()
+        self._wake.set()
+        if self.stream:
+            self.stream.stop()
+
+    def next_delay(self, now=None):
+        """Seconds until the next sync, as things stand"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.failures:
+                return self.failure_backoff.delay(self.failures)
+            if self.stream and self.stream.connected.is_set():
+                delay = self.push_interval
+            else:
+                delay = self.interval
+            if now < self._eager_until:
+                delay = min(delay, self.EAGER_INTERVAL)
+            return delay
+
+    def _listen(self):
+        if not self.stream.run():
+            logging.info("Sync polling every %d seconds", self.interval)
+
+    def _run(self):
         while True:
-            sync_db(database_url, sync_done, retries, delay)
-            logging.debug(f"Next sync in {interval} seconds.")
-            time.sleep(interval)
+            with self.lock:
+                self.lock.wait_for(lambda: self._stopped or not self._paused)
+                if self._stopped:
+                    return
+            # Cleared first: a change announced while sync_db runs sets it
+            # again, and is fetched straight after.
+            self._wake.clear()
+            succeeded = sync_db(self.database_url, self.sync_done,
+                                self.backoff)
+            with self.lock:
+                self.failures = 0 if succeeded else self.failures + 1
+            delay = self.next_delay()
+            logging.debug("Next sync in %.0f seconds.", delay)
+            self._wake.wait(delay)
+
 
-    thread = threading.Thread(target=sync_loop, daemon=True)
-    thread.start()
+def schedule_sync(database_url, sync_done=None, backoff=None, interval=900,
+                  push=False, push_interval=900):
+    """Start a SyncScheduler: sync now, and from then on as it sees fit
+
+    With `push`, a SyncStream runs alongside and triggers a sync the moment
+    the server announces a change. While it is connected polling drops to
+    every `push_interval` seconds - enough to upload cards registered on the
+    device and to cover an event lost in transit. If the stream drops, or
+    the server cannot push at all, it goes back to `interval`.
+    """
+    return SyncScheduler(database_url, sync_done, backoff, interval, push,
+                         push_interval).start()
@@ -1,10 +1,11 @@
 import logging
 import os
 import string
-import time
 
 from evdev import InputDevice, categorize, ecodes, list_devices
 
+from backoff import Backoff
+
 
 class RfidReader:
     KEY_MAP = {f'KEY_{char}': char for char in string.digits +
@@ -14,8 +15,19 @@ class RfidReader:
     # that is merely slow to appear raises FileNotFoundError, which exits the
     # app; systemd then burns StartLimitBurst=5 restarts in well under its 10s
     # window and parks the unit in a failed state until someone intervenes.
-    FIND_RETRIES = 15
-    FIND_DELAY = 2
+    # Set by configure().
+    FIND_BACKOFF = None
+
+    @classmethod
+    def configure(cls):
+        """Read the retry settings from the environment
+
+        Run at import, and again by main once .env is loaded, as
+        utils.configure() is.
+        """
+        cls.FIND_BACKOFF = Backoff.from_env(
+            "RFID_FIND", first=0.25, max_delay=2, deadline=30,
+            max_attempts=20)
 
     def __init__(self, device_name_env="RFID_READER"):
         self.device_name = os.getenv(device_name_env)
@@ -28,18 +40,15 @@ class RfidReader:
 
     def _find_device(self, device_name):
         """Find device with name containing given string, waiting for it"""
-        for attempt in range(self.FIND_RETRIES):
+        for attempt in self.FIND_BACKOFF.attempts():
             for path in list_devices():
                 dev = InputDevice(path)
                 if device_name in dev.name:
                     return dev
                 dev.close()  # otherwise each retry leaks a descriptor
 
-            if attempt < self.FIND_RETRIES - 1:
-                logging.warning(
-                    "No input device matching %r (attempt %d/%d), retrying in %ds",
-                    device_name, attempt + 1, self.FIND_RETRIES, self.FIND_DELAY)
-                time.sleep(self.FIND_DELAY)
+            logging.warning("No input device matching %r (attempt %d)",
+                            device_name, attempt + 1)
 
         raise FileNotFoundError(
             f"No input device found matching: {device_name}")
@@ -58,3 +67,6 @@ class RfidReader:
 
     def close(self):
         self.device.close()
+
+
+RfidReader.configure()
@@ -0,0 +1,299 @@
+import array
+import glob
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import wave
+
+import alsa_pcm
+
+SOUND_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "sounds")
+
+
+def decode(path, rate):
+    """A WAV file as mono 16-bit samples at `rate`
+
+    The sounds/ folder is not uniform - some clips are 24kHz - and one
+    stream can only run at one rate, so everything is converted on load.
+    """
+    with wave.open(path, "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        source_rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if width == 2:
+        samples = array.array("h")
+        samples.frombytes(frames)
+        if sys.byteorder == "big":
+            samples.byteswap()
+    elif width == 1:
+        # 8-bit WAV is unsigned, centred on 128.
+        samples = array.array("h", [(b - 128) << 8 for b in frames])
+    else:
+        raise ValueError(f"{8 * width}-bit samples are not supported")
+
+    if channels > 1:
+        samples = array.array("h", [
+            sum(samples[i:i + channels]) // channels
+            for i in range(0, len(samples), channels)])
+
+    if source_rate != rate:
+        samples = _resample(samples, source_rate, rate)
+    return samples
+
+
+def _resample(samples, source, target):
+    """Linear interpolation, in integer arithmetic to keep loading quick"""
+    if not samples:
+        return samples
+    count = len(samples) * target // source
+    # One extra sample so the last frame can interpolate towards itself.
+    padded = samples + array.array("h", [samples[-1]])
+    return array.array("h", [
+        (padded[j] * (target - r) + padded[j + 1] * r) // target
+        for j, r in (divmod(i * source, target) for i in range(count))])
+
+
+def mix(chunks, frames):
+    """Sum chunks of samples into one, clipped to 16 bits
+
+    Clipping rather than scaling down: effects rarely overlap for long, and
+    halving every clip's volume in case two meet would make them all quiet.
+    """
+    total = [0] * frames
+    for chunk in chunks:
+        for i, sample in enumerate(chunk):
+            total[i] += sample
+    return array.array("h", [max(-32768, min(32767, s)) for s in total])
+
+
+class _Voice:
+    """One playing clip: how far it has got, and when it will be heard out"""
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.position = 0
+        self.done = threading.Event()
+        self.heard_by = 0
+
+
+class _AplayStream:
+    """aplay reading raw PCM from a pipe, where libasound cannot be used"""
+
+    # Nothing here can tell whether the device is shared, so it is assumed
+    # not to be.
+    shared = False
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def write(self, samples):
+        self.process.stdin.write(samples.tobytes())
+        self.process.stdin.flush()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+class SoundEngine:
+    """Sound effects from memory, through one output stream
+
+    Spawning aplay for every click cost a fork, an exec and an ALSA open on
+    each button press, and a burst of presses left a pile of processes
+    fighting over the card. Here every clip is decoded once, up front, and a
+    single mixer thread writes to one PCM held open through libasound - as
+    alsa_mixer holds the mixer. Clips that overlap are mixed into the same
+    stream instead of racing for the device. Without libasound, or with
+    `command` given, the stream is that command reading raw PCM from a pipe,
+    aplay by default.
+
+    Where the device is shared (dmix, which Raspberry Pi OS sets up), the
+    stream stays open for good, and a press costs one write. On a device
+    that is not, a stream held open would lock MPD and spotifyd out, so it
+    is released after IDLE_RELEASE seconds of silence. Which of the two
+    applies is measured when the stream is opened, not assumed.
+    """
+
+    RATE = 44100
+    # 20ms of audio per write: small enough that a new clip joins the stream
+    # promptly, large enough that a Pi Zero mixes it with time to spare.
+    PERIOD = RATE // 50
+    # How far writing may run ahead of what is audible. Everything already
+    # written plays before a clip added now, so this is its worst latency.
+    LEAD = 0.06
+    IDLE_RELEASE = 10
+
+    # Microseconds of audio the device buffers, as aplay's --buffer-time.
+    BUFFER_TIME = 50000
+
+    def __init__(self, folder=SOUND_FOLDER, command=None):
+        self.command = command
+        self.clips = {}
+        self.lock = threading.Condition()
+        self._voices = []
+        self._thread = None
+        self._closing = False
+        self._stream = None
+        # When the audio written so far will have finished playing.
+        self._heard_by = 0
+        self.load(folder)
+
+    def load(self, folder):
+        started = time.monotonic()
+        for path in sorted(glob.glob(os.path.join(folder, "*.wav"))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                self.clips[name] = decode(path, self.RATE)
+            except (OSError, EOFError, wave.Error, ValueError) as e:
+                logging.error("Could not load sound %s: %s", path, e)
+        logging.info("Loaded %d sounds in %.2fs", len(self.clips),
+                     time.monotonic() - started)
+
+    def play(self, name, blocking=False):
+        """Start a clip; with blocking=True, return once it has been heard"""
+        clip = self.clips.get(name)
+        if clip is None:
+            logging.error("No sound loaded for %r", name)
+            return
+
+        voice = _Voice(clip)
+        with self.lock:
+            self._voices.append(voice)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="sound", daemon=True)
+                self._thread.start()
+            self.lock.notify()
+
+        if blocking:
+            voice.done.wait(timeout=len(clip) / self.RATE + 5)
+            # Written is not yet heard: let the stream play it out.
+            remaining = voice.heard_by - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def close(self):
+        """Stop everything now and release the device"""
+        with self.lock:
+            for voice in self._voices:
+                voice.done.set()
+            self._voices = []
+            self._closing = True
+            self.lock.notify()
+            thread = self._thread
+        if thread:
+            thread.join(timeout=2)
+        with self.lock:
+            self._closing = False
+            self._release()
+
+    # --- mixer thread -----------------------------------------------------
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self._voices and not self._closing:
+                    self.lock.wait(self.IDLE_RELEASE)
+                if not self._voices:
+                    if self._closing or not (self._stream
+                                             and self._stream.shared):
+                        self._release()
+                    self._thread = None
+                    return
+                voices = list(self._voices)
+
+            chunks = []
+            for voice in voices:
+                chunks.append(voice.samples[voice.position:
+                                            voice.position + self.PERIOD])
+                voice.position += self.PERIOD
+            if len(chunks) == 1:
+                # The usual case: one clip, nothing to mix.
+                period = chunks[0]
+            else:
+                period = mix(chunks, max(map(len, chunks)))
+
+            written = self._write(period)
+            finished = [voice for voice in voices
+                        if not written or voice.position >= len(voice.samples)]
+            with self.lock:
+                for voice in finished:
+                    voice.heard_by = self._heard_by
+                    voice.done.set()
+                    if voice in self._voices:
+                        # Unless close() has dropped them all meanwhile.
+                        self._voices.remove(voice)
+
+    def _open_stream(self):
+        if self.command is None:
+            try:
+                stream = alsa_pcm.AlsaPcm(self.RATE,
+                                          latency=self.BUFFER_TIME)
+                logging.info("Sound output on %s, %s", stream.device,
+                             "held open (shared)" if stream.shared else
+                             f"released after {self.IDLE_RELEASE}s idle "
+                             "(not shared)")
+                return stream
+            except (alsa_pcm.PcmError, OSError) as e:
+                logging.warning("No direct sound output (%s); using aplay", e)
+                sample_format = ("S16_LE" if sys.byteorder == "little"
+                                 else "S16_BE")
+                self.command = [
+                    "aplay", "-q", "-t", "raw", "-f", sample_format,
+                    "-c", "1", "-r", str(self.RATE),
+                    f"--buffer-time={self.BUFFER_TIME}"]
+        return _AplayStream(self.command)
+
+    def _write(self, samples):
+        """Write to the stream, opening it if need be; False if that failed"""
+        try:
+            if self._stream is None:
+                self._stream = self._open_stream()
+            self._stream.write(samples)
+        except FileNotFoundError:
+            logging.error("aplay is not installed or not found in PATH.")
+            return False
+        except (OSError, alsa_pcm.PcmError) as e:
+            # Reopened for the next clip: aplay may have died, or the
+            # device gone away and come back.
+            logging.error("Sound output failed: %s", e)
+            self._release()
+            return False
+
+        # Keep only LEAD ahead of playback. The pipe and aplay would happily
+        # buffer far more, but a clip started now queues behind all of it.
+        now = time.monotonic()
+        self._heard_by = max(self._heard_by, now) + len(samples) / self.RATE
+        ahead = self._heard_by - now - self.LEAD
+        if ahead > 0:
+            time.sleep(ahead)
+        return True
+
+    def _release(self):
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.close()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The shared engine, loading every sound the first time it is asked"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SoundEngine()
+        return _engine
@@ -1,13 +1,20 @@
+import collections
 import datetime
+import hashlib
 import json
 import logging
 import os
+import random
 import sqlite3
+import threading
 import time
 
 import requests
 
+import paging
 import utils
+from backoff import Backoff
+from http_session import TimeoutSession
 
 
 class SpotifyAuthError(requests.RequestException):
@@ -32,11 +39,70 @@ class SpotifyAuthError(requests.RequestException):
         self.permanent = permanent
 
 
+class SpotifySession(TimeoutSession):
+    """One keep-alive connection pool for every Spotify request we make
+
+    Module-level requests.get() builds a throwaway session per call, so every
+    call paid a fresh TCP and TLS handshake to api.spotify.com - over this
+    Pi's wifi, most of the time between a scan and the first sound. Reusing
+    the connection makes a warm scan one round trip per request instead.
+
+    Shared by the RFID, button and watchdog threads. urllib3's pool is
+    thread-safe and hands each concurrent request its own connection, so the
+    pool is sized for those threads plus a little slack.
+    """
+
+    # Two hosts: accounts.spotify.com for tokens, api.spotify.com for the rest.
+    POOL_CONNECTIONS = 2
+    # The threads above, plus paging.MAX_PARALLEL page fetches at once.
+    POOL_MAXSIZE = 4 + paging.MAX_PARALLEL
+
+    # (connect, read) in seconds. Without a timeout a request stuck on a
+    # half-dead wifi link hangs whichever thread made it - holding
+    # player_lock, in the case of a scan or a button - until TCP gives up,
+    # which can take many minutes.
+    TIMEOUT = (3.05, 10)
+
+    def __init__(self):
+        super().__init__(self.TIMEOUT, self.POOL_MAXSIZE,
+                         pool_connections=self.POOL_CONNECTIONS)
+
+
+session = SpotifySession()
+
+
+
+# systemd-timesyncd creates this once it has synchronised the clock over NTP.
+TIMESYNC_FLAG = "/run/systemd/timesync/synchronized"
+
+
+def _boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def _provable_remaining(cached):
+    """Seconds a cached token is still good for, or None if unknowable
+
+    time.monotonic() counts from boot and cannot be stepped, so within the
+    boot that wrote the cache it is exact. Across a reboot only the wall clock
+    is left, and that is only believed once NTP has set it.
+    """
+    boot_id = _boot_id()
+    if boot_id and cached.get("boot_id") == boot_id:
+        return cached.get("monotonic_expiry", 0) - time.monotonic()
+    if os.path.exists(TIMESYNC_FLAG):
+        return cached.get("expiry", 0) - time.time()
+    return None
+
+
 class SpotifyAuthManager:
-    # Refreshing is only worth retrying for transient failures. These are
-    # class attributes so tests can shrink them.
-    RETRIES = 3
-    RETRY_DELAY = 3
+    # Refreshing is only worth retrying for transient failures. A class
+    # attribute so tests can shrink it; set by configure().
+    BACKOFF = None
     # After Spotify rejects the credentials themselves, stop asking for a
     # while. Every API call goes through get_token(), so without this a dead
     # refresh token means a token request per call - ten per card scan, given
@@ -56,17 +122,119 @@ class SpotifyAuthManager:
         if not self.refresh_token:
             raise ValueError("SPOTIFY_REFRESH_TOKEN environment variable is not set")
 
+        # Held for the whole of a refresh, retries included, so that callers
+        # arriving meanwhile wait for its result instead of each sending a
+        # token request of their own.
+        self.refresh_lock = threading.Lock()
+        self._refresher = None
+        self._stopping = threading.Event()
+
+        self._load_cached_token()
+
     def get_token(self):
-        if not self.token or time.time() >= self.expiry:
-            since_rejected = time.time() - self.rejected_at
-            if self.rejected_at and since_rejected < self.PERMANENT_FAILURE_COOLDOWN:
-                logging.debug(
-                    "Skipping token request: credentials were rejected %.0fs "
-                    "ago, retrying in %.0fs",
-                    since_rejected, self.PERMANENT_FAILURE_COOLDOWN - since_rejected)
-                return None
+        # The fast path takes no lock: a valid token is served even while the
+        # background refresher is busy replacing it.
+        if self.token and time.time() < self.expiry:
+            return self.token
+
+        with self.refresh_lock:
+            # Whoever held the lock before us may just have refreshed.
+            if not self.token or time.time() >= self.expiry:
+                if self._in_cooldown():
+                    return None
+                self._refresh_token()
+            return self.token
+
+    def _in_cooldown(self):
+        since_rejected = time.time() - self.rejected_at
+        if self.rejected_at and since_rejected < self.PERMANENT_FAILURE_COOLDOWN:
+            logging.debug(
+                "Skipping token request: credentials were rejected %.0fs "
+                "ago, retrying in %.0fs",
+                since_rejected, self.PERMANENT_FAILURE_COOLDOWN - since_rejected)
+            return True
+        return False
+
+    # How long before expiry the background refresher replaces the token,
+    # plus up to REFRESH_JITTER more at random so restarts of several devices
+    # on one account do not fall into step. IDLE_RETRY is how often it tries
+    # again while there is no token at all - no network at boot, say.
+    REFRESH_LEAD = 300
+    REFRESH_JITTER = 60
+    IDLE_RETRY = 60
+    # Between failed refreshes while the old token still works. Going
+    # straight back in sent a token request every few seconds for the rest
+    # of an outage, holding refresh_lock nearly throughout.
+    AHEAD_RETRY = Backoff(first=10, max_delay=IDLE_RETRY)
+
+    def start_refresher(self):
+        """Refresh ahead of expiry in the background, off every user action
+
+        Refreshing only on demand meant a token that expired while the device
+        sat idle was renewed by the next scan or button press, which then
+        waited on the token request, and on BACKOFF's retries after it.
+        """
+        if self._refresher and self._refresher.is_alive():
+            return
+        self._stopping.clear()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, name="spotify-token", daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self):
+        self._stopping.set()
+        if self._refresher:
+            self._refresher.join(timeout=1)
+
+    def _next_refresh_in(self):
+        """Seconds until the token should be replaced"""
+        if not self.token:
+            return self.IDLE_RETRY
+        lead = self.REFRESH_LEAD + random.uniform(0, self.REFRESH_JITTER)
+        return max(0, self.expiry - lead - time.time())
+
+    def _retry_ahead_in(self, failures):
+        """Seconds until trying again after `failures` failed refreshes
+
+        Never past the expiry, so that the last try comes while the old token
+        still covers for it, and never less than a second.
+        """
+        delay = self.AHEAD_RETRY.delay(failures)
+        return max(1, min(delay, self.expiry - time.time()))
+
+    def _due(self):
+        """Whether the token is close enough to expiry to be replaced"""
+        return self.expiry - time.time() <= self.REFRESH_LEAD + self.REFRESH_JITTER
+
+    def _refresh_loop(self):
+        failures = 0
+        wait = self._next_refresh_in()
+        while not self._stopping.wait(wait):
+            try:
+                self._refresh_ahead()
+            except Exception as e:
+                # A dead refresher silently puts the refresh back on the
+                # latency path of every scan, so it must outlive any failure.
+                logging.error("Background token refresh failed: %s", e,
+                              exc_info=True)
+            if self.token and self._due():
+                # Failed, and the token we still hold would schedule the
+                # next refresh for right now.
+                failures += 1
+                wait = self._retry_ahead_in(failures)
+            else:
+                failures = 0
+                wait = self._next_refresh_in()
+
+    def _refresh_ahead(self):
+        with self.refresh_lock:
+            if self._in_cooldown():
+                return
+            # An on-demand caller may have refreshed while we slept.
+            if self.token and not self._due():
+                return
+            logging.debug("Refreshing the Spotify token ahead of expiry")
             self._refresh_token()
-        return self.token
 
     def _refresh_token(self):
         logging.debug("Requesting Spotify auth token...")
@@ -79,12 +247,9 @@ class SpotifyAuthManager:
             "Authorization": f"Basic {self.usercreds}",
         }
 
-        retries = self.RETRIES
-        delay = self.RETRY_DELAY
-
-        for attempt in range(retries):
+        for attempt in self.BACKOFF.attempts():
             try:
-                response = requests.post(
+                response = session.post(
                     token_url, data=token_data, headers=token_headers)
 
                 # The reason lives in the body, not the status line. Without
@@ -114,19 +279,83 @@ class SpotifyAuthManager:
                 self.expiry = time.time() + expires_in - 60  # Refresh 1 min before expiry
                 self.rejected_at = 0
                 logging.info("Successfully retrieved Spotify auth token.")
+                self._save_cached_token()
                 return
 
             except requests.RequestException as e:
-                logging.error("Auth token request failed (Attempt %d/%d): %s",
-                              attempt + 1, retries, e, exc_info=True)
-                if attempt < retries - 1:
-                    logging.info("Retrying in %d seconds...", delay)
-                    time.sleep(delay)
-                else:
-                    logging.error(
-                        "Exceeded maximum retries for Spotify auth token request.")
-                    self.token = None
-                    self.expiry = 0
+                logging.error("Auth token request failed (attempt %d): %s",
+                              attempt + 1, e, exc_info=True)
+
+        logging.error(
+            "Exceeded maximum retries for Spotify auth token request.")
+        # A refresh ahead of expiry failing leaves the current token
+        # perfectly usable; only drop one that has run out.
+        if time.time() >= self.expiry:
+            self.token = None
+            self.expiry = 0
+
+    # --- the on-disk copy ---------------------------------------------------
+    #
+    # Without it every restart and every boot paid a token round trip before
+    # anything could play. Reusing a cached token must never mean presenting
+    # an expired one, and this Pi has no RTC: at boot the wall clock sits on a
+    # restored fake-hwclock stamp, behind real time, so a wall-clock expiry
+    # would make a stale token look fresh. So a token is only trusted when its
+    # remaining life can be proved - by the monotonic clock within the same
+    # boot, or by the wall clock once NTP has actually synchronised it.
+
+    def _fingerprint(self):
+        """Ties the cache to these credentials, so a re-authorization voids it"""
+        return hashlib.sha256(
+            f"{self.usercreds}:{self.refresh_token}".encode()).hexdigest()
+
+    def _load_cached_token(self):
+        try:
+            with open(TOKEN_CACHE_PATH) as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logging.debug("No usable cached Spotify token: %s", e)
+            return
+
+        if not isinstance(cached, dict) or cached.get("fingerprint") != self._fingerprint():
+            logging.debug("Cached Spotify token belongs to other credentials")
+            return
+
+        remaining = _provable_remaining(cached)
+        if remaining is None or remaining <= 0:
+            logging.debug("Cached Spotify token is not provably unexpired")
+            return
+
+        self.token = cached.get("access_token")
+        self.expiry = time.time() + remaining
+        logging.info("Reusing cached Spotify token (%.0fs left)", remaining)
+
+    def _save_cached_token(self):
+        """Write the token atomically, readable by this user alone
+
+        Best-effort: losing the cache costs one token request at the next
+        start, nothing else.
+        """
+        remaining = self.expiry - time.time()
+        cached = {
+            "access_token": self.token,
+            "fingerprint": self._fingerprint(),
+            "expiry": self.expiry,
+            "boot_id": _boot_id(),
+            "monotonic_expiry": time.monotonic() + remaining,
+        }
+        tmp_path = f"{TOKEN_CACHE_PATH}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(cached, cache_file)
+                cache_file.flush()
+                os.fsync(cache_file.fileno())
+            # os.open only applies the mode to a file it creates.
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, TOKEN_CACHE_PATH)
+        except OSError as e:
+            logging.warning("Could not cache the Spotify token: %s", e)
 
     @staticmethod
     def _is_permanent_failure(response):
@@ -218,7 +447,7 @@ def device_is_playing():
         if not token:
             return False
 
-        response = requests.get(
+        response = session.get(
             "https://api.spotify.com/v1/me/player",
             headers={"Authorization": "Bearer " + token})
         if response.status_code == 204:
@@ -226,20 +455,171 @@ def device_is_playing():
         response.raise_for_status()
 
         playback = response.json()
-        return ((playback.get("device") or {}).get("id") == device_id
-                and bool(playback.get("is_playing")))
+        is_ours = (playback.get("device") or {}).get("id") == device_id
+        _note_active_device(is_ours)
+        return is_ours and bool(playback.get("is_playing"))
     except (requests.RequestException, ValueError) as e:
         logging.debug("Could not check whether the device is playing: %s", e)
         return False
 
 
+def warm_up(on_done=None):
+    """Get the token, both connections and the device ready before any scan
+
+    Otherwise the first scan after boot pays for everything at once: the token
+    request, DNS for two hosts, two TLS handshakes, and spotifyd's first
+    transfer - all while a child stands there waiting for sound.
+
+    Runs in a daemon thread and returns it. `on_done(ready, seconds)` is called
+    when it finishes, ready being whether a token was obtained. Best-effort
+    throughout: whatever it fails to warm, the first scan simply does itself,
+    exactly as it did before.
+    """
+    def run():
+        started = time.monotonic()
+        ready = False
+        try:
+            ready = _warm_up()
+        except Exception as e:
+            # Nothing here may take the service down; a cold first scan is
+            # the worst outcome a failed warm-up is allowed to have.
+            logging.warning("Spotify warm-up failed: %s", e, exc_info=True)
+        finally:
+            elapsed = time.monotonic() - started
+            logging.info("Spotify warm-up %s in %.2fs",
+                         "finished" if ready else "gave up", elapsed)
+            if on_done:
+                on_done(ready, elapsed)
+
+    thread = threading.Thread(target=run, name="spotify-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def _warm_up():
+    # The token request opens the pooled connection to accounts.spotify.com.
+    if not get_auth_manager().get_token():
+        return False
+
+    try:
+        probe = SpotifyPlayer("warm-up", None, None)
+    except ValueError as e:
+        logging.debug("Skipping the device probe: %s", e)
+        return True
+
+    # The status check opens the connection to api.spotify.com. Transferring
+    # while a phone is playing would pull its audio onto the speaker at every
+    # boot, so the device is only probed when nothing else is in use.
+    playback = probe.check_playback_status()
+    if (playback and playback.get("is_playing")
+            and probe.active_device != probe.device_id):
+        logging.info("Another device is playing; not probing ours at warm-up")
+        return True
+
+    try:
+        probe.transfer_playback(play=False)
+    except SpotifyAuthError as e:
+        logging.debug("Device probe skipped: %s", e)
+    return True
+
+
+# When our device was last seen holding the session, by time.monotonic(), or
+# None. Module-level because it has to outlive the player that saw it: a card
+# switch, the one moment it is needed, is exactly when that player is being
+# replaced by a new one.
+_device_active_at = None
+
+# How long a sighting stays good enough to skip the transfer on. The watchdog
+# looks every STATE_REFRESH_INTERVAL (30s) while a card is loaded, so during
+# a session this never goes stale.
+ACTIVE_DEVICE_MAX_AGE = 60
+
+
+def _note_active_device(is_ours):
+    global _device_active_at
+    _device_active_at = time.monotonic() if is_ours else None
+
+
+def device_recently_active():
+    """Whether our device was seen holding the session moments ago
+
+    When it was, transferring playback to it before playing is a round trip
+    that changes nothing, and it sits directly between a scan and the sound.
+    """
+    seen = _device_active_at
+    return seen is not None and time.monotonic() - seen < ACTIVE_DEVICE_MAX_AGE
+
+
+def _is_device_not_found(e):
+    """Whether a failed request was Spotify no longer knowing our device"""
+    response = getattr(e, "response", None)
+    if response is None or response.status_code != 404:
+        return False
+    try:
+        error = (response.json() or {}).get("error") or {}
+    except ValueError:
+        # A bare 404 from a device-addressed endpoint can only be the device.
+        return True
+    if not isinstance(error, dict):
+        error = {"message": str(error)}
+    return (error.get("reason") == "NO_ACTIVE_DEVICE"
+            or "device" in (error.get("message") or "").lower())
+
+
 _auth_manager = None
 
 
+# One playlist entry, reduced to what is read of it. Entries arrive as a
+# track wrapped in an item wrapped in a page, any level of which Spotify may
+# send as null; the null checks live here rather than at every caller.
+PlaylistTrack = collections.namedtuple(
+    "PlaylistTrack", ["uri", "duration_ms", "album_uri", "album_name"])
+
+
+def playlist_tracks(page):
+    """The entries of one /playlists/{id}/tracks page, as PlaylistTrack"""
+    for entry in page.get("items") or []:
+        track = (entry or {}).get("track") or {}
+        album = track.get("album") or {}
+        yield PlaylistTrack(track.get("uri"), track.get("duration_ms") or 0,
+                            album.get("uri"), album.get("name"))
+
+
+def configure():
+    """Read this module's settings from the environment
+
+    Run at import, and again by main once .env is loaded, as
+    utils.configure() is.
+    """
+    global TOKEN_CACHE_PATH
+
+    # Where the current access token is kept between restarts. Beside the
+    # database by default, like the series cache.
+    TOKEN_CACHE_PATH = os.environ.get("SPOTIFY_TOKEN_CACHE",
+                                      "spotify_token.json")
+
+    SpotifyAuthManager.BACKOFF = Backoff.from_env(
+        "SPOTIFY_AUTH", first=1, max_delay=4, deadline=20, max_attempts=3)
+
+
+configure()
+
+
+_auth_manager_lock = threading.Lock()
+
+
 def get_auth_manager():
+    """The one SpotifyAuthManager of the process, built on first use
+
+    Under a lock: at startup the warm-up thread and main thread ask for it
+    at the same moment. Each used to build one of its own, and whichever
+    lost the race took its token - or the background refresher - with it.
+    """
     global _auth_manager
     if _auth_manager is None:
-        _auth_manager = SpotifyAuthManager()
+        with _auth_manager_lock:
+            if _auth_manager is None:
+                _auth_manager = SpotifyAuthManager()
     return _auth_manager
 
 
@@ -269,6 +649,10 @@ class SpotifyPlayer:
         self.playing = False
         self.active_device = None
         self.playback_started = False
+        # Set by create_player when it built this player without transferring
+        # playback first, trusting a recent sighting of the device. play()
+        # then owes a transfer if that trust turns out to be misplaced.
+        self.skipped_transfer = False
         # (position_ms, time.monotonic()) of the last reading we believed.
         # Purely diagnostic today: it lets an impossible position be compared
         # against how much time really elapsed, which is the one measurement
@@ -297,7 +681,7 @@ class SpotifyPlayer:
         url = f"{self.base_url}/me/player"
         data = {"device_ids": [self.device_id], "play": play}
         try:
-            response = requests.put(
+            response = session.put(
                 url, headers=self._get_headers(), json=data)
             response.raise_for_status()
             logging.info("Playback transferred to device %s", self.device_id)
@@ -564,7 +948,7 @@ class SpotifyPlayer:
 
     def check_playback_status(self):
         try:
-            response = requests.get(
+            response = session.get(
                 f"{self.base_url}/me/player", headers=self._get_headers())
             if response.status_code == 204:
                 self.active_device = None
@@ -579,6 +963,7 @@ class SpotifyPlayer:
             # enough - it only applies when the key is absent.
             device_id = (playback.get("device") or {}).get("id")
             self.active_device = device_id
+            _note_active_device(device_id == self.device_id)
             self.playing = (device_id == self.device_id) and playback.get(
                 "is_playing")
             # Free position update: we already have the payload, and every
@@ -592,7 +977,6 @@ class SpotifyPlayer:
             return None
 
     def play(self):
-        url = self._device_url("play")
         position = (self.playback_state.get("offset") or {}).get("position", 0)
         position_ms = self.playback_state.get("position_ms", 0)
 
@@ -603,22 +987,59 @@ class SpotifyPlayer:
         }
 
         try:
-            response = requests.put(
-                url, headers=self._get_headers(), json=data)
-            response.raise_for_status()
-            self.playing = True
-            self.playback_started = True
-            self.active_device = self.device_id
-            self._note_intended_position(position_ms)
-            logging.info(
-                "Started playback from beginning at position %d (%d ms)", position, position_ms)
+            self._put_play(data)
         except requests.RequestException as e:
-            self.handle_exception("Playback failed", e, audible=True)
+            if not self._recover_inactive_device(e):
+                self.handle_exception("Playback failed", e, audible=True)
+                return
+            try:
+                self._put_play(data)
+            except requests.RequestException as e:
+                self.handle_exception("Playback failed", e, audible=True)
+                return
+
+        self.playing = True
+        self.playback_started = True
+        self.active_device = self.device_id
+        _note_active_device(True)
+        self._note_intended_position(position_ms)
+        logging.info(
+            "Started playback from beginning at position %d (%d ms)", position, position_ms)
+
+    def _put_play(self, data):
+        response = session.put(
+            self._device_url("play"), headers=self._get_headers(), json=data)
+        response.raise_for_status()
+
+    def _recover_inactive_device(self, e):
+        """Transfer to our device after skipping that turned out to be wrong
+
+        Only for a player built on create_player's fast path, and only when
+        Spotify says the device is gone: spotifyd restarting since we last
+        looked, typically. Returns True when it is ready for another try.
+        """
+        if not self.skipped_transfer or not _is_device_not_found(e):
+            return False
+
+        self.skipped_transfer = False
+        _note_active_device(False)
+        logging.info("Device %s was not active after all; transferring "
+                     "playback before trying again", self.device_id)
+        # The same budget create_player would have spent, had it not skipped.
+        for attempt in utils.PLAYER_BACKOFF.attempts():
+            try:
+                if self.transfer_playback(play=False) and self.is_ready():
+                    return True
+            except SpotifyAuthError:
+                return False
+            logging.warning("Spotify player not ready (attempt %d)",
+                            attempt + 1)
+        return False
 
     def resume_playback(self):
         url = self._device_url("play")
         try:
-            response = requests.put(url, headers=self._get_headers(), json={})
+            response = session.put(url, headers=self._get_headers(), json={})
             response.raise_for_status()
             self.playing = True
             self.playback_started = True
@@ -633,7 +1054,7 @@ class SpotifyPlayer:
             return
         url = self._device_url("pause")
         try:
-            response = requests.put(url, headers=self._get_headers())
+            response = session.put(url, headers=self._get_headers())
             response.raise_for_status()
             self.playing = False
             # We have now driven this player's playback, so a later button
@@ -684,7 +1105,7 @@ class SpotifyPlayer:
             return
         url = self._device_url("next")
         try:
-            response = requests.post(url, headers=self._get_headers())
+            response = session.post(url, headers=self._get_headers())
             response.raise_for_status()
             self.playing = True
             self._forget_good_position()
@@ -697,7 +1118,7 @@ class SpotifyPlayer:
         url = (f"{self.base_url}/me/player/seek"
                f"?position_ms=0&device_id={self.device_id}")
         try:
-            response = requests.put(url, headers=self._get_headers())
+            response = session.put(url, headers=self._get_headers())
             response.raise_for_status()
             self.playing = True
             self._note_intended_position(0)
@@ -722,7 +1143,7 @@ class SpotifyPlayer:
 
         url = self._device_url("previous")
         try:
-            response = requests.post(url, headers=self._get_headers())
+            response = session.post(url, headers=self._get_headers())
             response.raise_for_status()
             self.playing = True
             self._forget_good_position()
@@ -735,7 +1156,7 @@ class SpotifyPlayer:
         data = {"context_uri": self._context_uri(),
                 "offset": {"position": 0}, "position_ms": 0}
         try:
-            response = requests.put(
+            response = session.put(
                 url, headers=self._get_headers(), json=data)
             response.raise_for_status()
             self.playing = True
@@ -816,45 +1237,117 @@ class SpotifyPlayer:
     # /albums/{id}/tracks rejects anything above 50 with "Invalid limit", while
     # /playlists/{id}/tracks allows 100. Using the lower bound for both keeps
     # one code path; the extra request on long playlists is irrelevant here,
-    # since this only runs on a card switch or shutdown.
+    # since the listing is cached and only fetched again once it changes.
     PAGE_LIMIT = 50
 
-    def _find_track_index(self, url, track_uri, uri_of):
-        """Absolute index of track_uri within a paginated context listing"""
+    # Albums never change their track list, so every album shares this in
+    # place of a snapshot_id.
+    ALBUM_VERSION = "album"
+
+    # What the playlist listings are trimmed to, with Spotify's `fields`
+    # filter. Unfiltered, every track and its album come with images,
+    # artists, external IDs and available_markets - nearly two hundred
+    # country codes each - and a page of 50 runs to hundreds of kilobytes,
+    # all of it decoded on the Pi to read one or three values per track.
+    # `total` and `next` are what paging.fetch_pages() goes by.
+    #
+    # The album and player endpoints have no such filter. /me/player, polled
+    # every 30 seconds, is a single object of a few kilobytes whatever we
+    # do; /albums/{id}/tracks already lists simplified tracks, and only once
+    # per album.
+    TRACK_URI_FIELDS = "items(track(uri)),total,next"
+    EPISODE_FIELDS = "items(track(duration_ms,album(uri,name))),total,next"
+
+    def _fetch_track_uris(self, url, uris_of, fields=None):
+        """Every track URI of a paginated context listing, in context order
+
+        `uris_of(page)` yields the URIs of one page; `fields`, for a playlist
+        listing, trims each page to them.
+        """
         headers = self._get_headers()
-        params = {"limit": self.PAGE_LIMIT, "offset": 0}
+        params = {"limit": self.PAGE_LIMIT}
+        if fields:
+            params["fields"] = fields
 
-        while True:
-            response = requests.get(url, headers=headers, params=params)
+        def get_page(offset):
+            response = session.get(url, headers=headers,
+                                   params=dict(params, offset=offset))
             response.raise_for_status()
-            page = response.json()
+            return response.json()
 
-            for index, entry in enumerate(page.get("items", [])):
-                if uri_of(entry) == track_uri:
-                    # Offset of the page plus position within it. Returning the
-                    # bare index put every match beyond the first page up to
-                    # 100 tracks too early.
-                    return params["offset"] + index
+        return [uri
+                for page in paging.fetch_pages(get_page, self.PAGE_LIMIT)
+                for uri in uris_of(page)]
 
-            if not page.get("next"):
-                return None
-            params["offset"] += params["limit"]
+    def _track_offsets(self, context_uri, version, url, uris_of,
+                       fields=None):
+        """uri -> offset within a context, from cache while `version` holds
+
+        Paging the listing to find one track cost a request per 50 tracks on
+        every card switch and shutdown - four for a long audiobook playlist,
+        all while the child waits for the next card to start. The listing is
+        cached per context instead, keyed on the playlist's snapshot_id as
+        the series cache is, so resolving an offset is a lookup.
+
+        Without a version (the snapshot could not be read) the listing is
+        fetched and not cached; should that fail too, a cached listing of
+        unknown age still beats resuming from the first track.
+        """
+        cached = utils.read_track_index(context_uri)
+        if cached and version and cached.get("version") == version:
+            uris = cached.get("uris", [])
+        else:
+            try:
+                uris = self._fetch_track_uris(url, uris_of, fields)
+            except requests.RequestException:
+                if not cached:
+                    raise
+                logging.warning("Could not read the tracks of %s; using the "
+                                "cached listing", context_uri)
+                uris = cached.get("uris", [])
+            else:
+                if version:
+                    utils.write_track_index(context_uri, version, uris)
+
+        offsets = {}
+        for offset, uri in enumerate(uris):
+            # The first occurrence, for a track a playlist repeats.
+            offsets.setdefault(uri, offset)
+        return offsets
+
+    def _playlist_snapshot_id(self, playlist_id):
+        try:
+            response = session.get(
+                f"{self.base_url}/playlists/{playlist_id}",
+                headers=self._get_headers(),
+                params={"fields": "snapshot_id"})
+            response.raise_for_status()
+            return (response.json() or {}).get("snapshot_id")
+        except requests.RequestException as e:
+            self.handle_exception("Reading the playlist snapshot failed", e)
+            return None
 
     def _get_track_position_in_playlist(self, playlist_id, track_uri):
-        index = self._find_track_index(
+        index = self._track_offsets(
+            f"spotify:playlist:{playlist_id}",
+            self._playlist_snapshot_id(playlist_id),
             f"{self.base_url}/playlists/{playlist_id}/tracks",
-            track_uri,
-            lambda entry: (entry.get("track") or {}).get("uri"))
+            lambda page: [track.uri for track in playlist_tracks(page)],
+            self.TRACK_URI_FIELDS).get(track_uri)
         if index is None:
             logging.warning("Track URI not found in playlist")
             return 0  # fallback
         return index
 
     def _get_track_position_in_album(self, album_id, track_uri):
-        index = self._find_track_index(
-            f"{self.base_url}/albums/{album_id}/tracks",
-            track_uri,
-            lambda entry: entry.get("uri"))
+        def uris_of(page):
+            return [(entry or {}).get("uri")
+                    for entry in page.get("items") or []]
+
+        index = self._track_offsets(
+            f"spotify:album:{album_id}", self.ALBUM_VERSION,
+            f"{self.base_url}/albums/{album_id}/tracks", uris_of
+        ).get(track_uri)
         if index is None:
             logging.warning("Track URI not found in album")
             return 0  # fallback
@@ -921,9 +1414,25 @@ class SpotifySeriesPlayer(SpotifyPlayer):
     # seconds, so the last sample before the end can be well short of it.
     FINISHED_TOLERANCE_MS = 45000
 
+    # A cached episode map checked against the playlist this recently is
+    # used as it is. Older, it is still used - but checked again behind
+    # playback.
+    EPISODES_FRESH_FOR = 600
+    # When each playlist's cached map was last found current, by monotonic
+    # clock. Per process: recording it on disk would cost a flash write for
+    # every check.
+    _validated_at = {}
+
     def __init__(self, rfid, playback_state, location):
         super().__init__(rfid, playback_state, location)
         self.playlist_id = location.split(":")[-1]
+        # Guards episodes and episode_index together, for a map swapped in
+        # by the background check while a button moves between episodes.
+        # Readers take it too: between the two assignments a shorter map
+        # sits beside the old index. Re-entrant, since _swap_episodes()
+        # finds the current episode while holding it.
+        self.episodes_lock = threading.RLock()
+        self.revalidation = None
         self.episodes = self._load_episodes()
 
         index = self.playback_state.get("episode", 0)
@@ -943,23 +1452,38 @@ class SpotifySeriesPlayer(SpotifyPlayer):
 
         logging.info("Series %s: %d episodes, starting at episode %d",
                      rfid, len(self.episodes), self.episode_index + 1)
+        if self.revalidation:
+            self.revalidation.start()
 
     # --- the series definition -------------------------------------------
 
     def _load_episodes(self):
-        """Ordered episodes of the playlist, from cache when it is still valid
+        """Ordered episodes of the playlist, from cache whenever there is one
 
-        Paging an 80-episode playlist is a dozen-odd requests, far too slow to
-        repeat on every scan while a child waits for sound. The playlist's
+        Paging an 80-episode playlist is a dozen-odd requests - two round
+        trips' worth even fetched in parallel - too slow to repeat on every
+        scan while a child waits for sound. The playlist's
         snapshot_id changes whenever it is edited, so one cheap request tells
-        us whether the cached map is still good.
+        us whether the cached map is still good - but even that one used to
+        stand between every series scan and sound, for a map that is nearly
+        always current. So a cached map is used straight away, and the check
+        runs in the background (see _revalidate_episodes); only without one
+        does the scan wait for the playlist.
         """
-        snapshot = self._playlist_snapshot()
         cached = utils.read_series_cache(self.playlist_id)
+        if cached and cached.get("episodes"):
+            checked = self._validated_at.get(self.playlist_id)
+            if checked is None or (time.monotonic() - checked
+                                   > self.EPISODES_FRESH_FOR):
+                # Started once the player is built, so that a map swapped
+                # in cannot be overwritten by the one returned here.
+                self.revalidation = threading.Thread(
+                    target=self._revalidate_episodes,
+                    args=(cached.get("snapshot_id"),),
+                    name="series-check", daemon=True)
+            return cached["episodes"]
 
-        if cached and snapshot and cached.get("snapshot_id") == snapshot:
-            return cached.get("episodes", [])
-
+        snapshot = self._playlist_snapshot()
         try:
             episodes = self._fetch_episodes()
         except (requests.RequestException, ValueError) as e:
@@ -970,19 +1494,45 @@ class SpotifySeriesPlayer(SpotifyPlayer):
 
         if episodes and snapshot:
             utils.write_series_cache(self.playlist_id, snapshot, episodes)
+            self._validated_at[self.playlist_id] = time.monotonic()
         return episodes
 
+    def _revalidate_episodes(self, cached_snapshot):
+        """Check the cached map behind playback; swap in a new one if stale"""
+        snapshot = self._playlist_snapshot()
+        if not snapshot:
+            return  # Try again on the next scan.
+        if snapshot != cached_snapshot:
+            try:
+                episodes = self._fetch_episodes()
+            except (requests.RequestException, ValueError) as e:
+                self.handle_exception("Reading the series playlist failed", e)
+                return
+            if not episodes:
+                return
+            utils.write_series_cache(self.playlist_id, snapshot, episodes)
+            self._swap_episodes(episodes)
+        self._validated_at[self.playlist_id] = time.monotonic()
+
+    def _swap_episodes(self, episodes):
+        """Replace the map, keeping the child on the episode they are in
+
+        By album rather than by index: an episode inserted before the
+        current one would otherwise move them on by one.
+        """
+        with self.episodes_lock:
+            current = self.current_episode()
+            uris = [episode["uri"] for episode in episodes]
+            if current and current["uri"] in uris:
+                index = uris.index(current["uri"])
+            else:
+                index = min(self.episode_index, len(episodes) - 1)
+            logging.info("Series %s changed: %d episodes, now at episode %d",
+                         self.rfid, len(episodes), index + 1)
+            self.episodes, self.episode_index = episodes, index
+
     def _playlist_snapshot(self):
-        try:
-            response = requests.get(
-                f"{self.base_url}/playlists/{self.playlist_id}",
-                headers=self._get_headers(),
-                params={"fields": "snapshot_id"})
-            response.raise_for_status()
-            return (response.json() or {}).get("snapshot_id")
-        except requests.RequestException as e:
-            self.handle_exception("Reading the playlist snapshot failed", e)
-            return None
+        return self._playlist_snapshot_id(self.playlist_id)
 
     def _fetch_episodes(self):
         """Group the playlist's tracks into episodes by album identity
@@ -993,39 +1543,39 @@ class SpotifySeriesPlayer(SpotifyPlayer):
         """
         url = f"{self.base_url}/playlists/{self.playlist_id}/tracks"
         headers = self._get_headers()
-        params = {"limit": self.PAGE_LIMIT, "offset": 0}
-        episodes = []
 
-        while True:
-            response = requests.get(url, headers=headers, params=params)
+        def get_page(offset):
+            response = session.get(
+                url, headers=headers,
+                params={"limit": self.PAGE_LIMIT, "offset": offset,
+                        "fields": self.EPISODE_FIELDS})
             response.raise_for_status()
-            page = response.json()
+            return response.json()
 
-            for entry in page.get("items", []):
-                track = entry.get("track") or {}
-                album = track.get("album") or {}
-                uri = album.get("uri")
-                if not uri:
+        episodes = []
+        # Grouped only once every page is in, and in playlist order: a run
+        # of one album may well straddle two pages.
+        for page in paging.fetch_pages(get_page, self.PAGE_LIMIT):
+            for track in playlist_tracks(page):
+                if not track.album_uri:
                     # Removed tracks, local files and podcast episodes all
                     # arrive without a usable album.
                     continue
 
-                if not episodes or episodes[-1]["uri"] != uri:
-                    episodes.append({"uri": uri,
-                                     "title": album.get("name"),
+                if not episodes or episodes[-1]["uri"] != track.album_uri:
+                    episodes.append({"uri": track.album_uri,
+                                     "title": track.album_name,
                                      "durations": []})
-                episodes[-1]["durations"].append(track.get("duration_ms") or 0)
-
-            if not page.get("next"):
-                return episodes
-            params["offset"] += params["limit"]
+                episodes[-1]["durations"].append(track.duration_ms)
+        return episodes
 
     # --- where we are in the series ---------------------------------------
 
     def current_episode(self):
-        if not self.episodes:
-            return None
-        return self.episodes[self.episode_index]
+        with self.episodes_lock:
+            if not self.episodes:
+                return None
+            return self.episodes[self.episode_index]
 
     def _current_episode_finished(self):
         """Whether the stored position sits at the end of the current episode
@@ -1050,16 +1600,18 @@ class SpotifySeriesPlayer(SpotifyPlayer):
 
     def _advance_episode(self, step, reason):
         """Move by whole episodes, wrapping so a card never goes dead"""
-        if not self.episodes:
-            return
-        previous = self.episode_index
-        self.episode_index = (self.episode_index + step) % len(self.episodes)
-        self.playback_state = {"episode": self.episode_index,
+        with self.episodes_lock:
+            if not self.episodes:
+                return
+            previous = self.episode_index
+            self.episode_index = index = ((self.episode_index + step)
+                                          % len(self.episodes))
+            title = self.episodes[index].get("title")
+        self.playback_state = {"episode": index,
                                "offset": {"position": 0},
                                "position_ms": 0}
-        logging.info("Episode %d -> %d (%s): %s", previous + 1,
-                     self.episode_index + 1, reason,
-                     (self.current_episode() or {}).get("title"))
+        logging.info("Episode %d -> %d (%s): %s", previous + 1, index + 1,
+                     reason, title)
 
     def next_episode(self):
         self._advance_episode(+1, reason="next episode")
@@ -1083,13 +1635,15 @@ class SpotifySeriesPlayer(SpotifyPlayer):
         Still exact: a podcast pushed from a phone is not in this set, so it
         is never adopted.
         """
-        if not self.episodes:
-            return {self.location}
-        return {episode["uri"] for episode in self.episodes}
+        with self.episodes_lock:
+            if not self.episodes:
+                return {self.location}
+            return {episode["uri"] for episode in self.episodes}
 
     def _state_from_playback(self, playback):
         state = super()._state_from_playback(playback)
-        state["episode"] = self.episode_index
+        with self.episodes_lock:
+            state["episode"] = self.episode_index
         return state
 
     def _persist_state(self, state):
@@ -1097,6 +1651,7 @@ class SpotifySeriesPlayer(SpotifyPlayer):
         # otherwise drop the episode, silently resetting the child to the
         # first one on the next scan.
         state = dict(state or {})
-        state["episode"] = self.episode_index
+        with self.episodes_lock:
+            state["episode"] = self.episode_index
         self.playback_state = state
         return super()._persist_state(state)
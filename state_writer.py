@@ -0,0 +1,114 @@
+import logging
+import sqlite3
+import threading
+import time
+
+import database
+
+
+class StateWriter:
+    """Writes playback states from one thread, batched and behind the caller
+
+    Saving a position used to open a connection, commit - an fsync on the SD
+    card - and close, every 30 seconds of playback and on every card switch.
+    Here the caller only queues the state. A writer thread holding the one
+    connection waits DELAY seconds for more to arrive, then writes whatever
+    has gathered in a single transaction. Several saves for the same card
+    collapse into its latest.
+
+    What is still queued is lost if the process dies, which is why shutdown
+    calls flush(): that writes everything before returning.
+    """
+
+    DELAY = 2
+
+    def __init__(self, database_url, delay=DELAY):
+        self.database_url = database_url
+        self.delay = delay
+        self.lock = threading.Condition()
+        self._pending = {}
+        self._writing = False
+        self._flush_requested = False
+        self._thread = None
+
+    def put(self, rfid, playback_state):
+        """Queue a state, as the JSON text stored in music.playback_state"""
+        with self.lock:
+            self._pending[rfid] = playback_state
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="state-writer", daemon=True)
+                self._thread.start()
+            self.lock.notify_all()
+
+    def flush(self, timeout=5):
+        """Write everything queued now; True once nothing is left unwritten"""
+        with self.lock:
+            if not self._pending and not self._writing:
+                return True
+            self._flush_requested = True
+            self.lock.notify_all()
+            done = self.lock.wait_for(
+                lambda: not self._pending and not self._writing, timeout)
+            if done:
+                self._flush_requested = False
+        if not done:
+            logging.error("Playback states still unwritten after %ss",
+                          timeout)
+        return done
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self._pending:
+                    self.lock.wait()
+                # Let more saves gather, unless someone is waiting on them.
+                self.lock.wait_for(lambda: self._flush_requested, self.delay)
+                batch, self._pending = self._pending, {}
+                self._flush_requested = False
+                self._writing = True
+
+            try:
+                db = database.connect(self.database_url)
+                with db:
+                    db.executemany(
+                        "UPDATE music SET playback_state = ? WHERE rfid = ?",
+                        [(state, rfid) for rfid, state in batch.items()])
+                logging.debug("Wrote playback state for %d card(s)",
+                              len(batch))
+                failed = False
+            except sqlite3.Error as e:
+                logging.error("Could not write playback states: %s", e)
+                failed = True
+
+            with self.lock:
+                if failed:
+                    # Retried with the next batch. A state queued meanwhile
+                    # is newer than the failed one, so it wins.
+                    for rfid, state in batch.items():
+                        self._pending.setdefault(rfid, state)
+                self._writing = False
+                self.lock.notify_all()
+            if failed:
+                # Do not spin against a database that keeps refusing; a
+                # waiting flush() gives up on its own timeout.
+                time.sleep(self.delay)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database_url):
+    with _writers_lock:
+        writer = _writers.get(database_url)
+        if writer is None:
+            writer = _writers[database_url] = StateWriter(database_url)
+        return writer
+
+
+def flush_all(timeout=5):
+    """Write every queued state, in every database; for shutdown"""
+    with _writers_lock:
+        writers = list(_writers.values())
+    return all([writer.flush(timeout) for writer in writers])
@@ -8,7 +8,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 
 @pytest.fixture(autouse=True)
-def spotify_env(monkeypatch):
+def spotify_env(monkeypatch, tmp_path):
     """Give every test valid Spotify credentials and a clean auth manager
 
     SpotifyPlayer.__init__ builds the auth manager eagerly, so any test that
@@ -22,7 +22,9 @@ def spotify_env(monkeypatch):
     where most of the suite's runtime used to go.
 
     Tests that exercise SpotifyAuthManager itself construct it directly and are
-    unaffected by the singleton.
+    unaffected by the singleton. The token cache is pointed at a scratch
+    file, so they neither read a token a previous test left behind nor write
+    one into the working tree.
     """
     # A real .env leaking in (some modules call load_dotenv) would otherwise
     # decide which branch utils.shutdown() takes, and the os._exit() branch
@@ -34,8 +36,20 @@ def spotify_env(monkeypatch):
     monkeypatch.setenv("SPOTIFY_DEVICE_ID", "test_device")
 
     import spotify
+    monkeypatch.setattr(spotify, "TOKEN_CACHE_PATH",
+                        str(tmp_path / "spotify_token.json"))
     stub = MagicMock()
     stub.get_token.return_value = "test_access_token"
     spotify._auth_manager = stub
+    # Otherwise a sighting of the device in one test sends create_player down
+    # its fast path in the next.
+    spotify._device_active_at = None
+    import utils
+    monkeypatch.setattr(utils, "TRACK_INDEX_CACHE_PATH",
+                        str(tmp_path / "track_index_cache"))
+    # An index loaded by one test would answer the next one's scans.
+    import card_index
+    monkeypatch.setattr(card_index, "_index", card_index.CardIndex())
     yield
     spotify._auth_manager = None
+    spotify._device_active_at = None
@@ -0,0 +1,43 @@
+"""The -M volume mapping, which has to agree with what amixer showed"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import patch
+
+from alsa_mixer import DB_GAIN_MUTE, db_to_fraction, fraction_to_db, open_mixer
+
+# The Pi's headphone PCM control: -102.39dB to +4.00dB.
+PI_RANGE = (-10239, 400)
+
+
+def test_the_ends_of_the_range_map_to_0_and_100():
+    assert db_to_fraction(PI_RANGE[1], *PI_RANGE) == 1
+    assert round(db_to_fraction(PI_RANGE[0], *PI_RANGE), 6) == 0
+
+
+def test_a_wide_range_follows_the_ear_not_the_decibels():
+    # Halfway in dB is nowhere near half as loud.
+    halfway = (PI_RANGE[0] + PI_RANGE[1]) // 2
+    assert db_to_fraction(halfway, *PI_RANGE) < 0.2
+
+
+def test_setting_then_reading_round_trips():
+    for percent in range(0, 101, 10):
+        value = fraction_to_db(percent / 100, *PI_RANGE)
+        assert round(100 * db_to_fraction(value, *PI_RANGE)) == percent
+
+
+def test_a_narrow_range_is_linear():
+    assert db_to_fraction(-1200, -2400, 0) == 0.5
+    assert fraction_to_db(0.5, -2400, 0) == -1200
+
+
+def test_a_range_down_to_mute_reaches_silence():
+    assert fraction_to_db(0, DB_GAIN_MUTE, 0) == DB_GAIN_MUTE
+
+
+def test_without_libasound_there_is_no_mixer():
+    with patch("alsa_mixer.ctypes.util.find_library", return_value=None):
+        assert open_mixer("PCM") is None
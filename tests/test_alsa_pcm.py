@@ -0,0 +1,55 @@
+"""The libasound PCM, against a stand-in for the library"""
+import array
+import errno
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import MagicMock, patch
+
+from alsa_pcm import SND_PCM_NONBLOCK, AlsaPcm
+
+
+def fake_libasound(busy_when_open=False, writes=()):
+    lib = MagicMock()
+
+    def snd_pcm_open(handle, name, stream, mode):
+        if mode == SND_PCM_NONBLOCK and busy_when_open:
+            return -errno.EBUSY
+        return 0
+
+    lib.snd_pcm_open.side_effect = snd_pcm_open
+    lib.snd_pcm_set_params.return_value = 0
+    lib.snd_pcm_recover.return_value = 0
+    lib.snd_pcm_writei.side_effect = list(writes)
+    lib.snd_strerror.return_value = b"Device or resource busy"
+    return lib
+
+
+def open_pcm(lib):
+    with patch("alsa_pcm._load_libasound", return_value=lib):
+        return AlsaPcm(44100)
+
+
+def test_a_device_that_opens_twice_is_shared():
+    assert open_pcm(fake_libasound()).shared
+
+
+def test_a_busy_device_is_not_shared():
+    assert not open_pcm(fake_libasound(busy_when_open=True)).shared
+
+
+def test_an_underrun_is_recovered_and_the_rest_written():
+    lib = fake_libasound(writes=[100, -errno.EPIPE, 341])
+    pcm = open_pcm(lib)
+    samples = array.array("h", [0] * 441)
+    pcm.write(samples)
+
+    lib.snd_pcm_recover.assert_called_once()
+    address = samples.buffer_info()[0]
+    offsets = [call.args[1] - address
+               for call in lib.snd_pcm_writei.call_args_list]
+    frames = [call.args[2] for call in lib.snd_pcm_writei.call_args_list]
+    assert offsets == [0, 200, 200]
+    assert frames == [441, 341, 341]
@@ -0,0 +1,53 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import patch
+
+from backoff import Backoff
+
+
+def test_delays_start_short_and_grow_to_the_cap():
+    policy = Backoff(first=0.2, factor=2, max_delay=1, jitter=0)
+    assert [policy.delay(n) for n in range(1, 5)] == [0.2, 0.4, 0.8, 1]
+
+
+def test_jitter_stays_within_its_band():
+    policy = Backoff(first=1, max_delay=1, jitter=0.2)
+    for _ in range(100):
+        assert 0.8 <= policy.delay(1) <= 1.2
+
+
+def test_attempts_are_capped_and_the_last_is_not_followed_by_a_sleep():
+    with patch("backoff.time.sleep") as sleep:
+        assert list(Backoff(max_attempts=4).attempts()) == [0, 1, 2, 3]
+    assert sleep.call_count == 3
+
+
+def test_the_deadline_ends_retrying_and_caps_the_last_wait():
+    clock = iter([0, 9.5, 11])
+    with patch("backoff.time.monotonic", side_effect=lambda: next(clock)), \
+            patch("backoff.time.sleep") as sleep:
+        attempts = list(Backoff(first=5, max_delay=5, jitter=0,
+                                deadline=10).attempts())
+    assert attempts == [0, 1]
+    # Only half a second of the deadline was left, so that is all it waited.
+    sleep.assert_called_once_with(0.5)
+
+
+def test_environment_overrides_defaults(monkeypatch):
+    monkeypatch.setenv("PLAYER_RETRY_FIRST", "0.5")
+    monkeypatch.setenv("PLAYER_RETRY_ATTEMPTS", "3")
+    policy = Backoff.from_env("PLAYER", first=0.2, max_attempts=15,
+                              deadline=15)
+    assert policy.first == 0.5
+    assert policy.max_attempts == 3
+    assert policy.deadline == 15
+
+
+def test_a_malformed_override_is_ignored(monkeypatch, caplog):
+    monkeypatch.setenv("SYNC_RETRY_DEADLINE", "soon")
+    policy = Backoff.from_env("SYNC", deadline=60)
+    assert policy.deadline == 60
+    assert "SYNC_RETRY_DEADLINE" in caplog.text
@@ -140,7 +140,7 @@ class TestTogglingWithNoPlayer:
 
         with patch.object(player, "_device_url", return_value="http://x"), \
                 patch.object(player, "_get_headers", return_value={}), \
-                patch("spotify.requests.put", return_value=MagicMock(
+                patch("spotify.session.put", return_value=MagicMock(
                     raise_for_status=MagicMock(return_value=None))):
             player.pause_playback()
 
@@ -198,18 +198,28 @@ class TestMixerDetection:
             assert self._handler()._detect_mixer_control() is None
 
 
+def _volume_handler(current, mixer=None):
+    """A handler with only the volume machinery, reading `current`"""
+    import buttons
+    h = buttons.PlayerActionHandler.__new__(buttons.PlayerActionHandler)
+    h.mixer_control = "PCM"
+    h.mixer = mixer
+    h.volume_lock = threading.Condition()
+    h._volume_pending = None
+    h._volume_worker = None
+    h._current_volume = lambda: current
+    return h
+
+
 class TestVolume:
     def _handler(self, current):
-        import buttons
-        h = buttons.PlayerActionHandler.__new__(buttons.PlayerActionHandler)
-        h.mixer_control = "PCM"
-        h._current_volume = lambda: current
-        return h
+        return _volume_handler(current)
 
     def test_step_up(self):
         h = self._handler(50)
         with patch("buttons.subprocess.run") as run, patch("buttons.utils"):
             h._set_volume(+10)
+            assert h._wait_for_volume()
         assert "60%" in run.call_args.args[0]
 
     def test_clamped_to_max(self):
@@ -218,6 +228,7 @@ class TestVolume:
         h = self._handler(buttons.PlayerActionHandler.VOLUME_MAX - 5)
         with patch("buttons.subprocess.run") as run, patch("buttons.utils"):
             h._set_volume(+10)
+            assert h._wait_for_volume()
         assert f"{buttons.PlayerActionHandler.VOLUME_MAX}%" in run.call_args.args[0]
 
     def test_at_the_end_stop_says_so(self):
@@ -235,6 +246,49 @@ class TestVolume:
         run.assert_not_called()
         u.play_sound.assert_called_once_with("error")
 
+    def test_the_open_mixer_is_used_without_forking(self):
+        mixer = MagicMock()
+        h = _volume_handler(50, mixer=mixer)
+        with patch("buttons.subprocess.run") as run, patch("buttons.utils"):
+            h._set_volume(-10)
+            assert h._wait_for_volume()
+        run.assert_not_called()
+        mixer.set_volume.assert_called_once_with(40)
+
+    def test_presses_during_a_write_coalesce(self):
+        """A held key must not queue one mixer write per repeat frame"""
+        writing = threading.Event()
+        release = threading.Event()
+        written = []
+
+        def slow_set(target):
+            written.append(target)
+            writing.set()
+            release.wait(2)
+
+        mixer = MagicMock()
+        mixer.set_volume.side_effect = slow_set
+        h = _volume_handler(20, mixer=mixer)
+        with patch("buttons.utils"):
+            h._set_volume(+10)
+            assert writing.wait(2)
+            for _ in range(4):
+                h._set_volume(+10)
+            release.set()
+            assert h._wait_for_volume()
+        # 20 -> 30 was in flight; the other four frames became one write.
+        assert written == [30, 70]
+
+    def test_a_failed_write_is_audible_and_dropped(self):
+        from alsa_mixer import MixerError
+        mixer = MagicMock()
+        mixer.set_volume.side_effect = MixerError("gone")
+        h = _volume_handler(50, mixer=mixer)
+        with patch("buttons.utils") as u:
+            h._set_volume(+10)
+            assert h._wait_for_volume()
+        u.play_sound.assert_called_once_with("error")
+
 
 # --- IR socket handling ------------------------------------------------------
 
@@ -344,10 +398,7 @@ def test_volume_up_at_full_refuses_rather_than_clamping():
 
     Clamping there turned a volume-up press into a volume *cut*.
     """
-    import buttons
-    h = buttons.PlayerActionHandler.__new__(buttons.PlayerActionHandler)
-    h.mixer_control = "PCM"
-    h._current_volume = lambda: 100
+    h = _volume_handler(100)
 
     with patch("buttons.subprocess.run") as run, patch("buttons.utils") as u:
         h._set_volume(+10)
@@ -357,10 +408,7 @@ def test_volume_up_at_full_refuses_rather_than_clamping():
 
 
 def test_volume_down_at_zero_refuses():
-    import buttons
-    h = buttons.PlayerActionHandler.__new__(buttons.PlayerActionHandler)
-    h.mixer_control = "PCM"
-    h._current_volume = lambda: 0
+    h = _volume_handler(0)
 
     with patch("buttons.subprocess.run") as run, patch("buttons.utils") as u:
         h._set_volume(-10)
@@ -0,0 +1,105 @@
+"""Scans answered from memory, and kept in step with the database"""
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from unittest.mock import MagicMock, patch
+
+import card_index
+import db_setup
+import remote_sync
+import utils
+from backoff import Backoff
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "toem.db")
+    db_setup.create_db(path)
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "INSERT INTO music (rfid, source, location, title, last_modified)"
+            " VALUES ('a1', 'spotify', 'spotify:album:a1', 'Album',"
+            " '2026-08-18 13:00:00')")
+    monkeypatch.setenv("DATABASE_URL", path)
+    monkeypatch.setenv("SYNC_API_URL", "https://example.invalid")
+    return path
+
+
+@pytest.fixture
+def index(db_path):
+    with sqlite3.connect(db_path) as db:
+        card_index.get_index().load(db)
+    return card_index.get_index()
+
+
+def test_a_scan_makes_no_sqlite_calls(index):
+    db = MagicMock()
+    data = utils.get_music_data(db, "a1")
+    assert data["location"] == "spotify:album:a1"
+    assert utils.get_music_data(db, "unknown") is None
+    db.cursor.assert_not_called()
+    db.execute.assert_not_called()
+
+
+def test_saved_playback_state_is_seen_by_the_next_scan(index):
+    utils.persist_playback_state("a1", {"track": 3, "position": 1200})
+    assert utils.get_music_data(None, "a1")["playback_state"] == \
+        '{"track": 3, "position": 1200}'
+
+
+def test_synced_cards_reach_the_index(index, db_path):
+    utils.persist_playback_state("a1", {"track": 2, "position": 0})
+    remote = [
+        {"rfid": "a1", "source": "spotify", "location": "spotify:album:new",
+         "title": "Renamed", "last_modified": "2026-08-19 08:45:00"},
+        {"rfid": "b2", "source": "local", "location": "Some Album",
+         "title": "New card", "last_modified": "2026-08-19 08:45:00"},
+    ]
+    with patch("remote_sync.fetch_remote_items", return_value=remote), \
+            patch("remote_sync.session.post") as post:
+        post.return_value.status_code = 200
+        remote_sync.sync_db(db_path, backoff=Backoff(max_attempts=1))
+
+    renamed = utils.get_music_data(None, "a1")
+    assert renamed["title"] == "Renamed"
+    # Sync never touches playback state, and neither does its index update.
+    assert renamed["playback_state"] == '{"track": 2, "position": 0}'
+    assert utils.get_music_data(None, "b2")["source"] == "local"
+
+
+def test_a_failed_merge_leaves_the_index_alone(index, db_path):
+    remote = [{"rfid": "b2", "source": "local", "location": "x",
+               "title": "New card", "last_modified": "2026-08-19 08:45:00"}]
+    merge = remote_sync.merge_remote_items
+
+    def merge_then_fail(cursor, items):
+        merge(cursor, items)
+        raise sqlite3.OperationalError("disk I/O error")
+
+    with patch("remote_sync.fetch_remote_items", return_value=remote), \
+            patch("remote_sync.merge_remote_items",
+                  side_effect=merge_then_fail):
+        remote_sync.sync_db(db_path, backoff=Backoff(max_attempts=1))
+    assert utils.get_music_data(None, "b2") is None
+    with sqlite3.connect(db_path) as db:
+        assert db.execute(
+            "SELECT 1 FROM music WHERE rfid = 'b2'").fetchone() is None
+
+
+def test_cards_merged_before_a_failed_upload_are_kept(index, db_path):
+    """Each batch is committed as it is merged, and indexed with it"""
+    remote = [{"rfid": "b2", "source": "local", "location": "x",
+               "title": "New card", "last_modified": "2026-08-19 08:45:00"}]
+    with patch("remote_sync.fetch_remote_items", return_value=remote), \
+            patch("remote_sync.session.post") as post:
+        post.return_value.status_code = 500
+        assert not remote_sync.sync_db(db_path,
+                                       backoff=Backoff(max_attempts=1))
+    assert utils.get_music_data(None, "b2")["title"] == "New card"
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT last_sync FROM sync_meta"
+                          " WHERE id = 1").fetchone() in (None, (None,))
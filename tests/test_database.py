@@ -0,0 +1,89 @@
+"""Per-thread connections, reused, with lock waits and query times recorded"""
+import os
+import sqlite3
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import database
+import db_setup
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "toem.db")
+    db_setup.create_db(path)
+    yield path
+    database.get(path).close_all()
+
+
+def in_thread(function):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_a_thread_keeps_its_connection(db_path):
+    assert database.connect(db_path) is database.connect(db_path)
+
+
+def test_each_thread_gets_its_own(db_path):
+    mine = database.connect(db_path)
+    theirs = in_thread(lambda: database.connect(db_path))
+    assert theirs is not mine
+
+
+def test_writes_commit_and_roll_back_as_before(db_path):
+    db = database.connect(db_path)
+    with db:
+        db.execute("INSERT INTO music (rfid, source, location)"
+                   " VALUES ('a1', 'local', 'x')")
+    with pytest.raises(sqlite3.IntegrityError):
+        with db:
+            db.execute("INSERT INTO music (rfid, source, location)"
+                       " VALUES ('b2', 'local', 'x')")
+            db.execute("INSERT INTO music (rfid, source, location)"
+                       " VALUES ('a1', 'local', 'x')")
+
+    with sqlite3.connect(db_path) as check:
+        rows = check.execute("SELECT rfid FROM music").fetchall()
+    assert rows == [("a1",)]
+
+
+def test_queries_and_lock_waits_are_counted(db_path):
+    db = database.connect(db_path)
+    db.execute("SELECT * FROM music").fetchall()
+    with db:
+        db.execute("INSERT INTO music (rfid, source, location)"
+                   " VALUES ('a1', 'local', 'x')")
+        db.execute("UPDATE music SET title = 't' WHERE rfid = 'a1'")
+
+    stats = database.get(db_path).stats()
+    assert stats["queries"] == 3
+    # One transaction, so the write lock was waited for once.
+    assert stats["lock_waits"] == 1
+
+
+def test_a_long_lock_wait_is_logged(db_path, caplog):
+    # Another thread holds the write lock for a while.
+    holder = database.connect(db_path)
+    holder.execute("INSERT INTO music (rfid, source, location)"
+                   " VALUES ('a1', 'local', 'x')")
+    release = threading.Timer(0.3, holder.commit)
+    release.start()
+
+    def write():
+        db = database.connect(db_path)
+        with db:
+            db.execute("UPDATE music SET title = 't' WHERE rfid = 'a1'")
+
+    with caplog.at_level("WARNING"):
+        in_thread(write)
+    release.join()
+    assert "write lock" in caplog.text
+    assert database.get(db_path).stats()["max_lock_wait"] >= 0.2
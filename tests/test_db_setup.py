@@ -0,0 +1,78 @@
+"""Schema migrations, driven by PRAGMA user_version"""
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import db_setup
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "toem.db")
+
+
+def pragma(path, name):
+    with sqlite3.connect(path) as db:
+        return db.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def test_a_new_database_gets_every_migration(path):
+    db_setup.create_db(path)
+    assert pragma(path, "user_version") == len(db_setup.MIGRATIONS)
+    assert pragma(path, "journal_mode") == "wal"
+    with sqlite3.connect(path) as db:
+        indexes = [row[1] for row in db.execute("PRAGMA index_list(music)")]
+    assert "music_last_modified" in indexes
+
+
+def test_a_database_from_before_migrations_is_brought_up_to_date(path):
+    """Devices in the field have the tables but user_version 0"""
+    legacy = sqlite3.connect(path)
+    db_setup.create_tables(legacy)
+    legacy.execute("INSERT INTO music (rfid, source, location)"
+                   " VALUES ('a1', 'local', 'x')")
+    legacy.commit()
+    legacy.close()
+
+    db = db_setup.connect(path)
+    assert db_setup.migrate(db) == len(db_setup.MIGRATIONS)
+    assert db.execute("SELECT rfid FROM music").fetchall() == [("a1",)]
+    db.close()
+    assert pragma(path, "journal_mode") == "wal"
+
+
+def test_migrating_an_up_to_date_database_does_nothing(path, monkeypatch):
+    db_setup.create_db(path)
+    applied = []
+    monkeypatch.setattr(db_setup, "MIGRATIONS", [
+        lambda db: applied.append("old")] * len(db_setup.MIGRATIONS))
+    db = db_setup.connect(path)
+    db_setup.migrate(db)
+    db.close()
+    assert applied == []
+
+
+def test_only_new_migrations_run(path, monkeypatch):
+    db_setup.create_db(path)
+
+    def add_column(db):
+        db.execute("ALTER TABLE music ADD COLUMN artwork TEXT")
+
+    monkeypatch.setattr(db_setup, "MIGRATIONS",
+                        db_setup.MIGRATIONS + [add_column])
+    db = db_setup.connect(path)
+    assert db_setup.migrate(db) == len(db_setup.MIGRATIONS)
+    columns = [row[1] for row in db.execute("PRAGMA table_info(music)")]
+    db.close()
+    assert "artwork" in columns
+
+
+def test_connections_use_normal_sync(path):
+    db = db_setup.connect(path)
+    # 1 is NORMAL; the default is FULL (2).
+    assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+    db.close()
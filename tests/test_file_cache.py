@@ -0,0 +1,65 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import patch
+
+import file_cache
+
+
+def test_each_key_is_a_file_of_its_own(tmp_path):
+    cache = file_cache.FileCache(str(tmp_path / "cache"))
+    cache.put("pl1", {"snapshot_id": "a"})
+    cache.put("spotify:album:x", {"version": "album"})
+
+    assert sorted(os.listdir(tmp_path / "cache")) == [
+        "pl1.json", "spotify_album_x.json"]
+    assert json.loads((tmp_path / "cache" / "pl1.json").read_text()) == {
+        "snapshot_id": "a"}
+
+
+def test_reads_come_from_memory_after_the_first(tmp_path):
+    path = str(tmp_path / "cache")
+    file_cache.FileCache(path).put("pl1", {"snapshot_id": "a"})
+
+    cache = file_cache.FileCache(path)
+    assert cache.get("pl1") == {"snapshot_id": "a"}
+    with patch("builtins.open") as mock_open:
+        assert cache.get("pl1") == {"snapshot_id": "a"}
+        assert cache.get("pl1") == {"snapshot_id": "a"}
+    mock_open.assert_not_called()
+
+
+def test_a_write_that_fails_leaves_the_previous_entry(tmp_path):
+    """A power cut mid-write must not take the entry with it"""
+    path = str(tmp_path / "cache")
+    file_cache.FileCache(path).put("pl1", {"snapshot_id": "a"})
+
+    with patch("file_cache.json.dump", side_effect=OSError("power cut")):
+        file_cache.FileCache(path).put("pl1", {"snapshot_id": "b"})
+
+    assert file_cache.FileCache(path).get("pl1") == {"snapshot_id": "a"}
+    assert os.listdir(path) == ["pl1.json"]
+
+
+def test_a_corrupt_entry_is_a_miss_and_spares_the_others(tmp_path):
+    path = tmp_path / "cache"
+    file_cache.FileCache(str(path)).put("pl1", {"snapshot_id": "a"})
+    file_cache.FileCache(str(path)).put("pl2", {"snapshot_id": "b"})
+    (path / "pl1.json").write_text("{ half written")
+
+    cache = file_cache.FileCache(str(path))
+    assert cache.get("pl1") is None
+    assert cache.get("pl2") == {"snapshot_id": "b"}
+
+
+def test_the_old_single_file_cache_is_replaced(tmp_path):
+    path = tmp_path / "series_cache"
+    path.write_text(json.dumps({"pl1": {"snapshot_id": "old"}}))
+
+    cache = file_cache.FileCache(str(path))
+    assert cache.get("pl1") is None
+    cache.put("pl1", {"snapshot_id": "new"})
+    assert file_cache.FileCache(str(path)).get("pl1") == {"snapshot_id": "new"}
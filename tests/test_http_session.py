@@ -0,0 +1,25 @@
+"""The pooled session both API clients build on"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from unittest.mock import patch
+
+from http_session import TimeoutSession
+
+
+def test_every_request_gets_the_timeout_unless_it_brings_one():
+    session = TimeoutSession((1, 2), pool_maxsize=3)
+    with patch("requests.Session.request") as request:
+        session.get("https://example.invalid/")
+        session.get("https://example.invalid/", timeout=9)
+    assert [call.kwargs["timeout"] for call in request.call_args_list] == [
+        (1, 2), 9]
+
+
+def test_both_schemes_share_one_sized_pool():
+    session = TimeoutSession((1, 2), pool_maxsize=3)
+    adapter = session.get_adapter("https://example.invalid")
+    assert session.get_adapter("http://example.invalid") is adapter
+    assert adapter._pool_maxsize == 3
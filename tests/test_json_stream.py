@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import json_stream
+
+ITEMS = [{"rfid": "a1", "title": "Die drei ??? – Folge 1", "n": 12345},
+         [1, 2], "comma, ] bracket", None, 1.5e3, True, -0.25]
+
+
+def split(text, size):
+    body = text.encode("utf-8")
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 4096])
+def test_elements_survive_any_chunking(size):
+    """Down to one byte at a time: mid-character, mid-number, mid-string"""
+    text = json.dumps(ITEMS, ensure_ascii=False)
+    assert list(json_stream.iter_array(split(text, size))) == ITEMS
+
+
+def test_an_empty_array_yields_nothing():
+    assert list(json_stream.iter_array([b" [ ", b"]\n"])) == []
+
+
+def test_elements_are_yielded_before_the_body_ends():
+    def chunks():
+        yield b'[{"rfid": "a1"},'
+        raise AssertionError("read past the first element")
+
+    assert next(json_stream.iter_array(chunks())) == {"rfid": "a1"}
+
+
+@pytest.mark.parametrize("text", ["{}", "[1 2]", "[1,2", "[1],", "[,1]",
+                                  "[1,]", ""])
+def test_anything_but_a_whole_array_is_an_error(text):
+    with pytest.raises(ValueError):
+        list(json_stream.iter_array(split(text, 1)))
+
+
+def test_batched_keeps_order_and_the_remainder():
+    assert list(json_stream.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(json_stream.batched([], 2)) == []
@@ -1,107 +1,200 @@
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import sqlite3
+
 import pytest
 from unittest.mock import patch
+
+import state_writer
 from local import AudioPlayer
+from mpd_client import MpdError
+
+
+class FakeMpd:
+    """Records what AudioPlayer sends, and answers `status` from a dict"""
+
+    def __init__(self, status=None):
+        self.sent = []
+        self.status_reply = status or {}
+
+    def command(self, name, *args):
+        self.sent.append([(name, *args)])
+        return []
+
+    def command_list(self, commands):
+        self.sent.append(list(commands))
+        if ("status",) in commands:
+            return list(self.status_reply.items())
+        return []
+
+    def status(self):
+        return dict(self.status_reply)
+
+    def commands(self):
+        return [command[0] for batch in self.sent for command in batch]
 
-def setup_in_memory_db():
-    import sqlite3
-    db = sqlite3.connect(":memory:")
-    cursor = db.cursor()
-    cursor.execute("""
-        CREATE TABLE music(
-            rfid TEXT PRIMARY KEY,
-            source TEXT NOT NULL,
-            playback_state TEXT,
-            location TEXT NOT NULL,
-            title TEXT
-        );
-    """)
-    db.commit()
-    return db
 
-def test_audioplayer_initialization():
-    db = None
+class FakeWatcher:
+    """A watcher that is never connected unless a test says otherwise"""
+
+    def __init__(self):
+        self.status = None
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def snapshot(self):
+        return None if self.status is None else dict(self.status)
+
+
+@pytest.fixture
+def mpd():
+    fake = FakeMpd()
+    with patch("local.get_client", return_value=fake), \
+            patch("local.get_watcher", return_value=FakeWatcher()):
+        yield fake
+
+
+@pytest.fixture
+def watcher(mpd):
+    with patch("local.get_watcher", return_value=FakeWatcher()) as get:
+        yield get.return_value
+
+
+def test_audioplayer_initialization(mpd):
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
     assert player.rfid == "rfid1"
     assert player.location == "/music/track1.mp3"
-    assert player.playback_state == {"track": 1, "position": "0%"}
+    assert player.playback_state == {"track": 1, "position": 0}
     assert not player.playing
 
     # With playback_state
-    state = '{"track": 2, "position": "50%"}'
+    state = '{"track": 2, "position": 12.5}'
     player2 = AudioPlayer("rfid2", state, "/music/track2.mp3")
-    assert player2.playback_state == {"track": 2, "position": "50%"}
+    assert player2.playback_state == {"track": 2, "position": 12.5}
 
-def test_toggle_playback_and_pause():
-    db = None
-    player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.system") as mock_system:
-        player.toggle_playback()
-        assert player.playing
-        mock_system.assert_called_with("mpc -q toggle")
-        player.pause_playback()
-        assert not player.playing
-        mock_system.assert_called_with("mpc -q pause")
-
-def test_restart_playback():
-    db = None
-    player = AudioPlayer("rfid1", '{"track": 3, "position": "75%"}', "/music/track1.mp3")
-    with patch("os.system") as mock_system:
-        player.restart_playback()
-        assert player.playback_state == {"track": 1, "position": "0%"}
-        assert player.playing
-        # play() is called, so mpc commands should be issued
-        assert mock_system.call_count >= 3 
-
-def test_check_playback_status_playing():
-    db = None
+
+def test_toggle_playback_and_pause(mpd):
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.popen") as mock_popen:
-        mock_popen.return_value.readlines.return_value = ["", "[playing] #1/10 3:45/45:12 (8%)"]
-        player.check_playback_status()
-        assert player.playing
+    mpd.status_reply = {"state": "stop"}
+    player.toggle_playback()
+    assert player.playing
+    assert mpd.sent[-1] == [("play",)]
+
+    mpd.status_reply = {"state": "play"}
+    player.toggle_playback()
+    assert not player.playing
+    assert mpd.sent[-1] == [("pause", 1)]
+
+    player.pause_playback()
+    assert not player.playing
+    assert mpd.sent[-1] == [("pause", 1)]
+
+
+def test_restart_playback(mpd):
+    player = AudioPlayer("rfid1", '{"track": 3, "position": 75}', "/music/track1.mp3")
+    player.restart_playback()
+    assert player.playback_state == {"track": 1, "position": 0}
+    assert player.playing
+    assert mpd.sent[-1][-2] == ("seek", 0, "0.0")
+
 
-def test_check_playback_status_paused():
-    db = None
+def test_check_playback_status_playing(mpd):
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.popen") as mock_popen:
-        mock_popen.return_value.readlines.return_value = ["", "[paused] #1/10 3:45/45:12 (8%)"]
-        player.check_playback_status()
-        assert not player.playing
+    mpd.status_reply = {"state": "play"}
+    player.check_playback_status()
+    assert player.playing
 
-def test_play():
-    db = None
+
+def test_check_playback_status_paused(mpd):
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.system") as mock_system:
+    player.playing = True
+    mpd.status_reply = {"state": "pause"}
+    player.check_playback_status()
+    assert not player.playing
+
+
+def test_play_is_one_batch(mpd):
+    """Clearing, loading and seeking used to be five forks of mpc"""
+    player = AudioPlayer("rfid1", '{"track": 3, "position": 47.2}',
+                         "Some Album")
+    player.play()
+    assert player.playing
+    assert mpd.sent == [[("clear",), ("add", "Some Album"),
+                         ("seek", 2, "47.2"), ("status",)]]
+
+
+def test_play_converts_a_percentage_saved_by_mpc(mpd):
+    """States written by the mpc version must still resume in place"""
+    player = AudioPlayer("rfid1", '{"track": "2", "position": "25%"}',
+                         "Some Album")
+    mpd.status_reply = {"duration": "200.0"}
+    player.play()
+    assert mpd.sent[0] == [("clear",), ("add", "Some Album"), ("play", 1),
+                           ("status",)]
+    assert mpd.sent[1] == [("seekcur", "50.0")]
+
+
+def test_play_failure_is_audible(mpd):
+    player = AudioPlayer("rfid1", None, "Missing Album")
+
+    def refuse(commands):
+        raise MpdError("ACK [50@1] {add} No such directory")
+
+    mpd.command_list = refuse
+    with patch("utils.play_sound") as sound:
         player.play()
-        assert player.playing
-        # Should call mpc commands: clear/add, play track, seek position
-        assert mock_system.call_count >= 3
+    assert not player.playing
+    sound.assert_called_once_with("playback_error")
+
+
+@pytest.mark.parametrize("state, start", [
+    ('{"track": 9, "position": 47.2}', ("seek", 8, "47.2")),
+    ('{"track": "9", "position": "25%"}', ("play", 8)),
+])
+def test_a_track_gone_from_the_folder_starts_the_first(mpd, state, start):
+    """As mpc did, rather than leaving the card loaded but silent"""
+    player = AudioPlayer("rfid1", state, "Shorter Album")
+    mpd.status_reply = {"playlist": "7", "duration": "200.0"}
+    answer = mpd.command_list
+
+    def refuse_the_saved_track(commands):
+        if start in commands:
+            mpd.sent.append(list(commands))
+            raise MpdError(f"ACK [2@2] {{{start[0]}}} Bad song index")
+        return answer(commands)
+
+    mpd.command_list = refuse_the_saved_track
+    with patch("utils.play_sound") as sound:
+        player.play()
+
+    assert mpd.sent[-1] == [("play", 0), ("status",)]
+    assert len(mpd.sent) == 2  # and no seek into the first track
+    assert player.playing
+    assert player.queue_version == "7"
+    sound.assert_not_called()
+
 
-def test_next_track():
-    db = None
+def test_next_track(mpd):
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.system") as mock_system:
-        player.next_track()
-        assert player.playing
-        mock_system.assert_called_with("mpc -q next")
+    player.next_track()
+    assert player.playing
+    assert mpd.sent[-1] == [("next",)]
 
-def test_previous_track():
-    db = None
+
+def test_previous_track(mpd):
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.system") as mock_system:
-        player.previous_track()
-        assert player.playing
-        mock_system.assert_called_with("mpc -q prev")
+    player.previous_track()
+    assert player.playing
+    assert mpd.sent[-1] == [("previous",)]
+
 
-def test_save_playback_state(tmp_path, monkeypatch):
+def test_save_playback_state(tmp_path, monkeypatch, mpd):
     # Must be a file, not :memory: - the state is persisted through a fresh
     # connection opened against DATABASE_URL, so it has to be reachable by path.
-    import json
-    import sqlite3
-
     database_url = str(tmp_path / "test.db")
     monkeypatch.setenv("DATABASE_URL", database_url)
 
@@ -122,12 +215,9 @@ def test_save_playback_state(tmp_path, monkeypatch):
     db.commit()
 
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.popen") as mock_popen:
-        mock_popen.return_value.read.return_value = "3"
-        mock_popen.return_value.readlines.return_value = ["", "track info (45%)"]
-        with patch("re.search") as mock_search:
-            mock_search.return_value.group.return_value = "45%"
-            player.save_playback_state()
+    mpd.status_reply = {"state": "play", "song": "2", "elapsed": "95.312"}
+    player.save_playback_state()
+    assert state_writer.flush_all()
 
     # Read back through a separate connection: proves the write was committed,
     # not just left pending in an open transaction.
@@ -138,23 +228,87 @@ def test_save_playback_state(tmp_path, monkeypatch):
 
     assert result is not None
     assert result[0] is not None, "playback_state was not persisted"
-    # Both values come from the same mocked os.popen().read()
-    assert json.loads(result[0]) == {"track": "3", "position": "3"} 
+    # MPD's song is 0-based; the stored track stays 1-based, as mpc's was.
+    assert json.loads(result[0]) == {"track": 3, "position": 95.3}
+
+
+def test_save_keeps_the_position_when_nothing_is_current(mpd):
+    player = AudioPlayer("rfid1", '{"track": 4, "position": 30}', "x")
+    mpd.status_reply = {"state": "stop"}
+    with patch("utils.persist_playback_state") as persist:
+        player.save_playback_state()
+    persist.assert_called_once_with("rfid1", {"track": 4, "position": 30})
 
-def test_previous_restarts_the_track_when_past_the_threshold():
-    """Same rule as SpotifyPlayer, via mpc"""
+
+def test_previous_restarts_the_track_when_past_the_threshold(mpd):
+    """Same rule as SpotifyPlayer, via MPD"""
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.popen") as mock_popen, patch("os.system") as mock_system:
-        mock_popen.return_value.readlines.return_value = [
-            "Some Track", "[playing] #3/12   0:47/3:21 (23%)"]
-        player.previous_track()
-    mock_system.assert_called_with("mpc -q seek 0")
+    mpd.status_reply = {"state": "play", "elapsed": "47.0"}
+    player.previous_track()
+    assert mpd.sent[-1] == [("seekcur", 0)]
 
 
-def test_previous_skips_back_near_the_start():
+def test_previous_skips_back_near_the_start(mpd):
     player = AudioPlayer("rfid1", None, "/music/track1.mp3")
-    with patch("os.popen") as mock_popen, patch("os.system") as mock_system:
-        mock_popen.return_value.readlines.return_value = [
-            "Some Track", "[playing] #3/12   0:01/3:21 (0%)"]
-        player.previous_track()
-    mock_system.assert_called_with("mpc -q prev")
+    mpd.status_reply = {"state": "play", "elapsed": "1.2"}
+    player.previous_track()
+    assert mpd.sent[-1] == [("previous",)]
+
+
+def test_status_comes_from_the_watcher_when_connected(watcher, mpd):
+    player = AudioPlayer("rfid1", None, "x")
+    watcher.status = {"state": "play", "elapsed": "47.0"}
+    mpd.status = lambda: pytest.fail("asked MPD despite a live snapshot")
+    player.previous_track()
+    assert mpd.sent[-1] == [("seekcur", 0)]
+
+
+def test_a_track_change_is_saved_from_the_event(watcher, mpd):
+    mpd.status_reply = {"playlist": "7"}
+    player = AudioPlayer("rfid1", None, "x")
+    player.play()
+    with patch("utils.persist_playback_state") as persist:
+        player._on_mpd_change(
+            {"playlist": "7", "state": "play", "songid": "1", "song": "0"},
+            {"playlist": "7", "state": "play", "songid": "2", "song": "1",
+             "elapsed": "0.4"})
+    persist.assert_called_once_with("rfid1", {"track": 2, "position": 0.4})
+
+
+def test_pausing_is_saved_from_the_event(watcher, mpd):
+    mpd.status_reply = {"playlist": "7"}
+    player = AudioPlayer("rfid1", None, "x")
+    player.play()
+    with patch("utils.persist_playback_state") as persist:
+        player._on_mpd_change(
+            {"playlist": "7", "state": "play", "songid": "1", "song": "0"},
+            {"playlist": "7", "state": "pause", "songid": "1", "song": "0",
+             "elapsed": "61.25"})
+    assert not player.playing
+    persist.assert_called_once_with("rfid1", {"track": 1, "position": 61.2})
+
+
+def test_events_for_another_cards_queue_are_ignored(watcher, mpd):
+    mpd.status_reply = {"playlist": "7"}
+    player = AudioPlayer("rfid1", None, "x")
+    player.play()
+    with patch("utils.persist_playback_state") as persist:
+        player._on_mpd_change(
+            {"playlist": "7", "state": "play", "songid": "1"},
+            {"playlist": "9", "state": "play", "songid": "5", "song": "0"})
+    persist.assert_not_called()
+
+
+def test_the_timer_leaves_saving_to_events_while_connected(watcher, mpd):
+    player = AudioPlayer("rfid1", None, "x")
+    player.playing = True
+    watcher.status = {"state": "play"}
+    with patch.object(player, "save_playback_state") as save:
+        assert player.refresh_playback_state() is False
+    save.assert_not_called()
+
+    # Disconnected: back to saving on the timer.
+    watcher.status = None
+    with patch.object(player, "save_playback_state") as save:
+        assert player.refresh_playback_state() is True
+    save.assert_called_once_with()
@@ -1,6 +1,7 @@
 import os
 import sys
 import threading
+import time
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -9,6 +10,7 @@ from unittest.mock import MagicMock, patch
 
 import buttons
 from main import RFIDMusicPlayer
+from remote_sync import SyncScheduler
 
 
 @pytest.fixture(params=[buttons.GpioButtonHandler, buttons.IrReceiver],
@@ -24,6 +26,83 @@ def app(request):
     return application
 
 
+def test_settings_from_dotenv_are_read_after_it_is_loaded(monkeypatch):
+    """The modules are imported before .env is; their settings must follow"""
+    import remote_sync
+    import spotify
+    import utils
+    from rfid import RfidReader
+    for module, name in ((utils, "PLAYER_BACKOFF"),
+                         (utils, "SERIES_CACHE_PATH"),
+                         (utils, "TRACK_INDEX_CACHE_PATH"),
+                         (spotify, "TOKEN_CACHE_PATH"),
+                         (spotify.SpotifyAuthManager, "BACKOFF"),
+                         (remote_sync, "SYNC_BACKOFF"),
+                         (RfidReader, "FIND_BACKOFF")):
+        monkeypatch.setattr(module, name, getattr(module, name))
+
+    def load_dotenv():
+        monkeypatch.setenv("PLAYER_RETRY_DEADLINE", "99")
+        monkeypatch.setenv("SPOTIFY_AUTH_RETRY_ATTEMPTS", "7")
+        monkeypatch.setenv("SYNC_RETRY_MAX", "42")
+        monkeypatch.setenv("RFID_FIND_RETRY_FIRST", "3")
+        monkeypatch.setenv("SPOTIFY_TOKEN_CACHE", "/data/token.json")
+
+    with patch("main.load_dotenv", side_effect=load_dotenv), \
+            patch.object(utils, "verify_env_file",
+                         side_effect=ValueError("stop here")):
+        assert RFIDMusicPlayer().initialize() is False
+
+    assert utils.PLAYER_BACKOFF.deadline == 99
+    assert spotify.SpotifyAuthManager.BACKOFF.max_attempts == 7
+    assert remote_sync.SYNC_BACKOFF.max_delay == 42
+    assert RfidReader.FIND_BACKOFF.first == 3
+    assert spotify.TOKEN_CACHE_PATH == "/data/token.json"
+
+
+def test_startup_keeps_one_auth_manager_with_a_live_refresher(
+        tmp_path, monkeypatch):
+    """The warm-up and the refresher must end up on the same manager"""
+    import spotify
+    monkeypatch.delenv("SPOTIFY_DEVICE_ID")  # no device probe at warm-up
+    monkeypatch.setenv("SPOTIFY_TOKEN_CACHE", str(tmp_path / "token.json"))
+    monkeypatch.setattr(spotify, "TOKEN_CACHE_PATH",
+                        spotify.TOKEN_CACHE_PATH)
+    monkeypatch.setattr(spotify.SpotifyAuthManager, "BACKOFF",
+                        spotify.SpotifyAuthManager.BACKOFF)
+    built = []
+    build = spotify.SpotifyAuthManager.__init__
+
+    def slow_build(manager):
+        # Wide enough a window for both threads to find no manager yet.
+        time.sleep(0.05)
+        build(manager)
+        built.append(manager)
+
+    def grant(manager):
+        manager.token, manager.expiry = "fresh", time.time() + 3600
+
+    monkeypatch.setattr(spotify.SpotifyAuthManager, "__init__", slow_build)
+    monkeypatch.setattr(spotify.SpotifyAuthManager, "_refresh_token", grant)
+    monkeypatch.setattr(spotify, "_auth_manager", None)
+
+    app = RFIDMusicPlayer()
+    with patch("main.load_dotenv"), patch("main.utils"), \
+            patch("main.sound_engine"), \
+            patch("main.logging.basicConfig"), \
+            patch("main.logging.FileHandler"):
+        assert app.initialize()
+        assert app.warm_up_done.wait(timeout=2)
+
+    manager = spotify._auth_manager
+    try:
+        assert built == [manager]
+        assert manager._refresher.is_alive()
+        assert manager.token == "fresh"
+    finally:
+        manager.stop_refresher()
+
+
 def _sounds(mock_utils):
     return [call.args[0] for call in mock_utils.play_sound.call_args_list]
 
@@ -36,6 +115,15 @@ def test_unknown_card_plays_error(app):
     assert _sounds(mock_utils) == ["error"]
 
 
+def test_unknown_card_makes_sync_poll_eagerly(app):
+    """It is most likely being registered on the web right now"""
+    app.sync = MagicMock(spec=SyncScheduler)
+    with patch("main.utils") as mock_utils, patch("main.led", None):
+        mock_utils.get_music_data.return_value = None
+        app.handle_rfid_scan("unknown")
+    app.sync.expect_new_card.assert_called_once()
+
+
 def test_failed_player_creation_is_audible(app):
     """create_player returns None without raising once retries are spent
 
@@ -118,6 +206,7 @@ def test_previous_player_state_saved_before_switching(app):
 def test_sync_is_scheduled_not_run_once(app, monkeypatch):
     """sync_db runs once; a new card then waits for a service restart"""
     monkeypatch.setenv("ENABLE_SYNC", "true")
+    monkeypatch.delenv("SYNC_PUSH", raising=False)
     app.database_url = "/tmp/x.db"
 
     with patch("main.schedule_sync") as mock_schedule:
@@ -125,6 +214,17 @@ def test_sync_is_scheduled_not_run_once(app, monkeypatch):
 
     mock_schedule.assert_called_once()
     assert mock_schedule.call_args.kwargs["interval"] == app.SYNC_INTERVAL
+    assert mock_schedule.call_args.kwargs["push"] is False
+
+
+def test_sync_push_is_opt_in(app, monkeypatch):
+    monkeypatch.setenv("ENABLE_SYNC", "true")
+    monkeypatch.setenv("SYNC_PUSH", "true")
+    with patch("main.schedule_sync") as mock_schedule:
+        app.setup_sync()
+    assert mock_schedule.call_args.kwargs["push"] is True
+    assert (mock_schedule.call_args.kwargs["push_interval"]
+            == app.SYNC_PUSH_INTERVAL)
 
 
 def test_sync_not_scheduled_when_disabled(app, monkeypatch):
@@ -148,6 +248,20 @@ def test_idle_triggers_shutdown(app):
         mock_utils.shutdown.assert_called_once()
 
 
+def test_sync_pauses_before_idle_shutdown_and_resumes_on_activity(app):
+    app.sync = MagicMock(spec=SyncScheduler)
+    app.idle_time = 3600
+    app.last_activity = 0
+    with patch("main.utils"):
+        app.check_idle(now=3600 - app.SYNC_IDLE_PAUSE + 1)
+        app.sync.pause.assert_called_once()
+        app.sync.resume.assert_not_called()
+
+        app.last_activity = 3500
+        app.check_idle(now=3600)
+    app.sync.resume.assert_called_once()
+
+
 def test_recent_activity_does_not_shut_down(app):
     app.idle_time = 10
     app.last_activity = 995
@@ -200,3 +314,12 @@ def test_idle_without_a_card_is_not_activity(app):
         app.record_playback_activity()
 
     assert app.last_activity == 0
+
+
+def test_warm_up_hook_records_completion(app):
+    assert not app.warm_up_done.is_set()
+
+    app.on_warm_up(True, 1.25)
+
+    assert app.warm_up_done.is_set()
+    assert app.warm_up_seconds == 1.25
@@ -0,0 +1,232 @@
+"""The MPD client against a stand-in server speaking the real protocol"""
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from mpd_client import MpdClient, MpdError, MpdWatcher, quote
+
+
+class StubMpd:
+    """Accepts connections and answers like MPD, recording every line
+
+    `drop_after` closes each connection after that many commands, the way
+    MPD's connection_timeout drops an idle client. `stall` delays the answer
+    to `next` by that many seconds. `idle` blocks until a test
+    calls change().
+    """
+
+    def __init__(self, drop_after=None, stall=None):
+        self.stall = stall
+        self.lines = []
+        self.status = {"state": "play", "song": "2", "elapsed": "12.5"}
+        self.changes = queue.Queue()
+        self.connections = 0
+        self.drop_after = drop_after
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._handle, args=(conn,),
+                             daemon=True).start()
+
+    def _handle(self, conn):
+        with conn, conn.makefile("r") as reader:
+            conn.sendall(b"OK MPD 0.23.5\n")
+            served = 0
+            in_list = False
+            for line in reader:
+                line = line.rstrip("\n")
+                self.lines.append(line)
+                if line == "command_list_begin":
+                    in_list = True
+                    continue
+                if in_list and line != "command_list_end":
+                    continue
+                in_list = False
+                if line.startswith("add \"missing"):
+                    conn.sendall(b"ACK [50@0] {add} No such directory\n")
+                elif line == "status":
+                    reply = "".join(f"{key}: {value}\n"
+                                    for key, value in self.status.items())
+                    conn.sendall((reply + "OK\n").encode())
+                elif line == "next" and self.stall:
+                    # Acts on it, but answers too late for the client.
+                    time.sleep(self.stall)
+                    conn.sendall(b"OK\n")
+                elif line.startswith("idle"):
+                    subsystem = self.changes.get()
+                    if subsystem is None:
+                        return
+                    conn.sendall(f"changed: {subsystem}\nOK\n".encode())
+                else:
+                    conn.sendall(b"OK\n")
+                served += 1
+                if self.drop_after and served >= self.drop_after:
+                    return
+
+    def change(self, subsystem="player", **status):
+        """Update the status, and wake a client waiting in idle"""
+        self.status.update(status)
+        self.changes.put(subsystem)
+
+    def close(self):
+        self.changes.put(None)
+        self.server.close()
+
+
+@pytest.fixture
+def server():
+    stub = StubMpd()
+    yield stub
+    stub.close()
+
+
+def test_status_is_parsed(server):
+    client = MpdClient("127.0.0.1", server.port)
+    assert client.status() == {"state": "play", "song": "2", "elapsed": "12.5"}
+
+
+def test_one_connection_serves_every_command(server):
+    client = MpdClient("127.0.0.1", server.port)
+    for _ in range(5):
+        client.command("pause", 1)
+    assert server.connections == 1
+
+
+def test_a_command_list_is_sent_as_one_batch(server):
+    client = MpdClient("127.0.0.1", server.port)
+    client.command_list([("clear",), ("add", "Some Album"), ("seek", 0, 0)])
+    assert server.lines == ["command_list_begin", "clear",
+                            'add "Some Album"', 'seek "0" "0"',
+                            "command_list_end"]
+
+
+def test_a_refusal_raises(server):
+    client = MpdClient("127.0.0.1", server.port)
+    with pytest.raises(MpdError, match="No such directory"):
+        client.command("add", "missing album")
+    # And the connection is still usable afterwards.
+    assert client.status()["state"] == "play"
+
+
+def test_reconnects_after_mpd_drops_the_connection():
+    stub = StubMpd(drop_after=1)
+    try:
+        client = MpdClient("127.0.0.1", stub.port)
+        client.command("pause", 1)
+        assert client.status()["state"] == "play"
+        assert stub.connections == 2
+    finally:
+        stub.close()
+
+
+def test_a_command_that_timed_out_is_not_sent_again():
+    """MPD may have acted on it: a second `next` would skip two tracks"""
+    stub = StubMpd(stall=0.5)
+    try:
+        client = MpdClient("127.0.0.1", stub.port, timeout=0.1)
+        with pytest.raises(MpdError):
+            client.command("next")
+        assert stub.lines.count("next") == 1
+        assert stub.connections == 1
+    finally:
+        stub.close()
+
+
+def test_an_unreachable_mpd_raises_mpd_error():
+    with socket.socket() as placeholder:
+        placeholder.bind(("127.0.0.1", 0))
+        port = placeholder.getsockname()[1]
+    with pytest.raises(MpdError):
+        MpdClient("127.0.0.1", port).status()
+
+
+def test_quoting_survives_quotes_and_backslashes():
+    assert quote('a "b" \\c') == '"a \\"b\\" \\\\c"'
+
+
+def test_password_comes_from_mpd_host(monkeypatch):
+    monkeypatch.setenv("MPD_HOST", "secret@mpd.local")
+    client = MpdClient()
+    assert (client.password, client.host) == ("secret", "mpd.local")
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Listener:
+    def __init__(self):
+        self.calls = []
+
+    def changed(self, previous, current):
+        self.calls.append((previous.get("state"), current.get("state")))
+
+
+def test_watcher_follows_changes_without_polling(server):
+    watcher = MpdWatcher("127.0.0.1", server.port)
+    listener = Listener()
+    watcher.subscribe(listener.changed)
+    watcher.start()
+    try:
+        wait_for(lambda: watcher.snapshot() is not None)
+        server.change(state="pause", elapsed="30.0")
+        wait_for(lambda: watcher.snapshot()["state"] == "pause")
+        assert watcher.snapshot()["elapsed"] == "30.0"
+        assert listener.calls == [(None, "play"), ("play", "pause")]
+        # One status per change, and nothing in between.
+        assert server.lines.count("status") == 2
+    finally:
+        watcher.stop()
+
+
+def test_snapshot_extrapolates_elapsed_while_playing(server):
+    watcher = MpdWatcher("127.0.0.1", server.port)
+    watcher.start()
+    try:
+        wait_for(lambda: watcher.snapshot() is not None)
+        time.sleep(0.1)
+        assert float(watcher.snapshot()["elapsed"]) > 12.5
+    finally:
+        watcher.stop()
+
+
+def test_a_dropped_subscriber_is_forgotten(server):
+    watcher = MpdWatcher("127.0.0.1", server.port)
+    listener = Listener()
+    watcher.subscribe(listener.changed)
+    del listener
+    watcher.start()
+    try:
+        wait_for(lambda: watcher.snapshot() is not None)
+        assert watcher._subscribers == []
+    finally:
+        watcher.stop()
+
+
+def test_stop_wakes_the_watcher_out_of_idle(server):
+    watcher = MpdWatcher("127.0.0.1", server.port)
+    watcher.start()
+    wait_for(lambda: watcher.snapshot() is not None)
+    watcher.stop()
+    assert not watcher._thread.is_alive()
+    assert watcher.snapshot() is None
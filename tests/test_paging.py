@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import paging
+
+
+class FakeListing:
+    """A paging object of `total` items, slower to answer early offsets"""
+
+    def __init__(self, total, limit=50, with_total=True):
+        self.total = total
+        self.limit = limit
+        self.with_total = with_total
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_at_once = 0
+        self.offsets = []
+
+    def get_page(self, offset):
+        with self.lock:
+            self.offsets.append(offset)
+            self.running += 1
+            self.most_at_once = max(self.most_at_once, self.running)
+        # Later pages finish first, so order has to be restored.
+        time.sleep(0.02 * max(0, 5 - offset // self.limit))
+        with self.lock:
+            self.running -= 1
+        end = min(offset + self.limit, self.total)
+        page = {"items": list(range(offset, end)),
+                "next": "more" if end < self.total else None}
+        if self.with_total:
+            page["total"] = self.total
+        return page
+
+    def items(self, pages):
+        return [item for page in pages for item in page["items"]]
+
+
+def test_pages_come_back_in_order_however_they_finish():
+    listing = FakeListing(420)
+    pages = paging.fetch_pages(listing.get_page, 50)
+    assert listing.items(pages) == list(range(420))
+
+
+def test_the_rest_are_fetched_together_but_boundedly():
+    listing = FakeListing(1000)
+    paging.fetch_pages(listing.get_page, 50, max_parallel=3)
+    assert listing.offsets[0] == 0
+    assert sorted(listing.offsets) == list(range(0, 1000, 50))
+    assert listing.most_at_once == 3
+
+
+def test_a_single_page_is_one_request():
+    listing = FakeListing(20)
+    assert listing.items(paging.fetch_pages(listing.get_page, 50)) == \
+        list(range(20))
+    assert listing.offsets == [0]
+
+
+def test_without_a_total_next_is_followed():
+    listing = FakeListing(120, with_total=False)
+    pages = paging.fetch_pages(listing.get_page, 50)
+    assert listing.items(pages) == list(range(120))
+    assert listing.most_at_once == 1
+
+
+def test_a_failing_page_fails_the_whole_listing():
+    def get_page(offset):
+        if offset == 100:
+            raise ValueError("page 3 broke")
+        return {"items": [], "total": 200}
+
+    with pytest.raises(ValueError, match="page 3"):
+        paging.fetch_pages(get_page, 50)
@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 
@@ -175,3 +176,30 @@ class TestSeriesRegistration:
             location, title = reg.choose_spotify_series(None)
         assert location == "spotify:playlist:pl1"
         assert title is None
+
+
+def _listing(body, status=200):
+    response = MagicMock(status_code=status, text=body)
+    response.__enter__.return_value = response
+    response.iter_content.side_effect = lambda size: (
+        body.encode()[i:i + size] for i in range(0, len(body), size))
+    return response
+
+
+def test_listing_is_read_from_the_stream(capsys):
+    body = json.dumps([{"rfid": "a1", "title": "Folge 1", "source": "spotify",
+                        "location": "spotify:album:x",
+                        "last_modified": "2026-08-19"}])
+    with patch("register_rfid.requests.get",
+               return_value=_listing(body)) as get:
+        reg.list_registered_rfids("https://api", {})
+
+    assert get.call_args.kwargs["stream"] is True
+    out = capsys.readouterr().out
+    assert "a1" in out and "Folge 1" in out
+
+
+def test_empty_listing(capsys):
+    with patch("register_rfid.requests.get", return_value=_listing("[]")):
+        reg.list_registered_rfids("https://api", {})
+    assert "No registered RFID codes found." in capsys.readouterr().out
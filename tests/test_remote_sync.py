@@ -1,13 +1,20 @@
+import gzip
+import http.server
+import json
 import os
 import sqlite3
 import sys
+import threading
+import time
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import pytest
 from unittest.mock import patch
 
+import database
 import db_setup
+from backoff import Backoff
 import remote_sync
 
 
@@ -52,12 +59,20 @@ def cards(db_path):
         return {r["rfid"]: dict(r) for r in db.execute("SELECT * FROM music")}
 
 
+def uploaded(post):
+    """The items of the last upload, decompressed if need be"""
+    body = post.call_args.kwargs["data"]
+    if post.call_args.kwargs["headers"].get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
 def run_sync(db_path, remote_items, upload_status=200):
     """Run one sync attempt with the network stubbed out."""
     with patch("remote_sync.fetch_remote_items", return_value=remote_items), \
-            patch("remote_sync.requests.post") as post:
+            patch("remote_sync.session.post") as post:
         post.return_value.status_code = upload_status
-        remote_sync.sync_db(db_path, retries=1)
+        remote_sync.sync_db(db_path, backoff=Backoff(max_attempts=1))
         return post
 
 
@@ -117,8 +132,7 @@ def test_untouched_local_cards_are_not_re_uploaded(db_path):
 
     post = run_sync(db_path, [])
 
-    uploaded = [item["rfid"] for item in post.call_args.kwargs["json"]]
-    assert uploaded == ["ccc"]
+    assert [item["rfid"] for item in uploaded(post)] == ["ccc"]
 
 
 def test_new_local_card_is_uploaded(db_path):
@@ -128,7 +142,7 @@ def test_new_local_card_is_uploaded(db_path):
     post = run_sync(db_path, [])
 
     assert post.call_count == 1
-    assert post.call_args.kwargs["json"][0]["rfid"] == "ccc"
+    assert uploaded(post)[0]["rfid"] == "ccc"
 
 
 def test_first_sync_with_no_last_sync_inserts_everything(db_path):
@@ -156,7 +170,482 @@ def test_failure_reason_reaches_the_error_log(db_path, caplog):
     """Otherwise a stuck device reports nothing actionable at all"""
     with patch("remote_sync.fetch_remote_items",
                side_effect=RuntimeError("boom")):
-        remote_sync.sync_db(db_path, retries=1)
+        remote_sync.sync_db(db_path, backoff=Backoff(max_attempts=1))
 
     assert "boom" in caplog.text
     assert "RuntimeError" in caplog.text
+
+
+class TestSession:
+    def test_requests_get_a_timeout(self):
+        with patch("requests.Session.request") as request:
+            remote_sync.SyncSession().get("https://example.invalid/music")
+        assert request.call_args.kwargs["timeout"] == \
+            remote_sync.SyncSession.TIMEOUT
+
+    def test_responses_are_asked_for_gzipped(self):
+        assert remote_sync.SyncSession().headers["Accept-Encoding"] == "gzip"
+
+    def test_a_large_upload_is_gzipped(self):
+        session = remote_sync.SyncSession()
+        items = [remote_card(str(n), NEW) for n in range(50)]
+        with patch.object(session, "post") as post:
+            post.return_value.status_code = 200
+            session.post_json("https://example.invalid/music/sync", items)
+        assert uploaded(post) == items
+        assert post.call_args.kwargs["headers"]["Content-Encoding"] == "gzip"
+
+    def test_a_small_upload_is_sent_as_is(self):
+        session = remote_sync.SyncSession()
+        with patch.object(session, "post") as post:
+            session.post_json("https://example.invalid/music/sync",
+                              [remote_card("a", NEW)])
+        assert "Content-Encoding" not in post.call_args.kwargs["headers"]
+
+    def test_a_server_refusing_gzip_gets_it_plain_from_then_on(self):
+        session = remote_sync.SyncSession()
+        items = [remote_card(str(n), NEW) for n in range(50)]
+        with patch.object(session, "post") as post:
+            post.return_value.status_code = 415
+            session.post_json("https://example.invalid/music/sync", items)
+            assert post.call_count == 2
+            assert uploaded(post) == items
+            assert "Content-Encoding" not in post.call_args.kwargs["headers"]
+
+            session.post_json("https://example.invalid/music/sync", items)
+            assert post.call_count == 3
+        assert not session.gzip_uploads
+
+
+class StubSyncApi:
+    """A local stand-in for the sync API that honours If-None-Match
+
+    The ETag is a version of the whole collection, as the real API's is, so
+    it does not depend on `since`. Records every request and how many body
+    bytes each response carried.
+
+    With `events`, GET /music/events is a server-sent event stream that gets
+    one event per change(); without, it is a 404, as on an API that cannot
+    push.
+    """
+
+    def __init__(self, items=(), events=False):
+        self.items = list(items)
+        self.version = 1
+        self.requests = []
+        self.uploads = []
+        self.events = events
+        self.listening = threading.Condition()
+        self.listeners = 0
+        self.closing = False
+        self.connections = 0
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith("/music/events"):
+                    return self._stream()
+                etag = f'"v{stub.version}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self._reply(304, b"", etag)
+                else:
+                    self._reply(200, json.dumps(stub.items).encode(), etag)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                stub.uploads.append(json.loads(body))
+                self._reply(200, b"{}", None)
+
+            def _stream(self):
+                if not stub.events:
+                    return self._reply(404, b"", None)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                self.wfile.write(b": connected\n\n")
+                self.wfile.flush()
+                stub.requests.append(("GET", 200, "events"))
+                with stub.listening:
+                    stub.listeners += 1
+                    stub.connections += 1
+                    stub.listening.notify_all()
+                    seen = stub.version
+                    connection = stub.connections
+                    while not stub.closing and connection == stub.connections:
+                        stub.listening.wait()
+                        if stub.version == seen:
+                            continue
+                        seen = stub.version
+                        self.wfile.write(
+                            f"event: changed\ndata: {seen}\n\n".encode())
+                        self.wfile.flush()
+                    stub.listeners -= 1
+
+            def _reply(self, status, body, etag):
+                # Recorded first: once the body is out, the client may send
+                # its next request, and that must not be recorded before this.
+                stub.requests.append((self.command, status, len(body)))
+                self.send_response(status)
+                if etag:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                      Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,),
+                         daemon=True).start()
+
+    def change(self, items):
+        with self.listening:
+            self.items = list(items)
+            self.version += 1
+            self.listening.notify_all()
+
+    def wait_for_listener(self, connections=1, timeout=5):
+        with self.listening:
+            return self.listening.wait_for(
+                lambda: self.listeners and self.connections >= connections,
+                timeout)
+
+    def drop(self):
+        """End the open event stream, as a flaky network would"""
+        with self.listening:
+            self.connections += 1
+            self.listening.notify_all()
+
+    def close(self):
+        with self.listening:
+            self.closing = True
+            self.listening.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestConditionalPolling:
+    @pytest.fixture
+    def api(self, db_path, monkeypatch):
+        stub = StubSyncApi([remote_card("aaa", NEW)])
+        monkeypatch.setenv("SYNC_API_URL", stub.url)
+        yield stub
+        stub.close()
+
+    def sync(self, db_path):
+        remote_sync.sync_db(db_path, backoff=Backoff(max_attempts=1))
+
+    def test_an_unchanged_poll_costs_one_empty_response_and_two_queries(
+            self, db_path, api):
+        self.sync(db_path)
+        assert set(cards(db_path)) == {"aaa"}
+
+        stats = database.get(db_path).stats()
+        self.sync(db_path)
+        after = database.get(db_path).stats()
+
+        assert api.requests[-1] == ("GET", 304, 0)
+        # Reading sync_meta and the indexed local delta - no table scan.
+        assert after["queries"] - stats["queries"] == 2
+
+    def test_a_change_on_the_server_is_still_picked_up(self, db_path, api):
+        self.sync(db_path)
+        api.change([remote_card("bbb", NEW)])
+        self.sync(db_path)
+        assert api.requests[-1][:2] == ("GET", 200)
+        assert set(cards(db_path)) == {"aaa", "bbb"}
+
+    def test_local_changes_are_uploaded_even_when_the_server_has_none(
+            self, db_path, api):
+        self.sync(db_path)
+        add_card(db_path, "ccc", "2999-01-01 00:00:00", title="new here")
+        self.sync(db_path)
+        assert api.requests[-2][:2] == ("GET", 304)
+        assert [item["rfid"] for item in api.uploads[-1]] == ["ccc"]
+
+    def test_the_validators_survive_a_sync_that_moves_last_sync(
+            self, db_path, api):
+        self.sync(db_path)
+        with sqlite3.connect(db_path) as db:
+            etag, last_sync = db.execute(
+                "SELECT etag, last_sync FROM sync_meta").fetchone()
+        assert etag == '"v1"'
+        assert last_sync is not None
+
+
+class TestLargeLibrary:
+    """The merge should cost what the delta costs, not what the library does
+
+    Measured in SQLite VM steps rather than seconds, so that a slow CI box
+    cannot fail it and a fast one cannot hide a table scan.
+    """
+
+    DELTA = [remote_card("card00007", NEW, title="edited remotely"),
+             remote_card("card00042", OLD, title="stale edit"),
+             remote_card("brand-new-1", NEW),
+             remote_card("brand-new-2", NEW)]
+
+    def seed(self, db_path, count):
+        with sqlite3.connect(db_path) as db:
+            db.executemany(
+                "INSERT INTO music (rfid, source, location, title,"
+                " last_modified) VALUES (?, 'spotify', ?, 'local', ?)",
+                [(f"card{i:05}", f"spotify:album:{i}", LAST_SYNC)
+                 for i in range(count)])
+        set_last_sync(db_path, LAST_SYNC)
+
+    def steps_to_sync(self, db_path):
+        steps = [0]
+
+        def count():
+            steps[0] += 1
+
+        db = database.connect(db_path)
+        db.set_progress_handler(count, 1)
+        try:
+            run_sync(db_path, self.DELTA)
+        finally:
+            db.set_progress_handler(None, 1)
+        return steps[0]
+
+    def test_a_small_delta_against_10k_cards_merges_correctly(self, db_path):
+        self.seed(db_path, 10_000)
+        run_sync(db_path, self.DELTA)
+
+        merged = cards(db_path)
+        assert len(merged) == 10_002
+        assert merged["card00007"]["title"] == "edited remotely"
+        assert merged["card00042"]["title"] == "local"
+        assert merged["brand-new-1"]["title"] == "remote"
+
+    def test_the_merge_does_not_grow_with_the_library(self, tmp_path,
+                                                      monkeypatch):
+        monkeypatch.setenv("SYNC_API_URL", "https://example.invalid")
+        monkeypatch.setenv("SYNC_API_TOKEN", "token")
+        steps = {}
+        for count in (100, 10_000):
+            path = str(tmp_path / f"{count}.db")
+            db_setup.create_db(path)
+            self.seed(path, count)
+            steps[count] = self.steps_to_sync(path)
+
+        # Reading every row of 10k cards would take hundreds of thousands of
+        # steps; the indexed merge takes a few more for a deeper B-tree.
+        assert steps[10_000] < 2 * steps[100]
+
+
+def test_read_events_skips_keep_alives_and_joins_data_lines():
+    lines = [": keep-alive", "", "event: changed", "data: a", "data: b", "",
+             "data: plain", "id: 7", "", "retry: 1000", ""]
+    assert list(remote_sync.read_events(lines)) == [
+        ("changed", "a\nb"), ("message", "plain")]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestPush:
+    QUICK = Backoff(first=0.01, max_delay=0.01)
+
+    @pytest.fixture
+    def api(self, db_path, monkeypatch):
+        stub = StubSyncApi([remote_card("aaa", NEW)], events=True)
+        monkeypatch.setenv("SYNC_API_URL", stub.url)
+        yield stub
+        stub.close()
+
+    @pytest.fixture
+    def listen(self):
+        streams = []
+
+        def listen(api, on_change):
+            stream = remote_sync.SyncStream(api.url, {}, on_change,
+                                            backoff=self.QUICK)
+            result = []
+            thread = threading.Thread(
+                target=lambda: result.append(stream.run()), daemon=True)
+            thread.start()
+            streams.append((stream, thread))
+            return stream, thread, result
+
+        yield listen
+        # They notice once the api fixture hangs up on them.
+        for stream, thread in streams:
+            stream.stop()
+
+    def test_a_change_is_synced_as_soon_as_it_is_announced(self, db_path,
+                                                           api):
+        # Polling an hour apart: only the push can bring "bbb" in time.
+        scheduler = remote_sync.schedule_sync(
+            db_path, backoff=Backoff(max_attempts=1), interval=3600,
+            push=True, push_interval=3600)
+        try:
+            assert api.wait_for_listener()
+            assert wait_until(lambda: "aaa" in cards(db_path))
+
+            api.change([remote_card("bbb", NEW)])
+            assert wait_until(lambda: "bbb" in cards(db_path), timeout=2)
+        finally:
+            scheduler.stop()
+
+    def test_every_event_and_every_connect_is_reported(self, api, listen):
+        changes = []
+        stream, _, _ = listen(api, lambda: changes.append(1))
+        assert api.wait_for_listener()
+        assert stream.connected.wait(timeout=2)
+        api.change([remote_card("bbb", NEW)])
+        assert wait_until(lambda: len(changes) == 2)
+
+    def test_a_dropped_stream_is_reopened(self, api, listen):
+        changes = []
+        listen(api, lambda: changes.append(1))
+        assert api.wait_for_listener()
+        api.drop()
+        assert api.wait_for_listener(connections=3)
+        # Whatever happened while it was down went unannounced: resync.
+        assert wait_until(lambda: len(changes) >= 2)
+
+    def test_a_server_that_cannot_push_leaves_polling_to_it(self, api,
+                                                            listen):
+        api.events = False
+        stream, thread, result = listen(api, lambda: None)
+        thread.join(timeout=2)
+        assert result == [False]
+        assert not stream.connected.is_set()
+
+
+class TestStreaming:
+    @pytest.fixture
+    def api(self, db_path, monkeypatch):
+        stub = StubSyncApi([remote_card(f"card{i:04}", NEW)
+                            for i in range(1200)])
+        monkeypatch.setenv("SYNC_API_URL", stub.url)
+        yield stub
+        stub.close()
+
+    def test_rows_come_back_as_they_are_decoded_not_as_a_list(self, api):
+        items = remote_sync.fetch_remote_items(api.url, {}, None)
+        assert not isinstance(items, list)
+        assert next(items)["rfid"] == "card0000"
+        assert len(list(items)) == 1199
+
+    def test_a_first_sync_is_merged_in_bounded_batches(self, db_path, api,
+                                                       monkeypatch):
+        monkeypatch.setattr(remote_sync, "MERGE_BATCH", 500)
+        merge = remote_sync.merge_remote_items
+        batches = []
+
+        def recording(cursor, items):
+            batches.append(len(items))
+            return merge(cursor, items)
+
+        monkeypatch.setattr(remote_sync, "merge_remote_items", recording)
+        remote_sync.sync_db(db_path, backoff=Backoff(max_attempts=1))
+
+        assert batches == [500, 500, 200]
+        assert len(cards(db_path)) == 1200
+
+    def test_the_write_lock_is_free_while_the_body_downloads(
+            self, db_path, monkeypatch):
+        monkeypatch.setattr(remote_sync, "MERGE_BATCH", 2)
+        writes = []
+
+        def download():
+            yield remote_card("card0001", NEW)
+            yield remote_card("card0002", NEW)
+            # The first batch is merged by now; a scan saving its card
+            # must not have to wait for the rest of the body.
+            with sqlite3.connect(db_path, timeout=0) as other:
+                other.execute("UPDATE music SET playback_state = 'saved'"
+                              " WHERE rfid = 'card0001'")
+            writes.append("saved")
+            yield remote_card("card0003", NEW)
+
+        run_sync(db_path, download())
+        assert writes == ["saved"]
+        assert len(cards(db_path)) == 3
+        assert cards(db_path)["card0001"]["playback_state"] == "saved"
+
+    def test_a_local_edit_newer_than_the_streamed_row_is_uploaded(
+            self, db_path, api):
+        add_card(db_path, "card0007", "2999-01-01 00:00:00", title="mine")
+        remote_sync.sync_db(db_path, backoff=Backoff(max_attempts=1))
+        assert [item["rfid"] for item in api.uploads[-1]] == ["card0007"]
+        assert cards(db_path)["card0007"]["title"] == "mine"
+
+
+class TestScheduler:
+    @pytest.fixture
+    def scheduler(self):
+        return remote_sync.SyncScheduler("unused.db", interval=60)
+
+    def test_waits_the_interval_when_all_is_well(self, scheduler):
+        assert scheduler.next_delay() == 60
+
+    def test_backs_off_while_syncs_keep_failing(self, scheduler):
+        delays = []
+        for failures in (1, 2, 3, 10):
+            scheduler.failures = failures
+            delays.append(scheduler.next_delay())
+        # Jittered by up to a fifth either way.
+        assert 48 <= delays[0] <= 72
+        assert 96 <= delays[1] <= 144
+        assert 192 <= delays[2] <= 288
+        assert delays[3] <= 1.2 * scheduler.MAX_FAILURE_DELAY
+
+    def test_polls_eagerly_for_a_while_after_an_unknown_card(self,
+                                                             scheduler):
+        scheduler.expect_new_card()
+        assert scheduler.next_delay() == scheduler.EAGER_INTERVAL
+        later = time.monotonic() + scheduler.EAGER_FOR + 1
+        assert scheduler.next_delay(now=later) == 60
+
+    def test_an_outage_is_not_polled_eagerly(self, scheduler):
+        scheduler.expect_new_card()
+        scheduler.failures = 3
+        assert scheduler.next_delay() > scheduler.EAGER_INTERVAL
+
+    def test_sync_now_cuts_the_wait_and_pausing_holds_it(self, monkeypatch):
+        runs = []
+        ran = threading.Condition()
+
+        def fake_sync(*args):
+            with ran:
+                runs.append(args)
+                ran.notify_all()
+            return False
+
+        def wait_for_runs(count, timeout=2):
+            with ran:
+                return ran.wait_for(lambda: len(runs) >= count, timeout)
+
+        monkeypatch.setattr(remote_sync, "sync_db", fake_sync)
+        scheduler = remote_sync.SyncScheduler("unused.db",
+                                              interval=3600).start()
+        assert wait_for_runs(1)
+        assert scheduler.failures == 1
+
+        scheduler.sync_now()
+        assert wait_for_runs(2)
+        assert scheduler.failures == 2
+
+        scheduler.pause()
+        scheduler.sync_now()
+        assert not wait_for_runs(3, timeout=0.2)
+        scheduler.resume()
+        assert wait_for_runs(3)
+
+        scheduler.stop()
+        scheduler.sync_now()
+        assert not wait_for_runs(4, timeout=0.2)
@@ -42,7 +42,7 @@ def test_waits_for_a_device_that_appears_late(monkeypatch):
 
     with patch("rfid.list_devices", side_effect=sweeps), \
             patch("rfid.InputDevice", return_value=dev), \
-            patch("rfid.time.sleep") as mock_sleep:
+            patch("backoff.time.sleep") as mock_sleep:
         reader = RfidReader()
 
     assert reader.device is dev
@@ -53,12 +53,12 @@ def test_gives_up_after_retries(monkeypatch):
     monkeypatch.setenv("RFID_READER", "SYC ID&IC")
 
     with patch("rfid.list_devices", return_value=[]), \
-            patch("rfid.time.sleep") as mock_sleep:
+            patch("backoff.time.sleep") as mock_sleep:
         with pytest.raises(FileNotFoundError, match="SYC ID&IC"):
             RfidReader()
 
-    # Retries FIND_RETRIES times, sleeping between but not after the last.
-    assert mock_sleep.call_count == RfidReader.FIND_RETRIES - 1
+    # Sleeps between attempts but not after the last.
+    assert mock_sleep.call_count == RfidReader.FIND_BACKOFF.max_attempts - 1
 
 
 def test_non_matching_devices_are_closed(monkeypatch):
@@ -50,7 +50,7 @@ class TestEpisodeMap:
         with patch.object(spotify.SpotifySeriesPlayer, "_load_episodes",
                           return_value=[]):
             player = spotify.SpotifySeriesPlayer("rfid1", None, PLAYLIST)
-        with patch("spotify.requests.get", side_effect=pages):
+        with patch("spotify.session.get", side_effect=pages):
             return player._fetch_episodes()
 
     def test_consecutive_tracks_of_one_album_are_one_episode(self):
@@ -82,11 +82,123 @@ class TestEpisodeMap:
         assert [e["uri"] for e in episodes] == ["spotify:album:a",
                                                 "spotify:album:b"]
 
+    def test_pages_fetched_together_are_grouped_in_playlist_order(self):
+        """An album run straddling a page boundary is still one episode"""
+        limit = spotify.SpotifyPlayer.PAGE_LIMIT
+        tracks = ([_track("a")] * (limit + 2) + [_track("b")] * limit
+                  + [_track("c")])
+
+        def get(url, headers=None, params=None):
+            offset = params["offset"]
+            response = _page(tracks[offset:offset + limit])
+            response.json.return_value["total"] = len(tracks)
+            return response
+
+        with patch.object(spotify.SpotifySeriesPlayer, "_load_episodes",
+                          return_value=[]):
+            player = spotify.SpotifySeriesPlayer("rfid1", None, PLAYLIST)
+        with patch("spotify.session.get", side_effect=get) as mock_get:
+            episodes = player._fetch_episodes()
+
+        assert mock_get.call_count == 3
+        assert [(e["uri"], len(e["durations"])) for e in episodes] == [
+            ("spotify:album:a", limit + 2), ("spotify:album:b", limit),
+            ("spotify:album:c", 1)]
+
     def test_durations_are_recorded_for_finished_detection(self):
         episodes = self._fetch([_page([_track("a", duration=1234)])])
         assert episodes[0]["durations"] == [1234]
 
 
+class TestCachedEpisodeMap:
+    """A cached map plays at once; the snapshot is checked behind it"""
+
+    @pytest.fixture(autouse=True)
+    def cache(self, tmp_path, monkeypatch):
+        import utils
+        monkeypatch.setattr(utils, "SERIES_CACHE_PATH",
+                            str(tmp_path / "series_cache"))
+        monkeypatch.setattr(spotify.SpotifySeriesPlayer, "_validated_at", {})
+        utils.write_series_cache("series1", "snap1", EPISODES)
+
+    def build(self, snapshot, episodes=None, state=None):
+        release = threading.Event()
+        answered = threading.Event()
+
+        def snapshot_check(player):
+            # Held until the test has looked at the freshly built player,
+            # which a scan waiting on it would therefore never get to.
+            release.wait(timeout=0.5)
+            answered.set()
+            return snapshot
+
+        with patch.object(spotify.SpotifySeriesPlayer, "_playlist_snapshot",
+                          autospec=True, side_effect=snapshot_check), \
+                patch.object(spotify.SpotifySeriesPlayer, "_fetch_episodes",
+                             return_value=episodes or []):
+            player = spotify.SpotifySeriesPlayer(
+                "rfid1", json.dumps(state) if state else None, PLAYLIST)
+            built_before_checking = not answered.is_set()
+            release.set()
+            if player.revalidation:
+                player.revalidation.join(timeout=2)
+        return player, built_before_checking
+
+    def test_the_scan_does_not_wait_for_the_snapshot(self):
+        player, built_before_checking = self.build("snap1")
+        assert built_before_checking
+        assert player.episodes == EPISODES
+
+    def test_a_changed_playlist_is_swapped_in_behind_playback(self):
+        new_first = {"uri": "spotify:album:ep0", "title": "Folge 0",
+                     "durations": [1000]}
+        player, _ = self.build("snap2", episodes=[new_first] + EPISODES,
+                               state={"episode": 1})
+        assert player.episodes[0] == new_first
+        # Still Folge 2, now one further down the list.
+        assert player.current_episode()["uri"] == "spotify:album:ep2"
+        assert player.episode_index == 2
+
+        import utils
+        assert utils.read_series_cache("series1")["snapshot_id"] == "snap2"
+
+    def test_a_shorter_map_never_meets_the_old_index(self):
+        player = make_player(state={"episode": 2})
+        seen = []
+
+        def read_current():
+            seen.append(player.current_episode())
+
+        with player.episodes_lock:
+            # A reader arriving mid-swap waits for the swap to finish.
+            reader = threading.Thread(target=read_current)
+            reader.start()
+            reader.join(timeout=0.1)
+            assert reader.is_alive()
+            player._swap_episodes(EPISODES[:1])
+        reader.join(timeout=2)
+
+        assert seen == [EPISODES[0]]
+        assert player.episode_index == 0
+
+    def test_a_recently_checked_map_is_not_checked_again(self):
+        first, _ = self.build("snap1")
+        assert first.revalidation is not None
+        second, _ = self.build("snap1")
+        assert second.revalidation is None
+
+    def test_without_a_cached_map_the_scan_waits_for_the_playlist(
+            self, tmp_path, monkeypatch):
+        import utils
+        monkeypatch.setattr(utils, "SERIES_CACHE_PATH",
+                            str(tmp_path / "empty"))
+        player, built_before_checking = self.build("snap1",
+                                                   episodes=EPISODES[:1])
+        assert not built_before_checking
+        assert player.revalidation is None
+        assert player.episodes == EPISODES[:1]
+
+
 # --- where we are in the series ---------------------------------------------
 
 class TestEpisodePosition:
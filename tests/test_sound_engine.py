@@ -0,0 +1,156 @@
+"""The sound engine, with a pipe standing in for aplay"""
+import array
+import os
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from unittest.mock import patch
+
+import alsa_pcm
+from sound_engine import SoundEngine, decode, mix
+
+
+def write_wav(path, samples, rate=44100, channels=1):
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(array.array("h", samples).tobytes())
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """An engine over two short clips, 'writing' to a file instead of ALSA"""
+    folder = tmp_path / "sounds"
+    folder.mkdir()
+    write_wav(folder / "click.wav", [1000] * 441)
+    # Long enough to still be playing when a test starts another clip.
+    write_wav(folder / "beep.wav", [2000] * 22050)
+    output = tmp_path / "out.raw"
+    sink = ("import shutil, sys; "
+            f"shutil.copyfileobj(sys.stdin.buffer, open({str(output)!r}, 'wb'))")
+    engine = SoundEngine(str(folder), command=[sys.executable, "-c", sink])
+    engine.output = output
+    yield engine
+    engine.close()
+
+
+def played(engine):
+    engine.close()
+    samples = array.array("h")
+    samples.frombytes(engine.output.read_bytes())
+    return samples
+
+
+def test_every_clip_is_loaded_up_front(engine):
+    assert sorted(engine.clips) == ["beep", "click"]
+
+
+def test_decode_converts_rate_and_channels(tmp_path):
+    path = tmp_path / "stereo.wav"
+    # 24kHz stereo, left and right averaging to 300.
+    write_wav(path, [200, 400] * 2400, rate=24000, channels=2)
+    samples = decode(str(path), 44100)
+    assert len(samples) == 4410
+    assert set(samples) == {300}
+
+
+def test_mix_sums_and_clips():
+    assert list(mix([[30000, 5, 7], [30000, -5]], 3)) == [32767, 0, 7]
+
+
+def test_a_blocking_play_returns_once_written_out(engine):
+    engine.play("click", blocking=True)
+    assert engine._voices == []
+    assert list(played(engine)) == [1000] * 441
+
+
+def test_overlapping_clips_share_one_stream(engine):
+    engine.play("beep")
+    engine.play("click", blocking=True)
+    stream = engine._stream
+    engine.play("click", blocking=True)
+    assert engine._stream is stream
+    samples = played(engine)
+    # The beep runs throughout; the clicks landed on top of it.
+    assert 3000 in samples
+    assert len(samples) < 22050 + 2 * 441
+
+
+def test_an_unknown_clip_is_reported_not_raised(engine, caplog):
+    engine.play("missing", blocking=True)
+    assert "No sound loaded" in caplog.text
+
+
+class FakePcm:
+    """Stands in for alsa_pcm.AlsaPcm, shared or not as a test says"""
+
+    SHARED = True
+    opened = []
+
+    def __init__(self, rate, device="default", latency=50000):
+        self.device = device
+        self.shared = self.SHARED
+        self.samples = array.array("h")
+        self.closed = False
+        FakePcm.opened.append(self)
+
+    def write(self, samples):
+        self.samples.extend(samples)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pcm_engine(tmp_path, monkeypatch):
+    folder = tmp_path / "sounds"
+    folder.mkdir()
+    write_wav(folder / "click.wav", [1000] * 441)
+    FakePcm.opened = []
+    monkeypatch.setattr(alsa_pcm, "AlsaPcm", FakePcm)
+    engine = SoundEngine(str(folder))
+    engine.IDLE_RELEASE = 0.05
+    yield engine
+    engine.close()
+
+
+def wait_for_idle(engine):
+    for _ in range(100):
+        with engine.lock:
+            if engine._thread is None:
+                return
+        time.sleep(0.01)
+    raise AssertionError("the mixer thread never went idle")
+
+
+def test_a_shared_device_is_held_open_between_presses(pcm_engine):
+    pcm_engine.play("click", blocking=True)
+    wait_for_idle(pcm_engine)
+    pcm_engine.play("click", blocking=True)
+
+    assert len(FakePcm.opened) == 1
+    assert not FakePcm.opened[0].closed
+    assert list(FakePcm.opened[0].samples) == [1000] * 882
+
+
+def test_a_device_that_is_not_shared_is_released_when_idle(pcm_engine,
+                                                           monkeypatch):
+    monkeypatch.setattr(FakePcm, "SHARED", False)
+    pcm_engine.play("click", blocking=True)
+    wait_for_idle(pcm_engine)
+
+    assert FakePcm.opened[0].closed
+    assert pcm_engine._stream is None
+
+
+def test_without_libasound_aplay_plays_instead(tmp_path):
+    engine = SoundEngine(str(tmp_path))
+    with patch("alsa_pcm.ctypes.util.find_library", return_value=None), \
+            patch("sound_engine._AplayStream") as aplay:
+        engine._open_stream()
+    assert aplay.call_args.args[0][0] == "aplay"
@@ -6,6 +6,7 @@ from unittest.mock import patch, MagicMock
 import json
 import sqlite3
 import time
+import threading
 
 import requests
 
@@ -73,7 +74,7 @@ def test_spotify_auth_manager_get_token_success(monkeypatch):
             "expires_in": 3600
         }
         mock_response.raise_for_status.return_value = None
-        with patch('spotify.requests.post', return_value=mock_response):
+        with patch('spotify.session.post', return_value=mock_response):
             token = auth_manager.get_token()
             assert token == "new_token"
 
@@ -87,12 +88,12 @@ def test_spotify_auth_manager_token_refresh_failure(monkeypatch):
         auth_manager = SpotifyAuthManager()
         
         # Mock only the post method with the correct exception type
-        with patch('spotify.requests.post', side_effect=requests.RequestException("Network error")), \
-                patch('spotify.time.sleep') as mock_sleep:
+        with patch('spotify.session.post', side_effect=requests.RequestException("Network error")), \
+                patch('backoff.time.sleep') as mock_sleep:
             token = auth_manager.get_token()
             assert token is None
             # Backoff is exercised, but not actually waited through.
-            assert mock_sleep.call_count == auth_manager.RETRIES - 1
+            assert mock_sleep.call_count == auth_manager.BACKOFF.max_attempts - 1
 
 # --- SpotifyPlayer tests ---
 def test_spotify_player_init_success(monkeypatch):
@@ -142,7 +143,7 @@ def test_spotify_player_transfer_playback_success(monkeypatch):
         # Mock only the put method
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
-        with patch('spotify.requests.put', return_value=mock_response):
+        with patch('spotify.session.put', return_value=mock_response):
             result = player.transfer_playback(play=False)
             assert result is True
 
@@ -156,7 +157,7 @@ def test_spotify_player_transfer_playback_failure(monkeypatch):
         player = SpotifyPlayer("rfid123", None, "spotify:album:123")
         
         # Mock only the put method with the correct exception type
-        with patch('spotify.requests.put', side_effect=requests.RequestException("Network error")):
+        with patch('spotify.session.put', side_effect=requests.RequestException("Network error")):
             result = player.transfer_playback(play=False)
             assert result is False
 
@@ -200,7 +201,7 @@ def test_spotify_player_play_success(monkeypatch):
         # Mock only the put method
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
-        with patch('spotify.requests.put', return_value=mock_response), \
+        with patch('spotify.session.put', return_value=mock_response), \
              patch('spotify.utils.play_sound'):
             player.play()
             assert player.playing is True
@@ -217,7 +218,7 @@ def test_spotify_player_play_failure(monkeypatch):
         player = SpotifyPlayer("rfid123", None, "spotify:album:123")
         
         # Mock only the put method with the correct exception type
-        with patch('spotify.requests.put', side_effect=requests.RequestException("Network error")), \
+        with patch('spotify.session.put', side_effect=requests.RequestException("Network error")), \
              patch('spotify.utils.play_sound') as mock_sound:
             player.play()
             mock_sound.assert_called_with("playback_error")
@@ -235,7 +236,7 @@ def test_spotify_player_toggle_playback_playing_to_pause(monkeypatch):
         # Mock only the put method
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
-        with patch('spotify.requests.put', return_value=mock_response):
+        with patch('spotify.session.put', return_value=mock_response):
             player.toggle_playback()
             assert player.playing is False
 
@@ -252,7 +253,7 @@ def test_spotify_player_toggle_playback_paused_to_resume(monkeypatch):
         # Mock only the put method
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
-        with patch('spotify.requests.put', return_value=mock_response):
+        with patch('spotify.session.put', return_value=mock_response):
             player.toggle_playback()
             assert player.playing is True
 
@@ -281,8 +282,8 @@ def test_spotify_player_next_track_success(monkeypatch):
         # too - our device, playing our album.
         status = _playback_status("test_device", "spotify:album:123")
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=status), \
-                patch('spotify.requests.post') as mock_post:
+                patch('spotify.session.get', return_value=status), \
+                patch('spotify.session.post') as mock_post:
             player.next_track()
             mock_post.assert_called_once()
             assert player.playing
@@ -299,9 +300,9 @@ def test_spotify_player_next_track_reclaims_when_not_ours(monkeypatch):
 
         status = _playback_status("other_device", "spotify:album:999")
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=status), \
-                patch('spotify.requests.put') as mock_put, \
-                patch('spotify.requests.post') as mock_post:
+                patch('spotify.session.get', return_value=status), \
+                patch('spotify.session.put') as mock_put, \
+                patch('spotify.session.post') as mock_post:
             player.next_track()
             # No skip issued against the foreign session ...
             mock_post.assert_not_called()
@@ -322,8 +323,8 @@ def test_spotify_player_toggle_does_not_inherit_foreign_content(monkeypatch):
         status = _playback_status(
             "test_device", "spotify:show:podcast", is_playing=False)
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=status), \
-                patch('spotify.requests.put') as mock_put:
+                patch('spotify.session.get', return_value=status), \
+                patch('spotify.session.put') as mock_put:
             player.toggle_playback()
             # play() with our context, never a context-less resume.
             mock_put.assert_called_once()
@@ -359,7 +360,7 @@ def test_spotify_player_tracks_position_while_playing(monkeypatch):
         status.json.return_value["item"] = {"uri": "spotify:track:x",
                                             "track_number": 2}
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=status):
+                patch('spotify.session.get', return_value=status):
             player.check_playback_status()
 
         assert player.playback_state == {
@@ -380,14 +381,14 @@ def test_spotify_player_reclaim_uses_fresh_position(monkeypatch):
         ours.json.return_value["item"] = {"uri": "spotify:track:x",
                                           "track_number": 2}
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=ours):
+                patch('spotify.session.get', return_value=ours):
             player.refresh_playback_state()
 
         # A phone then takes the session and plays a standalone track.
         foreign = _playback_status("phone", None)
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=foreign), \
-                patch('spotify.requests.put') as mock_put:
+                patch('spotify.session.get', return_value=foreign), \
+                patch('spotify.session.put') as mock_put:
             player.toggle_playback()
 
         sent = mock_put.call_args.kwargs["json"]
@@ -407,7 +408,7 @@ def test_save_playback_state_falls_back_when_not_ours(monkeypatch):
         # A phone has taken the session and plays something else.
         foreign = _playback_status("phone", "spotify:album:999")
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=foreign), \
+                patch('spotify.session.get', return_value=foreign), \
                 patch("spotify.utils.persist_playback_state") as mock_persist:
             player.save_playback_state()
 
@@ -430,7 +431,7 @@ def test_refresh_playback_state_skips_unchanged(monkeypatch):
         status.json.return_value["item"] = {"uri": "spotify:track:x",
                                             "track_number": 1}
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=status), \
+                patch('spotify.session.get', return_value=status), \
                 patch("spotify.utils.persist_playback_state") as mock_persist:
             assert player.refresh_playback_state() is True   # first: changed
             assert player.refresh_playback_state() is False  # second: identical
@@ -455,8 +456,8 @@ def test_invalid_grant_is_not_retried(monkeypatch):
         am = SpotifyAuthManager()
         resp = _token_error(400, '{"error":"invalid_grant",'
                                  '"error_description":"Refresh token revoked"}')
-        with patch('spotify.requests.post', return_value=resp) as mock_post, \
-                patch('spotify.time.sleep') as mock_sleep:
+        with patch('spotify.session.post', return_value=resp) as mock_post, \
+                patch('backoff.time.sleep') as mock_sleep:
             assert am.get_token() is None
             mock_post.assert_called_once()      # not three times
             mock_sleep.assert_not_called()      # and no backoff
@@ -468,11 +469,11 @@ def test_transient_failure_is_still_retried(monkeypatch):
     with patch.dict('sys.modules', {'utils': MagicMock()}):
         from spotify import SpotifyAuthManager
         am = SpotifyAuthManager()
-        with patch('spotify.requests.post',
+        with patch('spotify.session.post',
                    side_effect=requests.RequestException("boom")) as mock_post, \
-                patch('spotify.time.sleep'):
+                patch('backoff.time.sleep'):
             assert am.get_token() is None
-            assert mock_post.call_count == am.RETRIES
+            assert mock_post.call_count == am.BACKOFF.max_attempts
 
 def test_missing_token_raises_instead_of_bearer_none(monkeypatch):
     """No token must not produce an 'Authorization: Bearer None' request"""
@@ -487,7 +488,7 @@ def test_missing_token_raises_instead_of_bearer_none(monkeypatch):
                 player._get_headers()
 
             # And it is handled, not crashing, by the normal call paths.
-            with patch('spotify.requests.get') as mock_get:
+            with patch('spotify.session.get') as mock_get:
                 assert player.check_playback_status() is None
                 mock_get.assert_not_called()
 
@@ -500,7 +501,7 @@ def test_rejected_credentials_are_not_re_requested(monkeypatch):
         from spotify import SpotifyAuthManager
         am = SpotifyAuthManager()
         resp = _token_error(400, '{"error":"invalid_grant"}')
-        with patch('spotify.requests.post', return_value=resp) as mock_post:
+        with patch('spotify.session.post', return_value=resp) as mock_post:
             for _ in range(10):
                 assert am.get_token() is None
             mock_post.assert_called_once()
@@ -513,7 +514,7 @@ def test_cooldown_expires_and_recovery_clears_it(monkeypatch):
         from spotify import SpotifyAuthManager
         am = SpotifyAuthManager()
         bad = _token_error(400, '{"error":"invalid_grant"}')
-        with patch('spotify.requests.post', return_value=bad):
+        with patch('spotify.session.post', return_value=bad):
             assert am.get_token() is None
         assert am.rejected_at
 
@@ -523,7 +524,7 @@ def test_cooldown_expires_and_recovery_clears_it(monkeypatch):
         good.status_code = 200
         good.json.return_value = {"access_token": "fresh", "expires_in": 3600}
         good.raise_for_status.return_value = None
-        with patch('spotify.requests.post', return_value=good):
+        with patch('spotify.session.post', return_value=good):
             assert am.get_token() == "fresh"
         assert am.rejected_at == 0
 
@@ -541,7 +542,7 @@ def test_single_disc_album_offset_needs_no_request(monkeypatch):
         from spotify import SpotifyPlayer
         p = SpotifyPlayer("rfid123", None, "spotify:album:abc")
         with patch.object(p.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get') as mock_get:
+                patch('spotify.session.get') as mock_get:
             item = {"track_number": 5, "disc_number": 1}
             assert p._album_offset("abc", item, "spotify:track:x") == 4
             mock_get.assert_not_called()
@@ -556,7 +557,7 @@ def test_multi_disc_album_resolves_true_offset(monkeypatch):
         tracks = [{"uri": "spotify:track:a"}, {"uri": "spotify:track:b"},
                   {"uri": "spotify:track:c"}, {"uri": "spotify:track:want"}]
         with patch.object(p.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=_page(tracks)):
+                patch('spotify.session.get', return_value=_page(tracks)):
             item = {"track_number": 1, "disc_number": 2}
             assert p._album_offset("abc", item, "spotify:track:want") == 3
 
@@ -572,7 +573,8 @@ def test_playlist_offset_is_absolute_across_pages(monkeypatch):
         page2 = _page([{"track": {"uri": "spotify:track:other"}},
                        {"track": {"uri": "spotify:track:want"}}])
         with patch.object(p.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', side_effect=[page1, page2]) as mock_get:
+                patch.object(p, "_playlist_snapshot_id", return_value=None), \
+                patch('spotify.session.get', side_effect=[page1, page2]) as mock_get:
             # Second entry of the second page -> limit + 1, not 1.
             assert p._get_track_position_in_playlist(
                 "abc", "spotify:track:want") == limit + 1
@@ -586,9 +588,247 @@ def test_missing_track_falls_back_to_zero(monkeypatch):
         from spotify import SpotifyPlayer
         p = SpotifyPlayer("rfid123", None, "spotify:playlist:abc")
         with patch.object(p.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=_page([])):
+                patch('spotify.session.get', return_value=_page([])):
             assert p._get_track_position_in_playlist("abc", "nope") == 0
 
+class TestTrackIndexCache:
+    """Offsets come from a cached listing while the context is unchanged"""
+
+    TRACKS = [{"track": {"uri": "spotify:track:%d" % i}} for i in range(120)]
+
+    @pytest.fixture
+    def player(self):
+        from spotify import SpotifyPlayer
+        return SpotifyPlayer("rfid123", None, "spotify:playlist:abc")
+
+    def _listing(self, tracks):
+        limit = 50
+        pages = [tracks[i:i + limit] for i in range(0, len(tracks), limit)]
+        return [_page(page, has_next=i < len(pages) - 1)
+                for i, page in enumerate(pages)]
+
+    def test_an_unchanged_playlist_costs_only_its_snapshot(self, player):
+        with patch.object(player, "_playlist_snapshot_id",
+                          return_value="snap1"), \
+                patch('spotify.session.get',
+                      side_effect=self._listing(self.TRACKS)) as mock_get:
+            assert player._get_track_position_in_playlist(
+                "abc", "spotify:track:110") == 110
+            assert mock_get.call_count == 3
+
+            assert player._get_track_position_in_playlist(
+                "abc", "spotify:track:7") == 7
+            assert mock_get.call_count == 3
+
+    def test_an_edited_playlist_is_listed_again(self, player):
+        moved = [self.TRACKS[-1]] + self.TRACKS[:-1]
+        with patch.object(player, "_playlist_snapshot_id",
+                          side_effect=["snap1", "snap2"]), \
+                patch('spotify.session.get',
+                      side_effect=self._listing(self.TRACKS)
+                      + self._listing(moved)):
+            assert player._get_track_position_in_playlist(
+                "abc", "spotify:track:119") == 119
+            assert player._get_track_position_in_playlist(
+                "abc", "spotify:track:119") == 0
+
+    def test_an_album_is_listed_once_and_for_all(self, player):
+        tracks = [{"uri": "spotify:track:a"}, {"uri": "spotify:track:b"}]
+        with patch('spotify.session.get',
+                   return_value=_page(tracks)) as mock_get:
+            assert player._get_track_position_in_album(
+                "alb", "spotify:track:b") == 1
+            assert player._get_track_position_in_album(
+                "alb", "spotify:track:a") == 0
+        assert mock_get.call_count == 1
+
+    def test_a_cached_listing_beats_none_when_spotify_is_down(self, player):
+        import utils
+        utils.write_track_index("spotify:playlist:abc", "snap1",
+                                ["spotify:track:x", "spotify:track:y"])
+        with patch.object(player, "_playlist_snapshot_id",
+                          return_value=None), \
+                patch('spotify.session.get',
+                      side_effect=requests.ConnectionError("offline")):
+            assert player._get_track_position_in_playlist(
+                "abc", "spotify:track:y") == 1
+
+
+def _spotify_fields(value, fields):
+    """`value` as Spotify answers it for a `fields` filter
+
+    The filter names the keys to keep, with a parenthesised list for what to
+    keep inside an object, or inside each object of a list:
+    "items(track(uri)),total".
+    """
+    def parse(position):
+        tree = {}
+        while position < len(fields) and fields[position] != ")":
+            name = ""
+            while position < len(fields) and fields[position] not in ",()":
+                name += fields[position]
+                position += 1
+            tree[name] = None
+            if position < len(fields) and fields[position] == "(":
+                tree[name], position = parse(position + 1)
+                position += 1  # the closing parenthesis
+            if position < len(fields) and fields[position] == ",":
+                position += 1
+        return tree, position
+
+    def keep(value, tree):
+        if tree is None:
+            return value
+        if isinstance(value, list):
+            return [keep(item, tree) for item in value]
+        if isinstance(value, dict):
+            return {key: keep(value[key], sub)
+                    for key, sub in tree.items() if key in value}
+        return value
+
+    return keep(value, parse(0)[0])
+
+
+def test_the_fields_stand_in_filters_like_spotify():
+    page = {"items": [{"added_at": "x", "track": {"uri": "u", "id": "i"}},
+                      {"track": None}],
+            "total": 2, "href": "h"}
+    assert _spotify_fields(page, "items(track(uri)),total") == {
+        "items": [{"track": {"uri": "u"}}, {"track": None}], "total": 2}
+
+
+class TestTrimmedPayloads:
+    """Playlist listings ask for only the fields they read
+
+    Measured in bytes on the wire and in JSON values decoded rather than
+    seconds: decoding time follows both, and neither depends on how busy
+    the machine running the tests is. Pages are full playlist entries as
+    Spotify sends them, trimmed here as Spotify would for `fields`.
+    """
+
+    MARKETS = ["AD", "AE", "AG", "AL", "AM", "AO", "AR", "AT", "AU", "AZ",
+               "BA", "BB", "BD", "BE", "BF", "BG", "BH", "BI", "BJ", "BN",
+               "BO", "BR", "BS", "BT", "BW", "BY", "BZ", "CA", "CD", "CG",
+               "CH", "CI", "CL", "CM", "CO", "CR", "CV", "CW", "CY", "CZ",
+               "DE", "DJ", "DK", "DM", "DO", "DZ", "EC", "EE", "EG", "ES"] * 3
+
+    def _entry(self, number):
+        album_id = f"album{number // 10}"
+        artist = {"external_urls": {"spotify": "https://open.spotify.com/"
+                                               "artist/artist1"},
+                  "href": "https://api.spotify.com/v1/artists/artist1",
+                  "id": "artist1", "name": "Erzähler", "type": "artist",
+                  "uri": "spotify:artist:artist1"}
+        album = {"album_type": "album", "artists": [artist],
+                 "available_markets": self.MARKETS,
+                 "external_urls": {"spotify": "https://open.spotify.com/"
+                                              f"album/{album_id}"},
+                 "href": f"https://api.spotify.com/v1/albums/{album_id}",
+                 "id": album_id,
+                 "images": [{"height": size, "width": size,
+                             "url": f"https://i.scdn.co/image/{album_id}"
+                                    f"{size}"}
+                            for size in (640, 300, 64)],
+                 "name": f"Folge {number // 10}", "release_date": "2019-03-01",
+                 "release_date_precision": "day", "total_tracks": 10,
+                 "type": "album", "uri": f"spotify:album:{album_id}"}
+        track = {"album": album, "artists": [artist],
+                 "available_markets": self.MARKETS, "disc_number": 1,
+                 "duration_ms": 180000 + number, "episode": False,
+                 "explicit": False,
+                 "external_ids": {"isrc": f"DEA611900{number:03}"},
+                 "external_urls": {"spotify": "https://open.spotify.com/"
+                                              f"track/track{number}"},
+                 "href": f"https://api.spotify.com/v1/tracks/track{number}",
+                 "id": f"track{number}", "is_local": False,
+                 "name": f"Kapitel {number}", "popularity": 31,
+                 "preview_url": None, "track": True,
+                 "track_number": number % 10 + 1, "type": "track",
+                 "uri": f"spotify:track:track{number}"}
+        return {"added_at": "2023-01-01T00:00:00Z",
+                "added_by": {"id": "parent", "type": "user",
+                             "uri": "spotify:user:parent"},
+                "is_local": False, "primary_color": None, "track": track,
+                "video_thumbnail": {"url": None}}
+
+    def serve(self, count):
+        """A stub session.get over `count` entries, and what it served"""
+        entries = [self._entry(number) for number in range(count)]
+        served = {"bytes": 0, "values": 0}
+
+        def values(value):
+            if isinstance(value, dict):
+                return 1 + sum(values(item) for item in value.values())
+            if isinstance(value, list):
+                return 1 + sum(values(item) for item in value)
+            return 1
+
+        def get(url, headers=None, params=None):
+            offset, limit = params["offset"], params["limit"]
+            page = {"href": url, "limit": limit, "offset": offset,
+                    "items": entries[offset:offset + limit],
+                    "next": (f"{url}?offset={offset + limit}"
+                             if offset + limit < count else None),
+                    "previous": None, "total": count}
+            if "fields" in params:
+                page = _spotify_fields(page, params["fields"])
+            body = json.dumps(page).encode()
+            served["bytes"] += len(body)
+            served["values"] += values(page)
+            response = MagicMock(status_code=200)
+            response.raise_for_status.return_value = None
+            response.json.side_effect = lambda: json.loads(body)
+            return response
+
+        return get, served
+
+    def untrimmed(self, get):
+        def without_fields(url, headers=None, params=None):
+            return get(url, headers,
+                       {k: v for k, v in params.items() if k != "fields"})
+        return without_fields
+
+    def test_the_episode_map_is_a_fraction_of_the_full_listing(self):
+        import spotify
+        with patch.object(spotify.SpotifySeriesPlayer, "_load_episodes",
+                          return_value=[]):
+            player = spotify.SpotifySeriesPlayer(
+                "rfid1", None, "spotify:playlist:series1")
+
+        get, full = self.serve(200)
+        with patch("spotify.session.get", side_effect=self.untrimmed(get)):
+            expected = player._fetch_episodes()
+        get, trimmed = self.serve(200)
+        with patch("spotify.session.get", side_effect=get):
+            episodes = player._fetch_episodes()
+
+        assert episodes == expected
+        assert len(episodes) == 20
+        assert episodes[3]["title"] == "Folge 3"
+        assert episodes[3]["durations"][0] == 180030
+        # Three values a track instead of nearly four hundred.
+        assert trimmed["bytes"] * 20 < full["bytes"]
+        assert trimmed["values"] * 20 < full["values"]
+
+    def test_the_track_index_is_a_fraction_of_the_full_listing(self):
+        from spotify import SpotifyPlayer
+        player = SpotifyPlayer("rfid123", None, "spotify:playlist:abc")
+
+        get, full = self.serve(120)
+        with patch.object(player, "_playlist_snapshot_id", return_value=None), \
+                patch("spotify.session.get", side_effect=self.untrimmed(get)):
+            expected = player._get_track_position_in_playlist(
+                "abc", "spotify:track:track117")
+        get, trimmed = self.serve(120)
+        with patch.object(player, "_playlist_snapshot_id", return_value=None), \
+                patch("spotify.session.get", side_effect=get):
+            position = player._get_track_position_in_playlist(
+                "abc", "spotify:track:track117")
+
+        assert position == expected == 117
+        assert trimmed["bytes"] * 40 < full["bytes"]
+        assert trimmed["values"] * 40 < full["values"]
+
 # --- refresh token expiry warning ---
 def test_token_age_unknown_without_auth_date(monkeypatch, caplog):
     """A missing date is unknown, never treated as expired"""
@@ -650,7 +890,7 @@ def test_restart_failure_is_audible(monkeypatch):
 
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
                 patch("spotify.utils", fake_utils), \
-                patch('spotify.requests.put',
+                patch('spotify.session.put',
                       side_effect=requests.RequestException("404")):
             player.restart_playback()
 
@@ -665,7 +905,7 @@ def test_resume_failure_is_audible(monkeypatch):
 
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
                 patch("spotify.utils", fake_utils), \
-                patch('spotify.requests.put',
+                patch('spotify.session.put',
                       side_effect=requests.RequestException("boom")):
             player.resume_playback()
 
@@ -740,7 +980,7 @@ def test_device_is_playing_true_for_our_device(monkeypatch):
     monkeypatch.setenv("SPOTIFY_DEVICE_ID", "ours")
     import spotify
     with patch.object(spotify, "get_auth_manager") as am, \
-            patch("spotify.requests.get", return_value=_player_response("ours", True)):
+            patch("spotify.session.get", return_value=_player_response("ours", True)):
         am.return_value.get_token.return_value = "tok"
         assert spotify.device_is_playing() is True
 
@@ -749,7 +989,7 @@ def test_device_is_playing_false_when_another_device_plays(monkeypatch):
     monkeypatch.setenv("SPOTIFY_DEVICE_ID", "ours")
     import spotify
     with patch.object(spotify, "get_auth_manager") as am, \
-            patch("spotify.requests.get", return_value=_player_response("phone", True)):
+            patch("spotify.session.get", return_value=_player_response("phone", True)):
         am.return_value.get_token.return_value = "tok"
         assert spotify.device_is_playing() is False
 
@@ -757,7 +997,7 @@ def test_device_is_playing_false_when_paused(monkeypatch):
     monkeypatch.setenv("SPOTIFY_DEVICE_ID", "ours")
     import spotify
     with patch.object(spotify, "get_auth_manager") as am, \
-            patch("spotify.requests.get", return_value=_player_response("ours", False)):
+            patch("spotify.session.get", return_value=_player_response("ours", False)):
         am.return_value.get_token.return_value = "tok"
         assert spotify.device_is_playing() is False
 
@@ -768,13 +1008,13 @@ def test_device_is_playing_fails_closed(monkeypatch):
 
     # 204: nothing playing anywhere
     with patch.object(spotify, "get_auth_manager") as am, \
-            patch("spotify.requests.get", return_value=MagicMock(status_code=204)):
+            patch("spotify.session.get", return_value=MagicMock(status_code=204)):
         am.return_value.get_token.return_value = "tok"
         assert spotify.device_is_playing() is False
 
     # network error
     with patch.object(spotify, "get_auth_manager") as am, \
-            patch("spotify.requests.get",
+            patch("spotify.session.get",
                   side_effect=requests.RequestException("down")):
         am.return_value.get_token.return_value = "tok"
         assert spotify.device_is_playing() is False
@@ -801,9 +1041,9 @@ def test_previous_restarts_the_track_when_past_the_threshold(monkeypatch):
         status.json.return_value["item"] = {"uri": "spotify:track:x",
                                             "track_number": 2}
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=status), \
-                patch('spotify.requests.put') as mock_put, \
-                patch('spotify.requests.post') as mock_post:
+                patch('spotify.session.get', return_value=status), \
+                patch('spotify.session.put') as mock_put, \
+                patch('spotify.session.post') as mock_post:
             player.previous_track()
 
         mock_post.assert_not_called()          # did not skip back
@@ -821,8 +1061,8 @@ def test_previous_skips_back_near_the_start(monkeypatch):
         status.json.return_value["item"] = {"uri": "spotify:track:x",
                                             "track_number": 2}
         with patch.object(player.auth_manager, "get_token", return_value="tok"), \
-                patch('spotify.requests.get', return_value=status), \
-                patch('spotify.requests.post') as mock_post:
+                patch('spotify.session.get', return_value=status), \
+                patch('spotify.session.post') as mock_post:
             player.previous_track()
 
         mock_post.assert_called_once()
@@ -1109,7 +1349,7 @@ class TestPositionDriftAgainstMonotonic:
         player.ensure_owns_playback = lambda action: True
         self._anchor(player, 30000)
 
-        with patch("spotify.requests.post") as post:
+        with patch("spotify.session.post") as post:
             post.return_value = MagicMock(raise_for_status=lambda: None)
             player.next_track()
 
@@ -1132,7 +1372,7 @@ class TestPositionDriftAgainstMonotonic:
         player.playback_state = {"offset": {"position": 0},
                                  "position_ms": 45000}
 
-        with patch("spotify.requests.put") as put, \
+        with patch("spotify.session.put") as put, \
                 patch("spotify.time.monotonic", return_value=2000.0):
             put.return_value = MagicMock(raise_for_status=lambda: None)
             player.play()
@@ -1178,3 +1418,292 @@ class TestSeriesCapabilityFlag:
             from spotify import SpotifySeriesPlayer
         assert SpotifySeriesPlayer.is_series is True
 
+
+
+class TestSession:
+    """Every Spotify request goes through one pooled, time-limited session"""
+
+    def test_requests_get_a_default_timeout(self):
+        import spotify
+        with patch("requests.Session.request") as request:
+            spotify.session.get("https://api.spotify.com/v1/me/player")
+        assert request.call_args.kwargs["timeout"] == spotify.SpotifySession.TIMEOUT
+
+    def test_an_explicit_timeout_wins(self):
+        import spotify
+        with patch("requests.Session.request") as request:
+            spotify.session.get("https://api.spotify.com/v1/me/player",
+                                timeout=1)
+        assert request.call_args.kwargs["timeout"] == 1
+
+    def test_the_pool_is_sized_for_our_threads(self):
+        import spotify
+        adapter = spotify.session.get_adapter("https://api.spotify.com")
+        assert adapter._pool_maxsize == spotify.SpotifySession.POOL_MAXSIZE
+
+
+class TestWarmUp:
+    """Token, connections and device are readied before the first scan"""
+
+    def _run(self, playback):
+        import spotify
+        status = MagicMock(status_code=200 if playback else 204)
+        status.json.return_value = playback
+        done = []
+        with patch("spotify.session.get", return_value=status), \
+                patch("spotify.session.put") as put:
+            spotify.warm_up(on_done=lambda *args: done.append(args)).join()
+        return put, done
+
+    def test_probes_the_device_and_reports_timing(self):
+        put, done = self._run(None)
+        assert put.call_args.kwargs["json"] == {"device_ids": ["test_device"],
+                                                "play": False}
+        [(ready, seconds)] = done
+        assert ready is True
+        assert seconds >= 0
+
+    def test_does_not_take_playback_from_another_device(self):
+        put, done = self._run({"is_playing": True,
+                               "device": {"id": "phone"}})
+        put.assert_not_called()
+        assert done[0][0] is True
+
+    def test_no_token_reports_not_ready_without_any_api_call(self):
+        import spotify
+        spotify._auth_manager.get_token.return_value = None
+        done = []
+        with patch("spotify.session.get") as get, \
+                patch("spotify.session.put") as put:
+            spotify.warm_up(on_done=lambda *args: done.append(args)).join()
+        get.assert_not_called()
+        put.assert_not_called()
+        assert done[0][0] is False
+
+
+class TestBackgroundRefresh:
+    """The token is replaced ahead of expiry, never on a user's request"""
+
+    def _manager(self):
+        with patch.dict('sys.modules', {'utils': MagicMock()}):
+            from spotify import SpotifyAuthManager
+        return SpotifyAuthManager()
+
+    @staticmethod
+    def _granted(token):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"access_token": token,
+                                      "expires_in": 3600}
+        response.raise_for_status.return_value = None
+        return response
+
+    def test_refreshes_ahead_of_expiry(self):
+        am = self._manager()
+        am.token, am.expiry = "old", time.time() + 10  # inside the lead
+        with patch('spotify.session.post',
+                   return_value=self._granted("new")) as post:
+            am.start_refresher()
+            deadline = time.time() + 2
+            while am.token != "new" and time.time() < deadline:
+                time.sleep(0.01)
+            am.stop_refresher()
+        assert am.token == "new"
+        post.assert_called_once()
+
+    def test_old_token_is_served_while_a_refresh_is_in_flight(self):
+        am = self._manager()
+        am.token, am.expiry = "old", time.time() + 10
+        release = threading.Event()
+
+        def slow_post(*args, **kwargs):
+            release.wait(2)
+            return self._granted("new")
+
+        with patch('spotify.session.post', side_effect=slow_post):
+            refresh = threading.Thread(target=am._refresh_ahead)
+            refresh.start()
+            time.sleep(0.05)
+            assert am.get_token() == "old"
+            release.set()
+            refresh.join()
+        assert am.get_token() == "new"
+
+    def test_concurrent_callers_share_one_request(self):
+        am = self._manager()
+        release = threading.Event()
+        calls = []
+
+        def slow_post(*args, **kwargs):
+            calls.append(1)
+            release.wait(2)
+            return self._granted("new")
+
+        tokens = []
+        with patch('spotify.session.post', side_effect=slow_post):
+            threads = [threading.Thread(
+                target=lambda: tokens.append(am.get_token()))
+                for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join()
+        assert len(calls) == 1
+        assert tokens == ["new"] * 5
+
+    def test_failed_refresh_keeps_a_still_valid_token(self):
+        am = self._manager()
+        am.token, am.expiry = "old", time.time() + 100
+        with patch('spotify.session.post',
+                   side_effect=requests.RequestException("down")), \
+                patch('backoff.time.sleep'):
+            am._refresh_ahead()
+        assert am.get_token() == "old"
+
+    def test_a_failed_refresh_waits_before_the_next(self):
+        from backoff import Backoff
+        am = self._manager()
+        am.token, am.expiry = "old", time.time() + 100  # inside the lead
+        am.BACKOFF = Backoff(first=0, max_attempts=1)
+        with patch('spotify.session.post',
+                   side_effect=requests.ConnectionError("down")) as post:
+            am.start_refresher()
+            time.sleep(0.3)
+            am.stop_refresher()
+        post.assert_called_once()
+        assert am.get_token() == "old"
+
+    def test_retries_ahead_of_expiry_come_before_it(self):
+        am = self._manager()
+        am.token, am.expiry = "old", time.time() + 100
+        assert 1 <= am._retry_ahead_in(1) <= am.IDLE_RETRY
+        am.expiry = time.time() + 5
+        assert am._retry_ahead_in(10) <= 5
+        am.expiry = time.time() - 5
+        assert am._retry_ahead_in(10) == 1
+
+    def test_schedule_is_jittered_before_expiry(self):
+        am = self._manager()
+        am.token, am.expiry = "tok", time.time() + 1000
+        wait = am._next_refresh_in()
+        assert (1000 - am.REFRESH_LEAD - am.REFRESH_JITTER - 1 <= wait
+                <= 1000 - am.REFRESH_LEAD)
+
+
+class TestTokenCache:
+    """A restart within the token's lifetime plays without an auth request"""
+
+    def _manager(self):
+        with patch.dict('sys.modules', {'utils': MagicMock()}):
+            from spotify import SpotifyAuthManager
+        return SpotifyAuthManager()
+
+    def _fetch(self, am, token="cached"):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"access_token": token,
+                                      "expires_in": 3600}
+        response.raise_for_status.return_value = None
+        with patch('spotify.session.post', return_value=response):
+            return am.get_token()
+
+    def test_a_restart_reuses_the_token_without_a_request(self):
+        self._fetch(self._manager())
+
+        with patch('spotify.session.post') as post:
+            assert self._manager().get_token() == "cached"
+        post.assert_not_called()
+
+    def test_the_file_is_private_to_this_user(self):
+        import spotify
+        self._fetch(self._manager())
+        assert os.stat(spotify.TOKEN_CACHE_PATH).st_mode & 0o777 == 0o600
+
+    def test_an_expired_token_is_not_reused(self):
+        am = self._manager()
+        self._fetch(am)
+        with patch('spotify.time.monotonic',
+                   return_value=time.monotonic() + 3600):
+            assert self._manager().token is None
+
+    def test_other_credentials_do_not_reuse_it(self, monkeypatch):
+        self._fetch(self._manager())
+        monkeypatch.setenv("SPOTIFY_REFRESH_TOKEN", "reauthorized")
+        assert self._manager().token is None
+
+    def test_another_boot_needs_a_synchronised_clock(self, monkeypatch,
+                                                     tmp_path):
+        import spotify
+        self._fetch(self._manager())
+        monkeypatch.setattr(spotify, "_boot_id", lambda: "another-boot")
+
+        monkeypatch.setattr(spotify, "TIMESYNC_FLAG", str(tmp_path / "none"))
+        assert self._manager().token is None
+
+        flag = tmp_path / "synchronized"
+        flag.touch()
+        monkeypatch.setattr(spotify, "TIMESYNC_FLAG", str(flag))
+        assert self._manager().token == "cached"
+
+    def test_a_corrupt_cache_is_ignored(self):
+        import spotify
+        with open(spotify.TOKEN_CACHE_PATH, "w") as cache_file:
+            cache_file.write("{not json")
+        assert self._manager().token is None
+
+
+class TestPlayAfterSkippedTransfer:
+    """play() transfers only when Spotify no longer knows the device"""
+
+    @staticmethod
+    def _rejected(status, body):
+        response = MagicMock(status_code=status)
+        response.json.return_value = body
+        error = requests.HTTPError(f"{status} Error", response=response)
+        response.raise_for_status.side_effect = error
+        return response
+
+    def _player(self):
+        import spotify
+        player = spotify.SpotifyPlayer("rfid1", None, "spotify:album:1")
+        player.skipped_transfer = True
+        return player
+
+    def test_device_not_found_transfers_and_plays_again(self):
+        player = self._player()
+        gone = self._rejected(
+            404, {"error": {"status": 404, "message": "Device not found"}})
+        ok = MagicMock(raise_for_status=lambda: None)
+
+        with patch("spotify.session.put", side_effect=[gone, ok, ok]) as put, \
+                patch.object(player, "is_ready", return_value=True), \
+                patch("spotify.utils.play_sound"):
+            player.play()
+
+        urls = [c.args[0] for c in put.call_args_list]
+        assert urls[1].endswith("/me/player")  # the transfer
+        assert "/me/player/play" in urls[2]
+        assert player.playing
+        assert not player.skipped_transfer
+
+    def test_other_failures_are_not_retried(self):
+        player = self._player()
+        bad = self._rejected(400, {"error": {"message": "Invalid context uri"}})
+
+        with patch("spotify.session.put", return_value=bad) as put, \
+                patch("spotify.utils.play_sound"):
+            player.play()
+
+        assert put.call_count == 1
+        assert not player.playing
+
+    def test_a_normally_built_player_never_transfers_from_play(self):
+        player = self._player()
+        player.skipped_transfer = False
+        gone = self._rejected(404, {"error": {"message": "Device not found"}})
+
+        with patch("spotify.session.put", return_value=gone) as put, \
+                patch("spotify.utils.play_sound"):
+            player.play()
+
+        assert put.call_count == 1
@@ -0,0 +1,82 @@
+"""Playback states written behind the caller, batched, and flushed on demand"""
+import json
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from unittest.mock import MagicMock, patch
+
+import db_setup
+import utils
+from state_writer import StateWriter
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "toem.db")
+    db_setup.create_db(path)
+    with sqlite3.connect(path) as db:
+        for rfid in ("a1", "b2"):
+            db.execute("INSERT INTO music (rfid, source, location)"
+                       " VALUES (?, 'local', 'x')", (rfid,))
+    monkeypatch.setenv("DATABASE_URL", path)
+    return path
+
+
+def stored(db_path):
+    with sqlite3.connect(db_path) as db:
+        return dict(db.execute("SELECT rfid, playback_state FROM music"))
+
+
+def test_saves_wait_for_the_writer(db_path):
+    writer = StateWriter(db_path, delay=60)
+    writer.put("a1", '{"track": 1}')
+    assert stored(db_path)["a1"] is None
+    assert writer.flush()
+    assert stored(db_path)["a1"] == '{"track": 1}'
+
+
+def test_repeated_saves_coalesce_into_one_batch(db_path):
+    writer = StateWriter(db_path, delay=60)
+    connection = MagicMock()
+    with patch("state_writer.database.connect", return_value=connection):
+        for position in range(5):
+            writer.put("a1", json.dumps({"position": position}))
+        writer.put("b2", "{}")
+        assert writer.flush()
+    connection.executemany.assert_called_once()
+    rows = connection.executemany.call_args.args[1]
+    assert sorted(rows) == [('{"position": 4}', "a1"), ("{}", "b2")]
+
+
+def test_without_a_flush_the_writer_catches_up_by_itself(db_path):
+    writer = StateWriter(db_path, delay=0.01)
+    writer.put("b2", '{"track": 2}')
+    with writer.lock:
+        assert writer.lock.wait_for(
+            lambda: not writer._pending and not writer._writing, 2)
+    assert stored(db_path)["b2"] == '{"track": 2}'
+
+
+def test_a_failed_write_is_kept_for_the_next_attempt(db_path):
+    writer = StateWriter(db_path, delay=0.01)
+    with patch("state_writer.database.connect",
+               side_effect=sqlite3.OperationalError("disk I/O error")):
+        writer.put("a1", '{"track": 3}')
+        assert not writer.flush(timeout=0.2)
+    assert writer.flush()
+    assert stored(db_path)["a1"] == '{"track": 3}'
+
+
+def test_shutdown_flushes_before_powering_off(db_path, monkeypatch):
+    monkeypatch.delenv("DEVELOPMENT", raising=False)
+    player = MagicMock()
+    player.save_playback_state.side_effect = lambda: \
+        utils.persist_playback_state("a1", {"track": 7, "position": 3})
+    with patch("utils.play_sound"), patch("os.system"), \
+            patch("logging.shutdown"):
+        utils.shutdown(player)
+    assert json.loads(stored(db_path)["a1"]) == {"track": 7, "position": 3}
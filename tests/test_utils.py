@@ -6,6 +6,7 @@ import pytest
 from unittest.mock import patch, MagicMock
 from utils import get_music_data, create_player, play_sound, save_last_played, get_last_played_rfid, handle_already_playing, shutdown, verify_env_file
 import utils
+from backoff import Backoff
 
 def setup_in_memory_db():
     db = sqlite3.connect(":memory:")
@@ -83,7 +84,7 @@ def test_create_player_spotify(monkeypatch):
         mock_import.side_effect = mock_import_func
         
         music_data = {"rfid": "xyz", "source": "spotify", "playback_state": None, "location": "spotify:track:xyz"}
-        player = create_player(music_data, retries=1)
+        player = create_player(music_data, backoff=Backoff(max_attempts=1))
         assert isinstance(player, DummySpotifyPlayer)
         assert player.rfid == "xyz"
         assert player.location == "spotify:track:xyz"
@@ -95,14 +96,16 @@ def test_create_player_unknown_source():
 
 # --- play_sound tests ---
 def test_play_sound_runs(monkeypatch):
-    with patch("subprocess.Popen") as mock_popen:
-        play_sound("start")
-        assert mock_popen.called
+    with patch("utils.sound_engine.get_engine") as get_engine:
+        play_sound("next_track")
+        get_engine.return_value.play.assert_called_once_with(
+            "click", blocking=False)
 
 def test_play_sound_blocking(monkeypatch):
-    with patch("subprocess.run") as mock_run:
+    with patch("utils.sound_engine.get_engine") as get_engine:
         play_sound("shutdown", blocking=True)
-        assert mock_run.called
+        get_engine.return_value.play.assert_called_once_with(
+            "shutdown", blocking=True)
 
 def test_play_sound_unknown_event():
     with pytest.raises(ValueError):
@@ -231,8 +234,8 @@ def test_create_player_fails_fast_on_permanent_auth_error(monkeypatch):
     music_data = {"rfid": "abc", "source": "spotify",
                   "playback_state": None, "location": "spotify:album:x"}
 
-    with patch("utils.time.sleep") as mock_sleep:
-        assert create_player(music_data, retries=10) is None
+    with patch("backoff.time.sleep") as mock_sleep:
+        assert create_player(music_data, backoff=Backoff(max_attempts=10)) is None
         # Returned on the first attempt, without waiting between retries.
         mock_sleep.assert_not_called()
 
@@ -247,9 +250,10 @@ def test_create_player_still_retries_transient_failures(monkeypatch):
     music_data = {"rfid": "abc", "source": "spotify",
                   "playback_state": None, "location": "spotify:album:x"}
 
-    with patch("utils.time.sleep") as mock_sleep:
-        assert create_player(music_data, retries=3) is None
-        assert mock_sleep.call_count == 3
+    with patch("backoff.time.sleep") as mock_sleep:
+        assert create_player(music_data, backoff=Backoff(max_attempts=3)) is None
+        # Between attempts, never after the last.
+        assert mock_sleep.call_count == 2
 
 
 def test_handle_already_playing_refreshes_before_branching():
@@ -292,10 +296,10 @@ def test_create_player_skips_readiness_check_after_failed_transfer():
     with patch.object(spotify.SpotifyPlayer, "transfer_playback", failed_transfer), \
             patch.object(spotify.SpotifyPlayer, "is_ready", counted_is_ready), \
             patch.dict(os.environ, {"SPOTIFY_DEVICE_ID": "d"}), \
-            patch("utils.time.sleep"):
+            patch("backoff.time.sleep"):
         music_data = {"rfid": "abc", "source": "spotify",
                       "playback_state": None, "location": "spotify:album:x"}
-        assert create_player(music_data, retries=3) is None
+        assert create_player(music_data, backoff=Backoff(max_attempts=3)) is None
 
     assert calls["is_ready"] == 0
 
@@ -316,7 +320,7 @@ def test_create_player_still_checks_readiness_after_successful_transfer():
             patch.dict(os.environ, {"SPOTIFY_DEVICE_ID": "d"}):
         music_data = {"rfid": "abc", "source": "spotify",
                       "playback_state": None, "location": "spotify:album:x"}
-        assert create_player(music_data, retries=3) is not None
+        assert create_player(music_data, backoff=Backoff(max_attempts=3)) is not None
 
     assert calls["is_ready"] == 1
 
@@ -337,10 +341,10 @@ def test_create_player_retries_when_the_token_is_merely_unavailable(monkeypatch)
 
     with patch.object(spotify.SpotifyPlayer, "transfer_playback", no_token_yet), \
             patch.dict(os.environ, {"SPOTIFY_DEVICE_ID": "d"}), \
-            patch("utils.time.sleep"):
+            patch("backoff.time.sleep"):
         music_data = {"rfid": "abc", "source": "spotify",
                       "playback_state": None, "location": "spotify:album:x"}
-        assert create_player(music_data, retries=6) is None
+        assert create_player(music_data, backoff=Backoff(max_attempts=6)) is None
 
     assert attempts["n"] == 6, "should use the whole budget, not abort"
 
@@ -428,3 +432,43 @@ def test_rescanning_a_paused_series_resumes_rather_than_advancing():
 
     player.toggle_playback.assert_called_once()
     player.next_episode.assert_not_called()
+
+
+class TestCreatePlayerFastPath:
+    """A recently seen device is played to directly, without a transfer"""
+
+    MUSIC = {"rfid": "abc", "source": "spotify",
+             "playback_state": None, "location": "spotify:album:x"}
+
+    def test_skips_transfer_when_the_device_was_just_seen(self, monkeypatch):
+        import spotify
+        spotify._note_active_device(True)
+        transfer = MagicMock()
+        monkeypatch.setattr(spotify.SpotifyPlayer, "transfer_playback", transfer)
+
+        player = create_player(self.MUSIC)
+
+        assert player.skipped_transfer
+        transfer.assert_not_called()
+
+    def test_a_stale_sighting_takes_the_slow_path(self, monkeypatch):
+        import spotify
+        spotify._note_active_device(True)
+        spotify._device_active_at -= spotify.ACTIVE_DEVICE_MAX_AGE + 1
+        monkeypatch.setattr(spotify.SpotifyPlayer, "transfer_playback",
+                            lambda self, play=False: True)
+        monkeypatch.setattr(spotify.SpotifyPlayer, "is_ready", lambda self: True)
+
+        assert not create_player(self.MUSIC).skipped_transfer
+
+    def test_another_device_taking_over_ends_the_fast_path(self):
+        import spotify
+        spotify._note_active_device(True)
+        player = spotify.SpotifyPlayer("abc", None, "spotify:album:x")
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"device": {"id": "phone"},
+                                      "is_playing": True}
+        with patch("spotify.session.get", return_value=response):
+            player.check_playback_status()
+
+        assert not spotify.device_recently_active()
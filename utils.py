@@ -1,10 +1,12 @@
 import json
 import logging
 import os
-import sqlite3
-import subprocess
-import time
 
+import card_index
+import file_cache
+import sound_engine
+import state_writer
+from backoff import Backoff
 from local import AudioPlayer
 
 try:
@@ -13,9 +15,34 @@ except ImportError:
     led = None
 
 
-# Where the resolved episode list for a series playlist is cached. Beside the
-# database by default, so it lives with the rest of the device's state.
-SERIES_CACHE_PATH = os.environ.get("SERIES_CACHE", "series_cache.json")
+def configure():
+    """Read this module's settings from the environment
+
+    Run at import, and again by main once .env is loaded. main imports this
+    module first, so settings made only in .env were otherwise ignored.
+    """
+    global PLAYER_BACKOFF, SERIES_CACHE_PATH, TRACK_INDEX_CACHE_PATH
+
+    # How long a scan keeps trying to get a Spotify device ready. The first
+    # retry comes quickly, since spotifyd is usually ready within a fraction
+    # of a second; one still registering after boot is asked less and less
+    # often.
+    PLAYER_BACKOFF = Backoff.from_env("PLAYER", first=0.2, max_delay=2,
+                                      deadline=15, max_attempts=15)
+
+    # Where the resolved episode list for a series playlist is cached: a
+    # directory, one file per playlist. Beside the database by default, so
+    # it lives with the rest of the device's state.
+    SERIES_CACHE_PATH = os.environ.get("SERIES_CACHE", "series_cache")
+
+    # Where the track listing of each played album or playlist is cached,
+    # for turning the current track back into an offset. A directory, as
+    # above.
+    TRACK_INDEX_CACHE_PATH = os.environ.get("TRACK_INDEX_CACHE",
+                                            "track_index_cache")
+
+
+configure()
 
 
 def read_series_cache(playlist_id):
@@ -24,12 +51,7 @@ def read_series_cache(playlist_id):
     Best-effort by design: a missing, unreadable or corrupt cache just means
     the map gets fetched again, which is slower but always correct.
     """
-    try:
-        with open(SERIES_CACHE_PATH) as cache_file:
-            return json.load(cache_file).get(playlist_id)
-    except (OSError, ValueError) as e:
-        logging.debug("No usable series cache: %s", e)
-        return None
+    return file_cache.get_cache(SERIES_CACHE_PATH).get(playlist_id)
 
 
 def write_series_cache(playlist_id, snapshot_id, episodes):
@@ -38,47 +60,59 @@ def write_series_cache(playlist_id, snapshot_id, episodes):
     Written only when the playlist actually changes, so this costs a handful
     of flash writes a year rather than one per scan.
     """
-    try:
-        try:
-            with open(SERIES_CACHE_PATH) as cache_file:
-                cache = json.load(cache_file)
-        except (OSError, ValueError):
-            cache = {}
+    file_cache.get_cache(SERIES_CACHE_PATH).put(
+        playlist_id, {"snapshot_id": snapshot_id, "episodes": episodes})
+
+
+def read_track_index(context_uri):
+    """The cached track listing for a context, or None
+
+    Best-effort like the series cache: without it the listing is fetched.
+    """
+    return file_cache.get_cache(TRACK_INDEX_CACHE_PATH).get(context_uri)
+
 
-        cache[playlist_id] = {"snapshot_id": snapshot_id, "episodes": episodes}
-        with open(SERIES_CACHE_PATH, "w") as cache_file:
-            json.dump(cache, cache_file)
-    except OSError as e:
-        # Losing the cache costs speed on the next scan, nothing else.
-        logging.warning("Could not write the series cache: %s", e)
+def write_track_index(context_uri, version, uris):
+    """Record a context's track URIs in order, keyed by its version
+
+    `version` is a playlist's snapshot_id; albums do not change, so theirs
+    is a constant. Rewritten only when a listing had to be fetched.
+    """
+    file_cache.get_cache(TRACK_INDEX_CACHE_PATH).put(
+        context_uri, {"version": version, "uris": uris})
 
 
 def persist_playback_state(rfid, playback_state):
     """Write playback state for an RFID to the database
 
-    Uses its own short-lived connection: players are created from both the
-    button callback thread and the RFID thread, and a sqlite connection may
-    only be used by the thread that created it. Committing here also means the
-    write survives shutdown, which exits without touching the shared
-    connection.
+    Queued rather than written here: state_writer batches the writes on its
+    own thread and connection, so saving costs the caller no SD card fsync.
+    Players are created from both the button callback thread and the RFID
+    thread, and a sqlite connection may only be used by the thread that
+    created it, so none of theirs could be used for this anyway. shutdown()
+    flushes the queue, so the last position survives power-off.
     """
     database_url = os.getenv("DATABASE_URL")
     if not database_url:
         raise ValueError("DATABASE_URL environment variable is not set")
 
-    db = sqlite3.connect(database_url)
-    try:
-        with db:  # commits on success, rolls back on error
-            db.execute(
-                "UPDATE music SET playback_state = ? WHERE rfid = ?",
-                (json.dumps(playback_state), rfid),
-            )
-    finally:
-        db.close()
+    state = json.dumps(playback_state)
+    state_writer.get_writer(database_url).put(rfid, state)
+    card_index.get_index().set_playback_state(rfid, state)
 
 
 def get_music_data(db, rfid):
-    """Get music data from database"""
+    """Get music data from database
+
+    Answered from the card index once main has loaded it, without touching
+    `db`; the query remains for tools that run without one.
+    """
+    index = card_index.get_index()
+    if index.loaded:
+        data = index.get(rfid)
+        logging.debug("Music data for RFID %s: %s", rfid, data)
+        return data
+
     cursor = db.cursor()
     cursor.execute("SELECT * FROM music WHERE rfid = ?", (rfid,))
     result = cursor.fetchone()
@@ -92,8 +126,13 @@ def get_music_data(db, rfid):
         return None
 
 
-def create_player(music_data, retries=10, delay=1):
-    """Create audio player instance"""
+def create_player(music_data, backoff=None):
+    """Create audio player instance
+
+    `backoff` paces the attempts to get a Spotify device ready, defaulting to
+    PLAYER_BACKOFF.
+    """
+    backoff = backoff or PLAYER_BACKOFF
     rfid = music_data["rfid"]
     source = music_data.get("source")
     playback_state = music_data.get("playback_state")
@@ -104,11 +143,28 @@ def create_player(music_data, retries=10, delay=1):
     if source in ("spotify", "spotify_series"):
         # Lazy import to avoid circular dependency
         from spotify import (SpotifyAuthError, SpotifyPlayer,
-                             SpotifySeriesPlayer)
+                             SpotifySeriesPlayer, device_recently_active)
         player_class = (SpotifySeriesPlayer if source == "spotify_series"
                         else SpotifyPlayer)
 
-        for attempt in range(retries):
+        # Fast path: the device held the session moments ago, so transferring
+        # to it and then asking whether it is ready are two round trips that
+        # change nothing, between the scan and the first sound. play() goes
+        # straight to the device and transfers only if Spotify no longer
+        # knows it.
+        if device_recently_active():
+            try:
+                player = player_class(rfid, playback_state, location)
+            except SpotifyAuthError as e:
+                logging.debug("Fast path unavailable: %s", e)
+            else:
+                player.skipped_transfer = True
+                logging.info("Device recently active; skipping the transfer")
+                return player
+
+        attempts = 0
+        for attempt in backoff.attempts():
+            attempts = attempt + 1
             try:
                 player = player_class(rfid, playback_state, location)
                 transferred = player.transfer_playback(play=False)
@@ -121,9 +177,7 @@ def create_player(music_data, retries=10, delay=1):
                 # No token *yet* - typically the network is still coming up
                 # after a boot. Keep trying; this is what the budget is for.
                 logging.warning(
-                    "No Spotify token yet (attempt %d/%d): %s",
-                    attempt + 1, retries, e)
-                time.sleep(delay)
+                    "No Spotify token yet (attempt %d): %s", attempts, e)
                 continue
             # Only ask whether it is ready if the transfer worked. When it
             # did not, the device is not there and is_ready() is a second HTTP
@@ -131,14 +185,13 @@ def create_player(music_data, retries=10, delay=1):
             # the 17.4s a failing scan took before any sound came out.
             if transferred and player.is_ready():
                 logging.info(
-                    "Spotify player ready after %d attempt(s)", attempt + 1)
+                    "Spotify player ready after %d attempt(s)", attempts)
                 return player
-            logging.warning("Spotify player not ready (attempt %d/%d), retrying in %d seconds...",
-                            attempt + 1, retries, delay)
-            time.sleep(delay)
+            logging.warning("Spotify player not ready (attempt %d)", attempts)
 
         logging.error(
-            "Failed to initialize a ready Spotify player after %d attempts", retries)
+            "Failed to initialize a ready Spotify player after %d attempts",
+            attempts)
         return None
 
     elif source == "local":
@@ -170,26 +223,10 @@ def play_sound(event, blocking=False):
     if event not in sounds:
         raise ValueError(f"Sound file for event '{event}' not found.")
 
-    sound_folder = os.path.join(os.path.dirname(
-        os.path.abspath(__file__)), "sounds")
-    file_path = os.path.join(sound_folder, f"{sounds[event]}.wav")
-
     try:
-        if blocking:
-            subprocess.run(
-                ["aplay", file_path],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL)
-        else:
-            subprocess.Popen(
-                ["aplay", file_path],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-    except FileNotFoundError:
-        logging.error("aplay is not installed or not found in PATH.")
+        sound_engine.get_engine().play(sounds[event], blocking=blocking)
     except Exception as e:
-        logging.exception(f"Failed to play audio file {file_path}: {e}")
+        logging.exception(f"Failed to play sound {sounds[event]}: {e}")
 
 
 def save_last_played(db, rfid):
@@ -251,6 +288,8 @@ def shutdown(player, sync_done=None):
     if player:
         player.pause_playback()
         player.save_playback_state()
+    # Power goes off right after this; anything still queued would be lost.
+    state_writer.flush_all()
 
     if led:
         led.turn_off_led(23)